@@ -0,0 +1,242 @@
+import json
+import os
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from brainglobe_segmentation.atlas.utils import (
+    AnnotationIndex,
+    HemisphereIndex,
+    index_annotations,
+    index_hemispheres,
+)
+from brainglobe_segmentation.image.utils import get_points_from_image
+
+ATLAS_CACHE_DIRECTORY = (
+    Path.home() / ".brainglobe" / "brainglobe-segmentation" / "atlas_cache"
+)
+CHECKSUM_CHUNK_SIZE = 2**26
+
+
+class AtlasCache:
+    """
+    On-disk cache of arrays that depend only on an atlas (e.g. the
+    relabelled annotations), so that they are computed once per atlas,
+    rather than every time a project in that atlas is opened.
+
+    Each array is saved as a .npy file (loaded memory-mapped, so only the
+    parts that are used are read), alongside a .json file of its shape,
+    dtype, checksum, and the size and modification time of the .npy file.
+    The checksum is verified once, when the array is saved. Loading only
+    compares the file size and modification time (so the array is not
+    read), and arrays that are missing, or whose file has changed since
+    it was saved, are recomputed. The cache is best-effort: if it can't be
+    written to, arrays are just computed.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory to store the arrays of this atlas in
+        """
+        self.directory = Path(directory)
+
+    @classmethod
+    def from_atlas(cls, atlas, cache_directory=ATLAS_CACHE_DIRECTORY):
+        """
+        :param atlas: brainglobe atlas class
+        :param cache_directory: Directory containing the caches of all
+        atlases
+        :return: AtlasCache for this atlas name, version and resolution
+        """
+        version = atlas.metadata.get("version", "unknown")
+        resolution = "_".join(f"{res:g}" for res in atlas.resolution)
+        return cls(
+            Path(cache_directory)
+            / f"{atlas.atlas_name}_v{version}_{resolution}um"
+        )
+
+    def get(self, name, compute):
+        """
+        :param name: Name of the array
+        :param compute: Function (with no arguments) to calculate the array,
+        if it is not in the cache
+        :return: The (possibly memory-mapped) array
+        """
+        array = self.load(name)
+        if array is None:
+            array = np.asarray(compute())
+            self.save(name, array)
+        return array
+
+    def load(self, name):
+        """
+        :param name: Name of the array
+        :return: Memory-mapped array, or None if the array is not cached (or
+        the cached array is invalid)
+        """
+        array_path = self.directory / f"{name}.npy"
+        try:
+            with open(self.directory / f"{name}.json") as info_file:
+                info = json.load(info_file)
+            if get_file_info(array_path) != [info["size"], info["mtime"]]:
+                return None
+            array = np.load(array_path, mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return None
+        if (
+            list(array.shape) != info["shape"]
+            or array.dtype.str != info["dtype"]
+        ):
+            return None
+        return array
+
+    def save(self, name, array):
+        """
+        Save an array to the cache. The array is written to a temporary file
+        first, so that an interrupted save doesn't leave a partial array, and
+        its checksum is verified before it is moved into place.
+
+        :param name: Name of the array
+        :param array: Array to save
+        """
+        array = np.ascontiguousarray(array)
+        info = {
+            "shape": list(array.shape),
+            "dtype": array.dtype.str,
+            "checksum": get_checksum(array),
+        }
+        array_path = self.directory / f"{name}.npy"
+        info_path = self.directory / f"{name}.json"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            temporary_path = array_path.with_suffix(".npy.tmp")
+            with open(temporary_path, "wb") as array_file:
+                np.save(array_file, array)
+            saved = np.load(temporary_path, mmap_mode="r")
+            saved_checksum = get_checksum(saved)
+            del saved
+            if saved_checksum != info["checksum"]:
+                os.remove(temporary_path)
+                raise OSError("the saved array does not match its checksum")
+            os.replace(temporary_path, array_path)
+            info["size"], info["mtime"] = get_file_info(array_path)
+            with open(info_path, "w") as info_file:
+                json.dump(info, info_file)
+        except OSError as error:
+            print(f"Could not save {name} to the atlas cache: {error}")
+
+
+def get_file_info(path):
+    """
+    :param path: Path to a file
+    :return: [size in bytes, modification time in nanoseconds] of the file
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get_checksum(array):
+    """
+    :param array: Contiguous numpy array
+    :return: CRC32 of the array data (calculated in chunks, so that
+    memory-mapped arrays are not read into memory at once)
+    """
+    data = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+    checksum = 0
+    for start in range(0, len(data), CHECKSUM_CHUNK_SIZE):
+        checksum = zlib.crc32(
+            data[start : start + CHECKSUM_CHUNK_SIZE], checksum
+        )
+    return checksum
+
+
+def get_annotation_index(annotations, cache=None):
+    """
+    :param annotations: Atlas annotations image
+    :param cache: AtlasCache of the atlas of the annotations (or None to
+    always compute the index)
+    :return: AnnotationIndex of the annotations, see index_annotations
+    """
+    if cache is None:
+        return index_annotations(annotations)
+    compact = cache.load("annotation_compact")
+    if compact is None:
+        annotation_index = index_annotations(annotations)
+        cache.save("structure_ids", annotation_index.structure_ids)
+        cache.save("annotation_compact", annotation_index.compact)
+        return annotation_index
+    # the relabelled image is cached, so only the atlas values are needed
+    structure_ids = cache.get(
+        "structure_ids",
+        lambda: index_annotations(annotations, relabel=False),
+    )
+    return AnnotationIndex(compact, structure_ids)
+
+
+def get_hemisphere_index(
+    hemispheres,
+    left_hemisphere_value=1,
+    right_hemisphere_value=2,
+    cache=None,
+):
+    """
+    :param hemispheres: Hemispheres image
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    :param cache: AtlasCache of the atlas of the hemispheres (or None to
+    always compute the index)
+    :return: HemisphereIndex of the hemispheres, see index_hemispheres
+    """
+    if cache is None:
+        return index_hemispheres(
+            hemispheres,
+            left_hemisphere_value=left_hemisphere_value,
+            right_hemisphere_value=right_hemisphere_value,
+        )
+    hemisphere_index = None
+
+    def compute_midline():
+        # (axis, position, left_first), or empty if not split by a plane
+        nonlocal hemisphere_index
+        hemisphere_index = index_hemispheres(
+            hemispheres,
+            left_hemisphere_value=left_hemisphere_value,
+            right_hemisphere_value=right_hemisphere_value,
+        )
+        return np.array(hemisphere_index.midline or (), dtype=np.int64)
+
+    midline = cache.get("hemisphere_midline", compute_midline)
+    if len(midline):
+        axis, position, left_first = midline.tolist()
+        return HemisphereIndex.from_midline(
+            hemispheres.shape, (axis, position, bool(left_first))
+        )
+
+    def compute_sides():
+        if hemisphere_index is None:
+            return index_hemispheres(
+                hemispheres,
+                left_hemisphere_value=left_hemisphere_value,
+                right_hemisphere_value=right_hemisphere_value,
+            ).sides
+        return hemisphere_index.sides
+
+    return HemisphereIndex(cache.get("hemisphere_sides", compute_sides))
+
+
+def get_surface_points(annotations, cache=None):
+    """
+    :param annotations: Atlas annotations image
+    :param cache: AtlasCache of the atlas of the annotations (or None to
+    always compute the points)
+    :return: (N, 3) array of the background voxels on the brain surface,
+    see create_KDTree_from_image
+    """
+
+    def compute():
+        return get_points_from_image(annotations, boundary_only=True)
+
+    if cache is None:
+        return compute()
+    return cache.get("surface_points", compute)
@@ -1,3 +1,304 @@
+import numpy as np
+import pandas as pd
+
+# Hemisphere of each voxel, as encoded in a HemisphereIndex
+LEFT_HEMISPHERE = 0
+RIGHT_HEMISPHERE = 1
+NO_HEMISPHERE = 2
+
+
+class HemisphereIndex:
+    """
+    Compact encoding of a hemispheres image, in which each voxel is 0
+    (left), 1 (right) or 2 (neither). These values can be used directly as
+    an index (e.g. in a combined structure/hemisphere bincount), so once
+    computed (e.g. once per loaded project), voxels can be assigned to a
+    hemisphere without comparing them to the hemisphere values.
+
+    If the hemispheres are split by a plane (as in atlas space), the split
+    is stored as the "midline", so that each hemisphere of an image can be
+    selected with a slice (see split), and the codes are a broadcast view
+    of a single line, rather than a full image.
+
+    Indexing returns a HemisphereIndex of the selection.
+    """
+
+    def __init__(self, sides, midline=None):
+        """
+        :param sides: Array of hemisphere codes (LEFT_HEMISPHERE,
+        RIGHT_HEMISPHERE or NO_HEMISPHERE)
+        :param midline: If the hemispheres are split by a plane, tuple
+        (axis, position, left_first). Voxels before position along axis are
+        in the left hemisphere if left_first, otherwise in the right
+        """
+        self.sides = sides
+        self.midline = midline
+
+    @classmethod
+    def from_midline(cls, shape, midline):
+        """
+        :param shape: Shape of the hemispheres image
+        :param midline: Tuple (axis, position, left_first)
+        """
+        axis, position, left_first = midline
+        first, second = (
+            (LEFT_HEMISPHERE, RIGHT_HEMISPHERE)
+            if left_first
+            else (RIGHT_HEMISPHERE, LEFT_HEMISPHERE)
+        )
+        line = np.full(shape[axis], second, dtype=np.uint8)
+        line[:position] = first
+        line_shape = [1] * len(shape)
+        line_shape[axis] = shape[axis]
+        sides = np.broadcast_to(line.reshape(line_shape), shape)
+        return cls(sides, midline=midline)
+
+    @property
+    def shape(self):
+        return self.sides.shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __getitem__(self, key):
+        return HemisphereIndex(self.sides[key], midline=self.crop_midline(key))
+
+    def __reduce__(self):
+        # a planar split only needs its shape and midline to be recreated
+        if self.midline is not None:
+            return HemisphereIndex.from_midline, (self.shape, self.midline)
+        return HemisphereIndex, (self.sides,)
+
+    def crop_midline(self, key):
+        """
+        :param key: Index into the hemispheres image
+        :return: The midline within the indexed image, if the hemispheres
+        are split by a plane and key is a crop (tuple of slices), otherwise
+        None
+        """
+        if self.midline is None:
+            return None
+        if not isinstance(key, tuple):
+            key = (key,)
+        ellipses = [i for i, k in enumerate(key) if k is Ellipsis]
+        if len(ellipses) == 1:
+            i = ellipses[0]
+            key = (
+                key[:i]
+                + (slice(None),) * (self.ndim - len(key) + 1)
+                + key[i + 1 :]
+            )
+        if len(key) > self.ndim or not all(
+            isinstance(k, slice) and k.step in (None, 1) for k in key
+        ):
+            return None
+        axis, position, left_first = self.midline
+        if axis < len(key):
+            start, stop, _ = key[axis].indices(self.shape[axis])
+            position = min(max(position - start, 0), max(stop - start, 0))
+        return axis, position, left_first
+
+    def split(self):
+        """
+        :return: Tuple (left, right) of the crops of an image (of the same
+        shape) in each hemisphere, if the hemispheres are split by a plane,
+        otherwise None
+        """
+        if self.midline is None:
+            return None
+        axis, position, left_first = self.midline
+        before = [slice(None)] * self.ndim
+        after = [slice(None)] * self.ndim
+        before[axis] = slice(None, position)
+        after[axis] = slice(position, None)
+        if left_first:
+            return tuple(before), tuple(after)
+        return tuple(after), tuple(before)
+
+
+def find_midline(
+    hemispheres, left_hemisphere_value=1, right_hemisphere_value=2
+):
+    """
+    Check whether a hemispheres image is split into the two hemispheres by
+    a single plane, normal to one of the axes.
+
+    :param hemispheres: Hemispheres image
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    :return: Tuple (axis, position, left_first) as used by HemisphereIndex,
+    or None if the hemispheres are not split by a plane
+    """
+    hemispheres = np.asarray(hemispheres)
+    if hemispheres.size == 0:
+        return None
+    for axis in range(hemispheres.ndim):
+        # the values along a line through the first voxel
+        line_key = [0] * hemispheres.ndim
+        line_key[axis] = slice(None)
+        line = hemispheres[tuple(line_key)]
+        is_left = line == left_hemisphere_value
+        if not np.all(is_left | (line == right_hemisphere_value)):
+            return None
+        position = int(np.argmin(is_left == is_left[0]))
+        if position == 0:
+            # single hemisphere along this line
+            if axis < hemispheres.ndim - 1:
+                continue
+            position = len(line)
+        if np.any(is_left[position:] == is_left[0]):
+            # more than one transition along this axis
+            continue
+        line_shape = [1] * hemispheres.ndim
+        line_shape[axis] = len(line)
+        if np.all(hemispheres == line.reshape(line_shape)):
+            return axis, position, bool(is_left[0])
+    return None
+
+
+def index_hemispheres(
+    hemispheres,
+    left_hemisphere_value=1,
+    right_hemisphere_value=2,
+):
+    """
+    :param hemispheres: Hemispheres image (or an existing HemisphereIndex,
+    which is returned unchanged)
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    :return: HemisphereIndex of the hemispheres image
+    """
+    if isinstance(hemispheres, HemisphereIndex):
+        return hemispheres
+    hemispheres = np.asarray(hemispheres)
+    midline = find_midline(
+        hemispheres,
+        left_hemisphere_value=left_hemisphere_value,
+        right_hemisphere_value=right_hemisphere_value,
+    )
+    if midline is not None:
+        return HemisphereIndex.from_midline(hemispheres.shape, midline)
+    sides = np.full(hemispheres.shape, NO_HEMISPHERE, dtype=np.uint8)
+    sides[hemispheres == left_hemisphere_value] = LEFT_HEMISPHERE
+    sides[hemispheres == right_hemisphere_value] = RIGHT_HEMISPHERE
+    return HemisphereIndex(sides)
+
+
+def get_hemisphere_sides(
+    hemispheres,
+    coordinates,
+    left_hemisphere_value=1,
+    right_hemisphere_value=2,
+):
+    """
+    Get the hemisphere codes (as encoded in a HemisphereIndex) of a set of
+    voxels, reading only those voxels, rather than indexing the whole image
+
+    :param hemispheres: Hemispheres image or HemisphereIndex
+    :param coordinates: Tuple of (N) integer index arrays, one per axis
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    :return: Array of the (N) hemisphere codes
+    """
+    if isinstance(hemispheres, HemisphereIndex):
+        return np.asarray(hemispheres.sides)[coordinates]
+    values = np.asarray(hemispheres)[coordinates]
+    sides = np.full(values.shape, NO_HEMISPHERE, dtype=np.uint8)
+    sides[values == left_hemisphere_value] = LEFT_HEMISPHERE
+    sides[values == right_hemisphere_value] = RIGHT_HEMISPHERE
+    return sides
+
+
+class AnnotationIndex:
+    """
+    Atlas annotations relabelled to a dense index (0..K-1) of the K atlas
+    values present, e.g. so that voxels can be counted per structure with
+    np.bincount, rather than (sort-based) np.unique, even though atlas
+    values can be very large (e.g. > 600 million in the Allen atlases).
+    Like a HemisphereIndex, this is computed once (see index_annotations),
+    and reused for every analysis.
+
+    Indexing returns an AnnotationIndex of the selection, and converting to
+    a numpy array gives the original atlas values.
+    """
+
+    def __init__(self, compact, structure_ids):
+        """
+        :param compact: Array of the index of the atlas value of each voxel
+        in structure_ids
+        :param structure_ids: Sorted array of the (K) atlas values
+        """
+        self.compact = compact
+        self.structure_ids = structure_ids
+
+    @property
+    def shape(self):
+        return self.compact.shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.structure_ids.dtype
+
+    def __getitem__(self, key):
+        return AnnotationIndex(self.compact[key], self.structure_ids)
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.structure_ids[np.asarray(self.compact)]
+        if dtype is not None:
+            values = values.astype(dtype, copy=False)
+        return values
+
+
+def index_annotations(annotations, slab_thickness=64, relabel=True):
+    """
+    Relabel an annotations image to a dense index of its atlas values. Both
+    passes over the image are hash-based (O(n)), and use memory
+    proportional to a slab (along the first axis) of the image, plus the
+    (uint16 for up to 65536 structures) relabelled image.
+
+    :param annotations: Atlas annotations image (or an existing
+    AnnotationIndex, which is returned unchanged)
+    :param slab_thickness: How many planes to process at once
+    :param relabel: If False, only find the atlas values (in a single pass,
+    without allocating the relabelled image)
+    :return: AnnotationIndex of the annotations image, or if relabel is
+    False, the sorted array of its atlas values (structure_ids)
+    """
+    if isinstance(annotations, AnnotationIndex):
+        return annotations if relabel else annotations.structure_ids
+    slabs = [
+        slice(start, start + slab_thickness)
+        for start in range(0, annotations.shape[0], slab_thickness)
+    ]
+    structure_ids = np.unique(
+        np.concatenate(
+            [np.zeros(0, dtype=annotations.dtype)]
+            + [
+                pd.unique(np.asarray(annotations[slab]).ravel())
+                for slab in slabs
+            ]
+        )
+    )
+    if not relabel:
+        return structure_ids
+    compact = np.empty(
+        annotations.shape,
+        dtype=np.min_scalar_type(max(len(structure_ids) - 1, 0)),
+    )
+    for slab in slabs:
+        values = np.asarray(annotations[slab])
+        codes, slab_ids = pd.factorize(values.ravel())
+        compact[slab] = np.searchsorted(structure_ids, slab_ids)[
+            codes
+        ].reshape(values.shape)
+    return AnnotationIndex(compact, structure_ids)
+
+
 def lateralise_atlas_image(
     masked_atlas_annotations,
     hemispheres,
@@ -6,12 +307,26 @@ def lateralise_atlas_image(
 ):
     """
     :param masked_atlas_annotations: Masked image of atlas annotations
-    :param hemispheres: Hemispheres image
+    :param hemispheres: Hemispheres image or HemisphereIndex
     :param left_hemisphere_value: Value encoded in hemispheres image
     :param right_hemisphere_value: Value encoded in hemispheres image
     :return: Tuple (left, right) of numpy arrays of values within
-    each hemisphere
+    each hemisphere. If the hemispheres are split by a plane (according to
+    a HemisphereIndex), these are views of each side of the image, rather
+    than flat copies
     """
+    if isinstance(hemispheres, HemisphereIndex):
+        crops = hemispheres.split()
+        if crops is not None:
+            left, right = crops
+            return (
+                masked_atlas_annotations[left],
+                masked_atlas_annotations[right],
+            )
+        hemispheres = hemispheres.sides
+        left_hemisphere_value = LEFT_HEMISPHERE
+        right_hemisphere_value = RIGHT_HEMISPHERE
+
     annotation_left = masked_atlas_annotations[
         hemispheres == left_hemisphere_value
     ]
@@ -0,0 +1,348 @@
+import itertools
+
+import numpy as np
+
+
+class SparseArray:
+    """
+    Array of (mostly) zeros, stored as a dict of fixed-size chunks, in
+    which a chunk is only allocated when it is first written to (with any
+    nonzero values). Reading a chunk that has not been written to returns
+    zeros without allocating it, and chunks that are erased back to zeros
+    are freed, so memory use is proportional to the written part of the
+    array (e.g. the painted voxels), rather than its full size.
+
+    Supports the indexing used by napari labels layers (tuples of slices
+    and integers, and tuples of integer index arrays), so that it can be
+    used as the data of a labels layer. Converting to a numpy array gives
+    the full (dense) array.
+    """
+
+    def __init__(self, shape, dtype=np.uint16, chunk_size=64):
+        """
+        :param shape: Shape of the array
+        :param dtype: Data type of the array
+        :param chunk_size: Size of the (cubic) chunks (limited to the size
+        of the array along each axis)
+        """
+        self.shape = tuple(int(size) for size in shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_shape = tuple(min(chunk_size, size) for size in self.shape)
+        self.chunks = {}
+
+    @classmethod
+    def from_array(cls, array, chunk_size=64):
+        """
+        Copy an array (e.g. a zarr array or memory map) into a SparseArray,
+        allocating only the chunks with any nonzero values. The array is
+        read one row of chunks (along the last axis) at a time, so that it
+        is never held in memory in full.
+
+        :param array: Array to copy
+        :param chunk_size: Size of the (cubic) chunks
+        :return: SparseArray of the same shape and dtype as the array
+        """
+        sparse = cls(array.shape, dtype=array.dtype, chunk_size=chunk_size)
+        if sparse.ndim == 0:
+            return sparse
+        grid_shape = [
+            -(-size // chunk_size)
+            for size, chunk_size in zip(sparse.shape, sparse.chunk_shape)
+        ]
+        for row in itertools.product(*map(range, grid_shape[:-1])):
+            row_slices = sparse.get_chunk_slices(row + (0,))[:-1]
+            values = np.asarray(array[row_slices])
+            if not values.any():
+                continue
+            for index in range(grid_shape[-1]):
+                chunk_box = row + (index,)
+                chunk = values[
+                    ..., sparse.get_chunk_slices(chunk_box)[-1]
+                ].copy()
+                if chunk.any():
+                    sparse.chunks[chunk_box] = chunk
+        return sparse
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        """Number of bytes allocated (for the written chunks)"""
+        return sum(chunk.nbytes for chunk in list(self.chunks.values()))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[(slice(None),) * self.ndim]
+        if dtype is not None:
+            array = array.astype(dtype, copy=False)
+        return array
+
+    def __getitem__(self, key):
+        indices = get_index_arrays(key, self.ndim)
+        if indices is not None:
+            return self.get_points(indices)
+        box, steps, squeeze = self.normalise_key(key)
+        region = np.zeros(
+            tuple(stop - start for start, stop in box), dtype=self.dtype
+        )
+        for chunk_box, chunk_crop, region_crop in self.overlaps(box):
+            chunk = self.chunks.get(chunk_box)
+            if chunk is not None:
+                region[region_crop] = chunk[chunk_crop]
+        region = region[tuple(slice(None, None, step) for step in steps)]
+        return region.reshape(
+            [size for size, drop in zip(region.shape, squeeze) if not drop]
+        )
+
+    def __setitem__(self, key, value):
+        indices = get_index_arrays(key, self.ndim)
+        if indices is not None:
+            self.set_points(indices, value)
+            return
+        box, steps, squeeze = self.normalise_key(key)
+        if any(step != 1 for step in steps):
+            raise IndexError("SparseArray only supports writing unit steps")
+        region_shape = tuple(stop - start for start, stop in box)
+        # value has the shape of the indexed region, without the axes
+        # indexed with an integer
+        value = np.broadcast_to(
+            np.asarray(value, dtype=self.dtype),
+            [size for size, drop in zip(region_shape, squeeze) if not drop],
+        ).reshape(region_shape)
+        for chunk_box, chunk_crop, region_crop in self.overlaps(box):
+            self.write_chunk(chunk_box, chunk_crop, value[region_crop])
+
+    def normalise_key(self, key):
+        """
+        :param key: Basic index (integers, slices and Ellipsis)
+        :return: Tuple (box, steps, squeeze). box is the (start, stop) of
+        the indexed region along each axis, steps the step along each
+        axis, and squeeze whether each axis was indexed with an integer
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = next(i for i, k in enumerate(key) if k is Ellipsis)
+            key = (
+                key[:i]
+                + (slice(None),) * (self.ndim - len(key) + 1)
+                + key[i + 1 :]
+            )
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for SparseArray")
+
+        box = []
+        steps = []
+        squeeze = []
+        for k, size in zip(key, self.shape):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(size)
+                if step < 0:
+                    raise IndexError(
+                        "SparseArray does not support negative steps"
+                    )
+                box.append((start, max(start, stop)))
+                steps.append(step)
+                squeeze.append(False)
+            else:
+                index = int(k)
+                if index < 0:
+                    index += size
+                if not 0 <= index < size:
+                    raise IndexError(
+                        f"index {k} is out of bounds for axis with size "
+                        f"{size}"
+                    )
+                box.append((index, index + 1))
+                steps.append(1)
+                squeeze.append(True)
+        return box, steps, squeeze
+
+    def overlaps(self, box):
+        """
+        :param box: (start, stop) of a region along each axis
+        :return: Generator of (chunk index, crop of the chunk, crop of the
+        region) for each chunk overlapping the region
+        """
+        if any(start >= stop for start, stop in box):
+            return
+        ranges = [
+            range(start // chunk_size, (stop - 1) // chunk_size + 1)
+            for (start, stop), chunk_size in zip(box, self.chunk_shape)
+        ]
+        for chunk_box in itertools.product(*ranges):
+            chunk_crop = []
+            region_crop = []
+            for index, (start, stop), chunk_size in zip(
+                chunk_box, box, self.chunk_shape
+            ):
+                chunk_start = index * chunk_size
+                overlap_start = max(start, chunk_start)
+                overlap_stop = min(stop, chunk_start + chunk_size)
+                chunk_crop.append(
+                    slice(
+                        overlap_start - chunk_start, overlap_stop - chunk_start
+                    )
+                )
+                region_crop.append(
+                    slice(overlap_start - start, overlap_stop - start)
+                )
+            yield chunk_box, tuple(chunk_crop), tuple(region_crop)
+
+    def get_chunk_slices(self, chunk_box):
+        """
+        :return: Position of a chunk in the array, as a tuple of slices
+        """
+        return tuple(
+            slice(index * chunk_size, min((index + 1) * chunk_size, size))
+            for index, chunk_size, size in zip(
+                chunk_box, self.chunk_shape, self.shape
+            )
+        )
+
+    def write_chunk(self, chunk_box, chunk_key, value):
+        """
+        Write values to (part of) a chunk, allocating the chunk if needed,
+        and freeing it if it is then empty
+        :param chunk_box: Index of the chunk
+        :param chunk_key: Index within the chunk
+        :param value: Values to write
+        """
+        chunk = self.chunks.get(chunk_box)
+        if chunk is None:
+            if not value.any():
+                # writing zeros to an unallocated chunk changes nothing
+                return
+            chunk = np.zeros(
+                tuple(
+                    s.stop - s.start for s in self.get_chunk_slices(chunk_box)
+                ),
+                dtype=self.dtype,
+            )
+            self.chunks[chunk_box] = chunk
+        chunk[chunk_key] = value
+        if not value.any() and not chunk.any():
+            del self.chunks[chunk_box]
+
+    def get_points(self, indices):
+        """
+        :param indices: Tuple of (N) integer index arrays, one per axis
+        :return: Array of the (N) values at the indices
+        """
+        values = np.zeros(indices[0].shape, dtype=self.dtype)
+        for chunk_box, in_chunk, local in self.group_points(indices):
+            chunk = self.chunks.get(chunk_box)
+            if chunk is not None:
+                values[in_chunk] = chunk[local]
+        return values
+
+    def set_points(self, indices, value):
+        """
+        :param indices: Tuple of (N) integer index arrays, one per axis
+        :param value: Value, or array of (N) values, to set
+        """
+        value = np.broadcast_to(
+            np.asarray(value, dtype=self.dtype), indices[0].shape
+        )
+        for chunk_box, in_chunk, local in self.group_points(indices):
+            self.write_chunk(chunk_box, local, value[in_chunk])
+
+    def group_points(self, indices):
+        """
+        Group points by the chunk they are in
+        :param indices: Tuple of (N) integer index arrays, one per axis
+        :return: Generator of (chunk index, boolean mask of the points in
+        the chunk, tuple of the indices of those points within the chunk)
+        """
+        indices = tuple(
+            np.where(index < 0, index + size, index)
+            for index, size in zip(indices, self.shape)
+        )
+        for index, size in zip(indices, self.shape):
+            if np.any((index < 0) | (index >= size)):
+                raise IndexError("index is out of bounds for SparseArray")
+        chunk_indices = np.stack(
+            [
+                index // chunk_size
+                for index, chunk_size in zip(indices, self.chunk_shape)
+            ],
+            axis=-1,
+        ).reshape(-1, self.ndim)
+        if len(chunk_indices) == 0:
+            return
+        chunk_boxes, point_chunks = np.unique(
+            chunk_indices, axis=0, return_inverse=True
+        )
+        point_chunks = point_chunks.reshape(indices[0].shape)
+        for i, chunk_box in enumerate(chunk_boxes.tolist()):
+            in_chunk = point_chunks == i
+            local = tuple(
+                index[in_chunk] - start * chunk_size
+                for index, start, chunk_size in zip(
+                    indices, chunk_box, self.chunk_shape
+                )
+            )
+            yield tuple(chunk_box), in_chunk, local
+
+    def get_bounding_box(self):
+        """
+        Find the smallest box containing all nonzero values, from the
+        written chunks only
+        :return: Tuple of slices (one per axis), or None if the array is
+        empty
+        """
+        minimum = np.full(self.ndim, np.iinfo(np.int64).max)
+        maximum = np.full(self.ndim, -1)
+        for chunk_box, chunk in list(self.chunks.items()):
+            nonzero = chunk != 0
+            for axis in range(self.ndim):
+                other_axes = tuple(
+                    dim for dim in range(self.ndim) if dim != axis
+                )
+                found = np.flatnonzero(nonzero.any(axis=other_axes))
+                if len(found) == 0:
+                    break
+                start = chunk_box[axis] * self.chunk_shape[axis]
+                minimum[axis] = min(minimum[axis], start + found[0])
+                maximum[axis] = max(maximum[axis], start + found[-1])
+        if np.any(maximum < 0):
+            return None
+        return tuple(
+            slice(int(start), int(stop) + 1)
+            for start, stop in zip(minimum, maximum)
+        )
+
+    def iter_chunks(self):
+        """
+        :return: List of (position in the array as a tuple of slices,
+        chunk array) of the written chunks
+        """
+        return [
+            (self.get_chunk_slices(chunk_box), chunk)
+            for chunk_box, chunk in list(self.chunks.items())
+        ]
+
+
+def get_index_arrays(key, ndim):
+    """
+    :return: If key is a tuple of integer index arrays (one per axis), the
+    arrays, otherwise None
+    """
+    if (
+        isinstance(key, tuple)
+        and len(key) == ndim
+        and all(
+            isinstance(k, (np.ndarray, list)) and np.ndim(k) > 0 for k in key
+        )
+    ):
+        return tuple(np.asarray(k, dtype=np.intp) for k in key)
+    return None
@@ -1,14 +1,77 @@
 import numpy as np
+from scipy.ndimage import binary_erosion
 from scipy.spatial import cKDTree
 
+from brainglobe_segmentation.image.sparse import SparseArray
 
-def create_KDTree_from_image(image, value=0):
+
+def create_KDTree_from_image(image, value=0, boundary_only=False):
     """
     Create a KDTree of points equaling a given value
     :param image: Image to be converted to points
     :param value: Value of image to be used
+    :param boundary_only: If True, only use the points that are next to
+    (share a face with) a point not equaling the value. For any point within
+    a voxel not equaling the value, the nearest point equaling the value is
+    always on this boundary, so e.g. the nearest background voxel to a point
+    in the brain is found from the brain surface alone, rather than the
+    whole background
     :return: scipy.spatial.cKDTree object
     """
-
-    list_points = np.argwhere((image == value))
+    list_points = get_points_from_image(
+        image, value=value, boundary_only=boundary_only
+    )
     return cKDTree(list_points)
+
+
+def get_points_from_image(image, value=0, boundary_only=False):
+    """
+    Get the coordinates of points equaling a given value
+    :param image: Image to be converted to points
+    :param value: Value of image to be used
+    :param boundary_only: If True, only the points next to a point not
+    equaling the value (see create_KDTree_from_image)
+    :return: (N, image.ndim) array of coordinates
+    """
+    mask = image == value
+    if boundary_only:
+        # the image edge does not count as a boundary
+        mask &= ~binary_erosion(mask, border_value=1)
+    return np.argwhere(mask)
+
+
+def get_bounding_box(image):
+    """
+    Find the smallest box containing all nonzero values of an image. Each
+    axis is reduced only within the extent already found for the previous
+    axes, so no full-size temporary arrays are created.
+    :param image: nD image (any array supporting numpy reductions)
+    :return: Tuple of slices (one per axis), or None if the image is empty
+    """
+    if isinstance(image, SparseArray):
+        return image.get_bounding_box()
+    bounding_box = [slice(None)] * image.ndim
+    for axis in range(image.ndim):
+        other_axes = tuple(dim for dim in range(image.ndim) if dim != axis)
+        cropped = image[tuple(bounding_box)]
+        nonzero = np.flatnonzero(np.asarray(np.any(cropped, axis=other_axes)))
+        if len(nonzero) == 0:
+            return None
+        bounding_box[axis] = slice(int(nonzero[0]), int(nonzero[-1]) + 1)
+    return tuple(bounding_box)
+
+
+def scale_to_resolution(points, resolution):
+    """
+    Convert points (or the steps between them) from voxels to physical
+    units, e.g. microns. Used for both analysis (e.g. distances along a
+    track) and export, so that both are scaled the same way.
+    :param points: (N, ndim) array of points, in voxels
+    :param resolution: Size of a voxel (a single value, or one per axis,
+    e.g. atlas.resolution)
+    :return: (N, ndim) array of the points, in the units of resolution
+    """
+    points = np.asarray(points)
+    if not np.issubdtype(points.dtype, np.floating):
+        points = points.astype(float)
+    return points * np.asarray(resolution, dtype=points.dtype)
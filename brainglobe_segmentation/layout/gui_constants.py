@@ -19,13 +19,22 @@ SPLINE_SIZE = 50
 BRUSH_SIZE = 250
 SPLINE_POINTS_DEFAULT = 1000
 SPLINE_SMOOTHING_DEFAULT = 0.1
+SPLINE_STEP_DEFAULT = 0  # Microns between spline points (0 to use points)
 FIT_DEGREE_DEFAULT = 3
+STRAIGHT_TRACKS_DEFAULT = False  # Fit straight lines, rather than splines
 
 SUMMARISE_TRACK_DEFAULT = True
 CALCULATE_VOLUMES_DEFAULT = True
 SUMMARIZE_VOLUMES_DEFAULT = True
+FUSED_REGION_ANALYSIS = True  # Analyse all regions in a single pass
+# Build the atlas indices when a project is loaded, not on first analysis
+PREBUILD_ATLAS_INDICES = False
+N_PROCESSES_DEFAULT = 1
+MULTI_LABEL_REGIONS_DEFAULT = False  # All regions as labels of one layer
 
-TRACK_FILE_EXT = ".points"
-IMAGE_FILE_EXT = ".tiff"
+TRACK_FILE_EXT = ".points"  # Legacy (one file per track)
+TRACK_STORE_FILENAME = "tracks.npz"
+IMAGE_FILE_EXT = ".tiff"  # Legacy (uncompressed) region files
+REGION_FILE_EXT = ".zarr"
 BOUNDARIES_STRING = "Boundaries"
 HEMISPHERES_STRING = "Hemispheres"
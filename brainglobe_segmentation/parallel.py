@@ -0,0 +1,174 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+# Shared memory blocks attached to by this process, so that each block is
+# only attached once per worker process (rather than once per task)
+_attached_shared_memory = {}
+
+
+def get_executor(n_processes=1):
+    """
+    Get a pool of processes to spread work across.
+    Processes are spawned (rather than forked), as the parent process may be
+    running Qt and other threads.
+    :param int n_processes: Number of worker processes
+    :return: Context manager returning a ProcessPoolExecutor, or None if
+    only one process is requested (i.e. work should be done serially)
+    """
+    if n_processes > 1:
+        return ProcessPoolExecutor(
+            max_workers=n_processes, mp_context=get_context("spawn")
+        )
+    else:
+        return nullcontext()
+
+
+def get_background_executor(name):
+    """
+    Get a single, low priority, background thread, e.g. to prepare data
+    that will be needed later without slowing down the viewer.
+    :param str name: Name of the thread
+    :return: ThreadPoolExecutor (with one thread)
+    """
+    return ThreadPoolExecutor(
+        max_workers=1,
+        thread_name_prefix=name,
+        initializer=lower_thread_priority,
+    )
+
+
+def lower_thread_priority():
+    """
+    Lower the scheduling priority of the current thread, so that background
+    work doesn't slow down the viewer (only supported on Linux, where
+    priorities are per thread)
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+class SharedArray:
+    """
+    Read-only numpy array held in shared memory. Only the name, shape and
+    dtype are pickled, so it can be sent to worker processes without
+    copying the data. Indexing returns a (zero-copy where possible) view.
+    Create using `shared_arrays`.
+    """
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def array(self):
+        try:
+            shared_memory = _attached_shared_memory[self.name]
+        except KeyError:
+            shared_memory = SharedMemory(name=self.name)
+            _attached_shared_memory[self.name] = shared_memory
+        array = np.ndarray(self.shape, self.dtype, buffer=shared_memory.buf)
+        array.flags.writeable = False
+        return array
+
+    def __getitem__(self, key):
+        return self.array[key]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.array, dtype=dtype)
+
+    def __getstate__(self):
+        return self.name, self.shape, self.dtype.str
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class SharedArrayStore:
+    """
+    Arrays published in shared memory, kept until they are released, so
+    that arrays used by every analysis (e.g. the annotations and
+    hemispheres of a loaded project) are only copied to shared memory once,
+    rather than for every analysis. Sharing the same array again returns
+    the existing SharedArray.
+    """
+
+    def __init__(self):
+        # id of each shared array: (array, SharedArray, SharedMemory). The
+        # array is kept, so that its id isn't reused while it is shared
+        self.shared = {}
+        self.lock = threading.Lock()
+
+    def share(self, array):
+        """
+        :param array: Array to share
+        :return: SharedArray of a (read-only) copy of the array
+        """
+        with self.lock:
+            try:
+                return self.shared[id(array)][1]
+            except KeyError:
+                pass
+            data = np.asarray(array)
+            shared_memory = SharedMemory(create=True, size=max(data.nbytes, 1))
+            _attached_shared_memory[shared_memory.name] = shared_memory
+            shared_copy = np.ndarray(
+                data.shape, data.dtype, buffer=shared_memory.buf
+            )
+            shared_copy[...] = data
+            del shared_copy
+            shared_array = SharedArray(
+                shared_memory.name, data.shape, data.dtype
+            )
+            self.shared[id(array)] = (array, shared_array, shared_memory)
+            return shared_array
+
+    def release(self):
+        """
+        Release all shared memory. All work using it must be complete.
+        """
+        with self.lock:
+            for _, _, shared_memory in self.shared.values():
+                _attached_shared_memory.pop(shared_memory.name, None)
+                try:
+                    shared_memory.close()
+                except BufferError:
+                    # views still exist in this process, the memory will be
+                    # released when they are garbage collected
+                    pass
+                shared_memory.unlink()
+            self.shared = {}
+
+
+@contextmanager
+def shared_arrays(*arrays, store=None):
+    """
+    Publish arrays (e.g. the annotations and hemispheres) in shared memory,
+    so that they are only copied once, rather than once per worker process.
+    :param arrays: Arrays to share
+    :param store: SharedArrayStore to share the arrays in, which keeps them
+    after the context exits (so they can be reused). If None, the shared
+    memory is released when the context exits, so all work using it must be
+    complete by then.
+    :return: Context manager returning a list of SharedArray
+    """
+    if store is not None:
+        yield [store.share(array) for array in arrays]
+        return
+    store = SharedArrayStore()
+    try:
+        yield [store.share(array) for array in arrays]
+    finally:
+        store.release()
@@ -1,27 +1,51 @@
 from pathlib import Path
 
 import numpy as np
+import zarr
 from brainglobe_utils.general.pathlib import append_to_pathlib_stem
 from brainglobe_utils.IO.image.save import to_tiff
 from brainglobe_utils.IO.surfaces import marching_cubes_to_obj
 from napari.utils.notifications import show_info
+from scipy import ndimage
 from skimage import measure
+from zarr.codecs import BloscCodec
+
+from brainglobe_segmentation.image.sparse import SparseArray
+from brainglobe_segmentation.image.utils import (
+    get_bounding_box,
+    scale_to_resolution,
+)
+from brainglobe_segmentation.regions.layers import (
+    REGION_CHUNK_SIZE,
+    REGION_NAMES_KEY,
+    get_label_name,
+    get_region_names,
+    is_multi_label,
+)
 
 
 def convert_obj_to_br(verts, faces, voxel_size):
-    if voxel_size != 1:
-        verts = verts * voxel_size
+    """
+    :param voxel_size: Size of a voxel (a single value, or one per axis,
+    e.g. atlas.resolution)
+    """
+    verts = scale_to_resolution(verts, voxel_size)
 
     faces = faces + 1
     return verts, faces
 
 
 def extract_and_save_object(
-    image, output_file_name, voxel_size, threshold=0, step_size=1
+    image, output_file_name, voxel_size, threshold=0, step_size=1, offset=0
 ):
+    """
+    :param offset: If image is a crop, the position of the crop (added to
+    the vertex coordinates)
+    """
     verts, faces, normals, values = measure.marching_cubes(
         image, threshold, step_size=step_size
     )
+    verts = verts + offset
     verts, faces = convert_obj_to_br(verts, faces, voxel_size)
     marching_cubes_to_obj(
         (verts, faces, normals, values), str(output_file_name)
@@ -60,11 +84,29 @@ def volume_to_vector_array_to_obj_file(
         )
 
 
-def save_label_layers(regions_directory, label_layers):
+def save_label_layers(
+    regions_directory,
+    label_layers,
+    image_extension=".zarr",
+    region_changes=None,
+):
+    """
+    :param region_changes: List of the RegionChanges of (some of) the
+    label layers, so that only their changed chunks are saved
+    """
     show_info(f"Saving regions to: {regions_directory}")
     regions_directory.mkdir(parents=True, exist_ok=True)
+    changes = {
+        id(layer_changes.label_layer): layer_changes
+        for layer_changes in region_changes or []
+    }
     for label_layer in label_layers:
-        save_regions_to_file(label_layer, regions_directory)
+        save_regions_to_file(
+            label_layer,
+            regions_directory,
+            image_extension=image_extension,
+            changes=changes.get(id(label_layer)),
+        )
 
 
 def export_label_layers(
@@ -73,32 +115,208 @@ def export_label_layers(
     show_info(f"Exporting regions to: {regions_directory}")
     regions_directory.mkdir(parents=True, exist_ok=True)
     for label_layer in label_layers:
+        if is_multi_label(label_layer):
+            export_multi_label_regions(
+                label_layer, regions_directory, voxel_size, obj_ext=obj_ext
+            )
+            continue
         filename = regions_directory / (label_layer.name + obj_ext)
-        export_regions_to_file(label_layer.data, filename, voxel_size)
+        export_regions_to_file(
+            np.asarray(label_layer.data), filename, voxel_size
+        )
+
+
+def export_multi_label_regions(
+    label_layer, regions_directory, voxel_size, obj_ext=".obj"
+):
+    """
+    Export each region (label ID) of a multi-label layer as .obj for
+    brainrender, named from the layer's region names. The bounding boxes
+    of all labels are found in a single pass over the image, and each
+    region is then meshed within its bounding box.
+    """
+    image = np.asarray(label_layer.data)
+    for index, bounding_box in enumerate(ndimage.find_objects(image)):
+        if bounding_box is None:
+            continue
+        label_id = index + 1
+        # include the voxels around the region, which the surface passes
+        # through, so that it is the same as that of the full image
+        crop = tuple(
+            slice(max(axis.start - 1, 0), min(axis.stop + 1, size))
+            for axis, size in zip(bounding_box, image.shape)
+        )
+        extract_and_save_object(
+            (image[crop] == label_id).astype(np.uint8),
+            regions_directory
+            / (get_label_name(label_layer, label_id) + obj_ext),
+            voxel_size,
+            offset=[axis.start for axis in crop],
+        )
 
 
 def save_regions_to_file(
     label_layer,
     destination_directory,
     ignore_empty=True,
-    image_extension=".tiff",
+    image_extension=".zarr",
+    changes=None,
 ):
     """
-    Saves the segmented regions to file (as .tiff)
+    Saves the segmented regions to file (as a chunked, compressed .zarr
+    array, or a .tiff). The region names of multi-label layers are saved
+    with .zarr files only.
     :param label_layer: napari labels layer (with segmented regions)
     :param destination_directory: Where to save files to
     :param ignore_empty: If True, don't attempt to save empty images
     :param image_extension: File extension fo the image files
+    :param changes: RegionChanges of the layer (or None to save the whole
+    layer). Only used for .zarr files
     """
     data = label_layer.data
+    name = label_layer.name
+
+    filename = destination_directory / (name + image_extension)
+    if image_extension == ".zarr":
+        save_regions_to_zarr(
+            data, filename, ignore_empty=ignore_empty, changes=changes
+        )
+        if is_multi_label(label_layer) and filename.exists():
+            save_region_names(filename, get_region_names(label_layer))
+        return
+
+    if is_memmap_of(data, filename):
+        # opened from this file, and not edited since (writing the file
+        # would also change the memory-mapped data while it is read)
+        return
+    data = np.asarray(data)
     if ignore_empty:
         if data.sum() == 0:
             return
+    to_tiff(data.astype(np.int16), filename)
 
-    name = label_layer.name
 
-    filename = destination_directory / (name + image_extension)
-    to_tiff(data.astype(np.int16), filename)
+def save_regions_to_zarr(data, filename, ignore_empty=True, changes=None):
+    """
+    Saves segmented regions as a zarr array, in chunks compressed with
+    zstd. Chunks that are empty (all 0) are not stored, and only the
+    bounding box of the regions is written, so the size of the file (and
+    time to save it) depends on the size of the regions, rather than the
+    image. If the regions were saved to the same file before, and their
+    changes since then are known, only the changed chunks are rewritten.
+    :param data: Image of the segmented regions
+    :param filename: Path of the zarr array
+    :param ignore_empty: If True, don't save empty images
+    :param changes: RegionChanges of the regions, or None to save them in
+    full
+    """
+    if is_zarr_array_at(data, filename):
+        # opened from this file, and not edited since
+        return
+    chunks = None if changes is None else changes.begin_save(filename)
+    try:
+        if chunks is None or not update_zarr_chunks(data, filename, chunks):
+            if not write_zarr(data, filename, ignore_empty=ignore_empty):
+                # nothing saved, so the next save needs to be in full
+                if changes is not None:
+                    changes.mark_all_dirty()
+    except Exception:
+        if changes is not None:
+            changes.mark_all_dirty()
+        raise
+
+
+def update_zarr_chunks(data, filename, chunks):
+    """
+    Rewrite some of the chunks of a saved zarr array
+    :param data: Image of the segmented regions
+    :param filename: Path of the zarr array
+    :param chunks: Indices of the chunks to write
+    :return: False if the saved array doesn't match the regions (shape,
+    dtype or chunks), so the regions need to be saved in full
+    """
+    regions = zarr.open_array(str(filename), mode="r+")
+    if (
+        regions.shape != data.shape
+        or regions.dtype != data.dtype
+        or regions.chunks != get_chunk_shape(data.shape)
+    ):
+        return False
+    for chunk in chunks:
+        key = tuple(
+            slice(index * size, (index + 1) * size)
+            for index, size in zip(chunk, regions.chunks)
+        )
+        regions[key] = np.asarray(data[key])
+    return True
+
+
+def write_zarr(data, filename, ignore_empty=True):
+    """
+    Write segmented regions to a new zarr array (replacing any existing
+    array)
+    :return: False if the regions are empty, and so not saved
+    """
+    bounding_box = get_bounding_box(data)
+    if bounding_box is None and ignore_empty:
+        return False
+
+    regions = zarr.create_array(
+        store=str(filename),
+        shape=data.shape,
+        chunks=get_chunk_shape(data.shape),
+        dtype=data.dtype,
+        fill_value=0,
+        compressors=BloscCodec(cname="zstd", clevel=5, shuffle="bitshuffle"),
+        overwrite=True,
+    )
+    if isinstance(data, SparseArray) and data.chunk_shape == regions.chunks:
+        # only the written chunks hold any regions
+        for chunk_slices, chunk in data.iter_chunks():
+            regions[chunk_slices] = chunk
+    elif bounding_box is not None:
+        regions[bounding_box] = np.asarray(data[bounding_box])
+    return True
+
+
+def get_chunk_shape(shape):
+    """
+    :param shape: Shape of the regions image
+    :return: Shape of the chunks of the saved regions
+    """
+    return tuple(min(REGION_CHUNK_SIZE, size) for size in shape)
+
+
+def save_region_names(filename, region_names):
+    """
+    Save the name of each label ID of a multi-label layer in the
+    attributes of its saved zarr array (see load_region_names)
+    """
+    regions = zarr.open_array(str(filename), mode="r+")
+    regions.attrs[REGION_NAMES_KEY] = {
+        str(label_id): name for label_id, name in region_names.items()
+    }
+
+
+def is_zarr_array_at(data, filename):
+    """
+    Whether data is the zarr array stored at filename
+    """
+    if not isinstance(data, zarr.Array):
+        return False
+    root = getattr(data.store, "root", None)
+    return root is not None and Path(root).resolve() == (
+        Path(filename).resolve()
+    )
+
+
+def is_memmap_of(data, filename):
+    """
+    Whether data is a memory map of filename
+    """
+    if not isinstance(data, np.memmap) or data.filename is None:
+        return False
+    return Path(data.filename).resolve() == Path(filename).resolve()
 
 
 def export_regions_to_file(image, filename, voxel_size, ignore_empty=True):
@@ -1,12 +1,28 @@
+from concurrent.futures import Future
+
 import numpy as np
 import pandas as pd
-from brainglobe_utils.general.list import unique_elements_lists
-from brainglobe_utils.pandas.misc import initialise_df, safe_pandas_concat
 from napari.qt.threading import thread_worker
 from napari.utils.notifications import show_info
 from skimage.measure import regionprops_table
 
-from brainglobe_segmentation.atlas.utils import lateralise_atlas_image
+from brainglobe_segmentation.atlas.utils import (
+    NO_HEMISPHERE,
+    AnnotationIndex,
+    HemisphereIndex,
+    get_hemisphere_sides,
+    index_hemispheres,
+)
+from brainglobe_segmentation.image.sparse import SparseArray
+from brainglobe_segmentation.image.utils import get_bounding_box
+from brainglobe_segmentation.parallel import get_executor, shared_arrays
+from brainglobe_segmentation.regions.layers import (
+    get_label_name,
+    is_multi_label,
+)
+
+# Default number of planes read at once when analysing lazy label layers
+SLAB_THICKNESS = 64
 
 
 @thread_worker
@@ -19,33 +35,213 @@ def region_analysis(
     output_csv_file=None,
     volumes=True,
     summarise=True,
+    fused=False,
+    n_processes=1,
+    slab_thickness=SLAB_THICKNESS,
+    live_volumes=None,
+    shared_store=None,
 ):
+    """
+    Analyse all segmented regions, and save the results to file.
+    :param annotations_layer_image: Atlas annotations image, or (faster
+    for repeated analyses) an AnnotationIndex of it, or a Future of the
+    AnnotationIndex (e.g. still being built in the background)
+    :param hemispheres: Hemispheres image, or a HemisphereIndex of it (or a
+    Future of the HemisphereIndex)
+    :param fused: If True, analyse the volumes of all regions together in a
+    single pass over the annotations and hemispheres (faster for many
+    regions, but uses memory proportional to the space spanned by all
+    regions rather than the largest one)
+    :param n_processes: Number of processes to spread the regions across.
+    If more than one, each region is analysed separately (i.e. fused is
+    ignored)
+    :param slab_thickness: Lazy (e.g. dask or zarr) label layers are never
+    fully loaded, but analysed in slabs of this many planes (along the first
+    axis)
+    :param live_volumes: List of LiveRegionVolumes. The volumes of any label
+    layers tracked while painting are saved directly from these counts
+    :param shared_store: SharedArrayStore to publish the annotations and
+    hemispheres to the worker processes in (e.g. once per loaded project).
+    If None, they are shared for this analysis only
+    """
     regions_directory.mkdir(parents=True, exist_ok=True)
+    # wait for the atlas indices here, rather than on the main thread
+    if isinstance(annotations_layer_image, Future):
+        annotations_layer_image = annotations_layer_image.result()
+    if isinstance(hemispheres, Future):
+        hemispheres = hemispheres.result()
+    label_layers_to_analyse = label_layers
     if volumes:
-        show_info("Calculating region volume distribution")
-        show_info(f"Saving summary volumes to: {regions_directory}")
-        for label_layer in label_layers:
-            analyse_region_brain_areas(
-                label_layer,
-                annotations_layer_image,
-                hemispheres,
-                regions_directory,
-                atlas,
-            )
-    if summarise:
-        if output_csv_file is not None:
-            show_info("Summarising regions")
-            summarise_brain_regions(
-                label_layers, output_csv_file, atlas.resolution
-            )
+        label_layers_to_analyse = save_live_volumes(
+            label_layers,
+            live_volumes,
+            annotations_layer_image,
+            hemispheres,
+            regions_directory,
+            atlas,
+        )
+    if isinstance(hemispheres, np.ndarray):
+        # index the hemispheres once, rather than for every layer. Ideally
+        # a HemisphereIndex is passed in, so this is shared between runs
+        hemispheres = index_hemispheres(
+            hemispheres,
+            left_hemisphere_value=atlas.left_hemisphere_value,
+            right_hemisphere_value=atlas.right_hemisphere_value,
+        )
+    multi_label_layers = [
+        label_layer
+        for label_layer in label_layers_to_analyse
+        if is_multi_label(label_layer)
+    ]
+    label_layers_to_analyse = [
+        label_layer
+        for label_layer in label_layers_to_analyse
+        if not is_multi_label(label_layer)
+    ]
+    in_memory_layers = [
+        label_layer
+        for label_layer in label_layers_to_analyse
+        if not is_lazy_array(label_layer.data)
+    ]
+    lazy_layers = [
+        label_layer
+        for label_layer in label_layers_to_analyse
+        if is_lazy_array(label_layer.data)
+    ]
+    with get_executor(n_processes) as executor:
+        if volumes:
+            show_info("Calculating region volume distribution")
+            show_info(f"Saving summary volumes to: {regions_directory}")
+            if executor is not None:
+                analyse_region_brain_areas_parallel(
+                    in_memory_layers,
+                    annotations_layer_image,
+                    hemispheres,
+                    regions_directory,
+                    atlas,
+                    executor,
+                    shared_store=shared_store,
+                )
+            elif fused:
+                analyse_region_brain_areas_fused(
+                    in_memory_layers,
+                    annotations_layer_image,
+                    hemispheres,
+                    regions_directory,
+                    atlas,
+                )
+            else:
+                for label_layer in in_memory_layers:
+                    analyse_region_brain_areas(
+                        label_layer,
+                        annotations_layer_image,
+                        hemispheres,
+                        regions_directory,
+                        atlas,
+                    )
+            for label_layer in lazy_layers:
+                analyse_region_brain_areas_chunked(
+                    label_layer,
+                    annotations_layer_image,
+                    hemispheres,
+                    regions_directory,
+                    atlas,
+                    slab_thickness=slab_thickness,
+                )
+            for label_layer in multi_label_layers:
+                analyse_multi_label_brain_areas(
+                    label_layer,
+                    annotations_layer_image,
+                    hemispheres,
+                    regions_directory,
+                    atlas,
+                    slab_thickness=slab_thickness,
+                )
+        if summarise:
+            if output_csv_file is not None:
+                show_info("Summarising regions")
+                summarise_brain_regions(
+                    label_layers,
+                    output_csv_file,
+                    atlas.resolution,
+                    executor=executor,
+                    slab_thickness=slab_thickness,
+                )
 
     show_info("Finished!")
 
 
-def summarise_brain_regions(label_layers, filename, atlas_resolution):
-    summaries = []
+def save_live_volumes(
+    label_layers,
+    live_volumes,
+    annotations_layer_image,
+    hemispheres,
+    destination_directory,
+    atlas,
+    extension=".csv",
+    ignore_empty=True,
+):
+    """
+    Save the structure volumes of label layers whose voxels have been
+    counted while painting (see LiveRegionVolumes), provided they were
+    counted using the same annotations and hemispheres.
+    :param live_volumes: List of LiveRegionVolumes (or None)
+    :return: List of the label layers that still need to be analysed
+    """
+    label_layers_to_analyse = []
     for label_layer in label_layers:
-        summaries.append(summarise_single_brain_region(label_layer))
+        layer_volumes = None
+        for volumes in live_volumes or []:
+            if (
+                volumes.label_layer is label_layer
+                and volumes.annotations is annotations_layer_image
+                and volumes.hemispheres is hemispheres
+            ):
+                layer_volumes = volumes
+        if layer_volumes is None:
+            label_layers_to_analyse.append(label_layer)
+        elif layer_volumes.n_voxels != 0 or not ignore_empty:
+            save_structure_volumes(
+                *layer_volumes.counts,
+                atlas,
+                destination_directory / (label_layer.name + extension),
+            )
+    return label_layers_to_analyse
+
+
+def is_lazy_array(data):
+    """
+    Whether an array is (potentially) not held in memory, e.g. a dask or
+    zarr array, or a memory-mapped file. SparseArrays are held in memory,
+    and can be cropped to their regions without reading the whole array
+    """
+    if isinstance(data, SparseArray):
+        return False
+    return not isinstance(data, np.ndarray) or isinstance(data, np.memmap)
+
+
+def summarise_brain_regions(
+    label_layers,
+    filename,
+    atlas_resolution,
+    executor=None,
+    slab_thickness=SLAB_THICKNESS,
+):
+    if executor is None:
+        summaries = []
+        for label_layer in label_layers:
+            if is_lazy_array(label_layer.data):
+                summaries.append(
+                    summarise_single_brain_region_chunked(
+                        label_layer, slab_thickness=slab_thickness
+                    )
+                )
+            else:
+                summaries.append(summarise_single_brain_region(label_layer))
+    else:
+        summaries = summarise_brain_regions_parallel(
+            label_layers, executor, slab_thickness=slab_thickness
+        )
 
     if check_list_only_nones(summaries):
         show_info("No regions to summarise")
@@ -95,19 +291,271 @@ def summarise_single_brain_region(
         "centroid",
     ],
 ):
-    data = np.asarray(label_layer.data)
-    if ignore_empty:
-        if data.sum() == 0:
+    region_crop = crop_to_region(label_layer.data, ignore_empty=ignore_empty)
+    if region_crop is None:
+        return
+
+    if is_multi_label(label_layer):
+        return name_region_labels(
+            summarise_region_image(
+                *region_crop,
+                label_layer.name,
+                properties_to_fetch=["label"] + properties_to_fetch,
+            ),
+            label_layer,
+        )
+    return summarise_region_image(
+        *region_crop,
+        label_layer.name,
+        properties_to_fetch=properties_to_fetch,
+    )
+
+
+def name_region_labels(summary, label_layer):
+    """
+    Name each row (label ID) of the summary of a multi-label layer after
+    its region
+    :param summary: DataFrame from summarise_region_image, including the
+    "label" property (which is removed)
+    """
+    label_ids = summary.pop("label")
+    summary["region"] = [
+        get_label_name(label_layer, label_id) for label_id in label_ids
+    ]
+    return summary
+
+
+def summarise_brain_regions_parallel(
+    label_layers, executor, ignore_empty=True, slab_thickness=SLAB_THICKNESS
+):
+    """
+    As summarise_single_brain_region, for each label layer, with the
+    regions spread across the processes of an executor. Lazy label layers
+    are summarised in slabs, in this process.
+    :return: List of summaries (None for any empty regions)
+    """
+    summaries = []
+    for label_layer in label_layers:
+        if is_lazy_array(label_layer.data):
+            summaries.append(
+                summarise_single_brain_region_chunked(
+                    label_layer,
+                    ignore_empty=ignore_empty,
+                    slab_thickness=slab_thickness,
+                )
+            )
+            continue
+
+        region_crop = crop_to_region(
+            label_layer.data, ignore_empty=ignore_empty
+        )
+        if region_crop is None:
+            summaries.append(None)
+        elif is_multi_label(label_layer):
+            summaries.append(
+                executor.submit(
+                    summarise_region_image,
+                    *region_crop,
+                    label_layer.name,
+                    properties_to_fetch=["label", "area", "bbox", "centroid"],
+                )
+            )
+        else:
+            summaries.append(
+                executor.submit(
+                    summarise_region_image, *region_crop, label_layer.name
+                )
+            )
+    summaries = [
+        summary.result() if isinstance(summary, Future) else summary
+        for summary in summaries
+    ]
+    return [
+        (
+            name_region_labels(summary, label_layer)
+            if summary is not None
+            and "label" in summary
+            and is_multi_label(label_layer)
+            else summary
+        )
+        for summary, label_layer in zip(summaries, label_layers)
+    ]
+
+
+def summarise_single_brain_region_chunked(
+    label_layer, ignore_empty=True, slab_thickness=SLAB_THICKNESS
+):
+    """
+    As summarise_single_brain_region (area, bbox and centroid only), but
+    the label layer is read in slabs along the first axis, and the
+    statistics of each label are accumulated slab by slab.
+
+    :param label_layer: napari labels layer (data can be any array type)
+    :param ignore_empty: If True, return None for empty regions
+    :param slab_thickness: How many planes to read at once
+    """
+    data = label_layer.data
+    ndim = data.ndim
+    slab_statistics = []
+    for slab in iterate_slabs(data.shape[0], slab_thickness):
+        region = np.asarray(data[slab]).astype(np.uint16)
+        coordinates = np.nonzero(region)
+        if len(coordinates[0]) == 0:
+            continue
+        coordinates = np.stack(coordinates, axis=1)
+        coordinates[:, 0] += slab.start
+        slab_statistics.append(
+            label_statistics(region[region != 0], coordinates)
+        )
+
+    if slab_statistics:
+        label_ids, area, minimum, maximum, total = merge_label_statistics(
+            slab_statistics
+        )
+    else:
+        if ignore_empty:
+            return
+        label_ids = np.zeros(0, dtype=np.uint16)
+        area = np.zeros(0)
+        minimum = maximum = total = np.zeros((0, ndim))
+
+    regions_table = {"area": area.astype(np.float64)}
+    for dim in range(ndim):
+        regions_table[f"bbox-{dim}"] = minimum[:, dim].astype(np.int64)
+    for dim in range(ndim):
+        regions_table[f"bbox-{dim + ndim}"] = (maximum[:, dim] + 1).astype(
+            np.int64
+        )
+    for dim in range(ndim):
+        regions_table[f"centroid-{dim}"] = total[:, dim] / area
+    df = pd.DataFrame(regions_table, index=pd.RangeIndex(len(label_ids)))
+    if is_multi_label(label_layer):
+        df.insert(
+            0,
+            "region",
+            [get_label_name(label_layer, label_id) for label_id in label_ids],
+        )
+    else:
+        df.insert(0, "region", label_layer.name)
+    return df
+
+
+def label_statistics(labels, coordinates):
+    """
+    Calculate the number of voxels, minimum and maximum coordinate, and sum
+    of coordinates of each label value.
+
+    :param labels: (N) array of label values
+    :param coordinates: (N, ndim) array of voxel coordinates
+    :return: Tuple (label_ids, area, minimum, maximum, total)
+    """
+    label_ids, label_index = np.unique(labels, return_inverse=True)
+    label_index = label_index.ravel()
+    n_labels = len(label_ids)
+    ndim = coordinates.shape[1]
+
+    area = np.bincount(label_index, minlength=n_labels)
+    minimum = np.full((n_labels, ndim), np.iinfo(np.int64).max)
+    maximum = np.full((n_labels, ndim), np.iinfo(np.int64).min)
+    total = np.zeros((n_labels, ndim))
+    np.minimum.at(minimum, label_index, coordinates)
+    np.maximum.at(maximum, label_index, coordinates)
+    np.add.at(total, label_index, coordinates)
+    return label_ids, area, minimum, maximum, total
+
+
+def merge_label_statistics(statistics):
+    """
+    Combine the output of label_statistics from multiple parts of an image
+    """
+    label_ids, area, minimum, maximum, total = (
+        np.concatenate(values) for values in zip(*statistics)
+    )
+    merged_ids, index = np.unique(label_ids, return_inverse=True)
+    index = index.ravel()
+    n_labels = len(merged_ids)
+    ndim = minimum.shape[1]
+
+    merged_area = np.bincount(index, weights=area, minlength=n_labels)
+    merged_minimum = np.full((n_labels, ndim), np.iinfo(np.int64).max)
+    merged_maximum = np.full((n_labels, ndim), np.iinfo(np.int64).min)
+    merged_total = np.zeros((n_labels, ndim))
+    np.minimum.at(merged_minimum, index, minimum)
+    np.maximum.at(merged_maximum, index, maximum)
+    np.add.at(merged_total, index, total)
+    return (
+        merged_ids,
+        merged_area,
+        merged_minimum,
+        merged_maximum,
+        merged_total,
+    )
+
+
+def crop_to_region(data, ignore_empty=True):
+    """
+    Crop an image to the bounding box of its nonzero values
+    :param data: Image of a segmented region
+    :param ignore_empty: If True, return None for empty images. Otherwise,
+    the whole image is returned
+    :return: Tuple (bounding box, cropped image as numpy array)
+    """
+    region_bounding_box = get_bounding_box(data)
+    if region_bounding_box is None:
+        if ignore_empty:
             return
+        region_bounding_box = tuple(slice(0, size) for size in data.shape)
+    return region_bounding_box, np.asarray(data[region_bounding_box])
 
+
+def summarise_region_image(
+    region_bounding_box,
+    region,
+    name,
+    properties_to_fetch=[
+        "area",
+        "bbox",
+        "centroid",
+    ],
+):
+    """
+    Summarise a region, cropped to its bounding box. Coordinates are
+    returned relative to the full image.
+    :param region_bounding_box: Position of the crop within the full image
+    :param region: Cropped image of the region
+    :param name: Name of the region
+    :param properties_to_fetch: Properties passed to regionprops_table
+    :return: pandas DataFrame with one row per label value
+    """
     regions_table = regionprops_table(
-        data.astype(np.uint16), properties=properties_to_fetch
+        region.astype(np.uint16), properties=properties_to_fetch
+    )
+    offset_bounding_box_coordinates(
+        regions_table,
+        [dim_slice.start for dim_slice in region_bounding_box],
     )
     df = pd.DataFrame.from_dict(regions_table)
-    df.insert(0, "region", label_layer.name)
+    df.insert(0, "region", name)
     return df
 
 
+def offset_bounding_box_coordinates(regions_table, offset):
+    """
+    Shift the coordinate-based properties of a regionprops table
+    (calculated on a crop of an image) by the position of the crop.
+    :param regions_table: Dict returned by regionprops_table
+    :param offset: Start coordinate of the crop, per axis
+    """
+    ndim = len(offset)
+    for key in regions_table:
+        prop, _, dim = key.rpartition("-")
+        if prop == "bbox":
+            dim = int(dim)
+            regions_table[key] = regions_table[key] + offset[dim % ndim]
+        elif prop == "centroid":
+            regions_table[key] = regions_table[key] + offset[int(dim)]
+
+
 def analyse_region_brain_areas(
     label_layer,
     annotations_layer_image,
@@ -124,147 +572,701 @@ def analyse_region_brain_areas(
     :param ignore_empty: If True, don't analyse empty regions
     """
 
-    data = label_layer.data
-    if ignore_empty:
-        if data.sum() == 0:
-            return
+    region_crop = crop_to_region(label_layer.data, ignore_empty=ignore_empty)
+    if region_crop is None:
+        return
+    region_bounding_box, region = region_crop
 
-    name = label_layer.name
+    # Only voxels within the region's bounding box can contribute, so
+    # restrict all processing to this crop
+    structure_ids, counts_left, counts_right = count_region_structure_voxels(
+        region,
+        annotations_layer_image[region_bounding_box],
+        hemispheres[region_bounding_box],
+        left_hemisphere_value=atlas.left_hemisphere_value,
+        right_hemisphere_value=atlas.right_hemisphere_value,
+    )
+    save_structure_volumes(
+        structure_ids,
+        counts_left,
+        counts_right,
+        atlas,
+        destination_directory / (label_layer.name + extension),
+    )
 
-    masked_annotations = data.astype(bool) * annotations_layer_image
 
-    annotations_left, annotations_right = lateralise_atlas_image(
-        masked_annotations,
+def analyse_region_brain_areas_parallel(
+    label_layers,
+    annotations_layer_image,
+    hemispheres,
+    destination_directory,
+    atlas,
+    executor,
+    extension=".csv",
+    ignore_empty=True,
+    shared_store=None,
+):
+    """
+    As analyse_region_brain_areas, for each label layer, with the regions
+    spread across the processes of an executor. The annotations and
+    hemispheres are published once in shared memory, and only the bounding
+    box crop of each region is sent to the worker processes.
+
+    :param label_layers: List of napari labels layers
+    :param executor: concurrent.futures.Executor
+    :param ignore_empty: If True, don't analyse empty regions
+    :param shared_store: SharedArrayStore to publish the annotations and
+    hemispheres in, so that they are reused by later analyses. If None, the
+    shared memory is released once the regions are analysed
+    """
+    hemispheres = index_hemispheres(
         hemispheres,
         left_hemisphere_value=atlas.left_hemisphere_value,
         right_hemisphere_value=atlas.right_hemisphere_value,
     )
+    # a planar split is sent to each process as just its midline
+    is_annotation_index = isinstance(annotations_layer_image, AnnotationIndex)
+    arrays_to_share = [
+        (
+            annotations_layer_image.compact
+            if is_annotation_index
+            else annotations_layer_image
+        )
+    ]
+    if hemispheres.midline is None:
+        arrays_to_share.append(hemispheres.sides)
+    with shared_arrays(*arrays_to_share, store=shared_store) as shared:
+        shared_annotations = (
+            AnnotationIndex(shared[0], annotations_layer_image.structure_ids)
+            if is_annotation_index
+            else shared[0]
+        )
+        shared_hemispheres = (
+            hemispheres
+            if hemispheres.midline is not None
+            else HemisphereIndex(shared[1])
+        )
+        futures = []
+        for label_layer in label_layers:
+            region_crop = crop_to_region(
+                label_layer.data, ignore_empty=ignore_empty
+            )
+            if region_crop is None:
+                continue
+            region_bounding_box, region = region_crop
+            future = executor.submit(
+                count_region_structure_voxels,
+                region,
+                shared_annotations,
+                shared_hemispheres,
+                region_bounding_box=region_bounding_box,
+            )
+            futures.append((label_layer.name, future))
+
+        for name, future in futures:
+            save_structure_volumes(
+                *future.result(),
+                atlas,
+                destination_directory / (name + extension),
+            )
+
+
+def count_region_structure_voxels(
+    region,
+    annotations,
+    hemispheres,
+    left_hemisphere_value=1,
+    right_hemisphere_value=2,
+    region_bounding_box=None,
+):
+    """
+    Count the number of voxels of each atlas structure, in each
+    hemisphere, within a region.
+
+    :param region: Image of the region (nonzero within the region)
+    :param annotations: Atlas annotations image or AnnotationIndex (same
+    shape as region)
+    :param hemispheres: Hemispheres image or HemisphereIndex (same shape as
+    region)
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    :param region_bounding_box: If the region has been cropped, but the
+    annotations and hemispheres have not, the position of the crop
+    :return: Tuple (structure_ids, counts_left, counts_right)
+    """
+    if region_bounding_box is not None:
+        annotations = annotations[region_bounding_box]
+        hemispheres = hemispheres[region_bounding_box]
 
-    unique_vals_left, counts_left = np.unique(
-        annotations_left, return_counts=True
+    in_region = np.asarray(region).astype(bool)
+    annotations, structure_ids = get_annotation_values(annotations)
+    hemispheres = index_hemispheres(
+        hemispheres,
+        left_hemisphere_value=left_hemisphere_value,
+        right_hemisphere_value=right_hemisphere_value,
     )
-    unique_vals_right, counts_right = np.unique(
-        annotations_right, return_counts=True
+    crops = hemispheres.split()
+    if crops is not None:
+        # split by a plane, so each hemisphere is a crop of the images
+        left, right = crops
+        return count_structure_voxels(
+            annotations[left][in_region[left]],
+            annotations[right][in_region[right]],
+            structure_ids=structure_ids,
+        )
+    return count_structure_voxels_by_side(
+        annotations[in_region],
+        np.asarray(hemispheres.sides)[in_region],
+        structure_ids=structure_ids,
     )
+
+
+def get_annotation_values(annotations):
+    """
+    :param annotations: Atlas annotations image or AnnotationIndex
+    :return: Tuple (values, structure_ids). For an AnnotationIndex, values
+    are the dense indices of the atlas values in structure_ids, otherwise
+    the atlas values themselves, and structure_ids is None
+    """
+    if isinstance(annotations, AnnotationIndex):
+        return np.asarray(annotations.compact), annotations.structure_ids
+    return np.asarray(annotations), None
+
+
+def save_structure_volumes(
+    structure_ids, counts_left, counts_right, atlas, filename
+):
+    """
+    Save the volume of each atlas structure within a region to csv.
+    """
     voxel_volume_in_mm = np.prod(atlas.resolution) / (1000**3)
+    df = structure_volumes_to_df(
+        structure_ids,
+        counts_left,
+        counts_right,
+        atlas.structures,
+        voxel_volume_in_mm,
+    )
+    df.to_csv(filename, index=False)
+
 
-    df = initialise_df(
-        "structure_name",
-        "left_volume_mm3",
-        "left_percentage_of_total",
-        "right_volume_mm3",
-        "right_percentage_of_total",
-        "total_volume_mm3",
-        "percentage_of_total",
+def analyse_region_brain_areas_chunked(
+    label_layer,
+    annotations_layer_image,
+    hemispheres,
+    destination_directory,
+    atlas,
+    extension=".csv",
+    ignore_empty=True,
+    slab_thickness=SLAB_THICKNESS,
+):
+    """
+    As analyse_region_brain_areas, but the label layer, annotations and
+    hemispheres are read in aligned slabs along the first axis, and the
+    voxels of each structure are counted slab by slab. Only one slab
+    (cropped to the region) of each image is held in memory at a time.
+
+    :param label_layer: napari labels layer (data can be any array type)
+    :param ignore_empty: If True, don't analyse empty regions
+    :param slab_thickness: How many planes to read at once
+    """
+    data = label_layer.data
+    structure_ids = []
+    counts = []
+    for slab in iterate_slabs(data.shape[0], slab_thickness):
+        region_crop = crop_to_region(np.asarray(data[slab]))
+        if region_crop is None:
+            continue
+        slab_bounding_box, region = region_crop
+        slab_bounding_box = (
+            slice(
+                slab.start + slab_bounding_box[0].start,
+                slab.start + slab_bounding_box[0].stop,
+            ),
+        ) + slab_bounding_box[1:]
+
+        slab_ids, slab_left, slab_right = count_region_structure_voxels(
+            region,
+            annotations_layer_image[slab_bounding_box],
+            hemispheres[slab_bounding_box],
+            left_hemisphere_value=atlas.left_hemisphere_value,
+            right_hemisphere_value=atlas.right_hemisphere_value,
+        )
+        structure_ids.append(slab_ids)
+        counts.append(np.stack((slab_left, slab_right), axis=1))
+
+    if not structure_ids and ignore_empty:
+        return
+
+    structure_ids, index = np.unique(
+        np.concatenate(structure_ids or [np.zeros(0, dtype=np.int64)]),
+        return_inverse=True,
     )
+    total_counts = np.zeros((len(structure_ids), 2), dtype=np.int64)
+    if counts:
+        np.add.at(total_counts, index.ravel(), np.concatenate(counts))
 
-    sampled_structures = unique_elements_lists(
-        list(unique_vals_left) + list(unique_vals_right)
+    save_structure_volumes(
+        *select_sampled_structures(structure_ids, total_counts),
+        atlas,
+        destination_directory / (label_layer.name + extension),
     )
-    total_volume_region = get_total_volume_regions(
-        unique_vals_left, unique_vals_right, counts_left, counts_right
+
+
+def analyse_multi_label_brain_areas(
+    label_layer,
+    annotations_layer_image,
+    hemispheres,
+    destination_directory,
+    atlas,
+    extension=".csv",
+    slab_thickness=SLAB_THICKNESS,
+):
+    """
+    As analyse_region_brain_areas, for each region (label ID) of a
+    multi-label layer, in a single pass over the layer (see
+    count_structure_voxels_multi_label). Each region is saved under its
+    name in the layer's region names.
+
+    :param label_layer: Multi-label napari labels layer (data can be any
+    array type)
+    :param slab_thickness: How many planes to read at once
+    """
+    label_ids, structure_ids, counts = count_structure_voxels_multi_label(
+        label_layer.data,
+        annotations_layer_image,
+        hemispheres,
+        left_hemisphere_value=atlas.left_hemisphere_value,
+        right_hemisphere_value=atlas.right_hemisphere_value,
+        slab_thickness=slab_thickness,
     )
+    for label_id, label_counts in zip(label_ids, counts):
+        save_structure_volumes(
+            *select_sampled_structures(structure_ids, label_counts),
+            atlas,
+            destination_directory
+            / (get_label_name(label_layer, label_id) + extension),
+        )
 
-    for atlas_value in sampled_structures:
-        if atlas_value != 0:
-            try:
-                df = add_structure_volume_to_df(
-                    df,
-                    atlas_value,
-                    atlas.structures,
-                    unique_vals_left,
-                    unique_vals_right,
-                    counts_left,
-                    counts_right,
-                    voxel_volume_in_mm,
-                    total_volume_voxels=total_volume_region,
-                )
 
-            except KeyError:
-                show_info(
-                    f"Value: {atlas_value} is not in the atlas structure"
-                    f" reference file. Not calculating the volume"
-                )
-    filename = destination_directory / (name + extension)
-    df.to_csv(filename, index=False)
+def count_structure_voxels_multi_label(
+    labels,
+    annotations,
+    hemispheres,
+    left_hemisphere_value=1,
+    right_hemisphere_value=2,
+    slab_thickness=SLAB_THICKNESS,
+):
+    """
+    Count the number of voxels of each atlas structure in each hemisphere,
+    for every label of an image. The image is read in slabs along the
+    first axis (cropped to the labels), and in each slab the voxels of all
+    labels are counted together in a single (label, structure, hemisphere)
+    bincount.
 
+    :param labels: Image of labels (0 outside of any region)
+    :param annotations: Atlas annotations image or AnnotationIndex
+    :param hemispheres: Hemispheres image or HemisphereIndex
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    :param slab_thickness: How many planes to read at once
+    :return: Tuple (label_ids, structure_ids, counts). label_ids is an
+    array of the (L) labels found, structure_ids of (K) atlas values, and
+    counts an (L, K, 2) array of left and right voxel counts
+    """
+    if not is_lazy_array(labels):
+        # only the bounding box of all labels is read
+        bounding_box = get_bounding_box(labels)
+        if bounding_box is None:
+            bounding_box = (slice(0, 0),) * labels.ndim
+        labels = np.asarray(labels[bounding_box])
+        annotations = annotations[bounding_box]
+        hemispheres = hemispheres[bounding_box]
+    found_labels = []
+    slab_labels = []
+    slab_structures = []
+    slab_counts = []
+    for slab in iterate_slabs(labels.shape[0], slab_thickness):
+        region_crop = crop_to_region(np.asarray(labels[slab]))
+        if region_crop is None:
+            continue
+        slab_bounding_box, region = region_crop
+        slab_bounding_box = (
+            slice(
+                slab.start + slab_bounding_box[0].start,
+                slab.start + slab_bounding_box[0].stop,
+            ),
+        ) + slab_bounding_box[1:]
 
-def get_total_volume_regions(
-    unique_vals_left,
-    unique_vals_right,
-    counts_left,
-    counts_right,
+        # the atlas is only read at the voxels of the labels
+        coordinates = np.nonzero(region)
+        values, structure_ids = get_annotation_values(
+            annotations[slab_bounding_box]
+        )
+        values = values[coordinates]
+        sides = get_hemisphere_sides(
+            hemispheres[slab_bounding_box],
+            coordinates,
+            left_hemisphere_value=left_hemisphere_value,
+            right_hemisphere_value=right_hemisphere_value,
+        )
+
+        label_ids, label_index = np.unique(
+            region[coordinates], return_inverse=True
+        )
+        if structure_ids is None:
+            structure_ids, structure_index = np.unique(
+                values, return_inverse=True
+            )
+        else:
+            structure_index = values.astype(np.intp)
+        n_structures = len(structure_ids)
+        key = (
+            label_index.ravel() * n_structures + structure_index.ravel()
+        ) * (NO_HEMISPHERE + 1) + sides
+        # voxels not in either hemisphere are not counted
+        counts = np.bincount(
+            key, minlength=len(label_ids) * n_structures * (NO_HEMISPHERE + 1)
+        ).reshape(len(label_ids), n_structures, NO_HEMISPHERE + 1)[..., :2]
+
+        # only keep the (label, structure) pairs found in this slab
+        found_labels.append(label_ids)
+        label_found, structure_found = np.nonzero(counts.sum(axis=2))
+        slab_labels.append(label_ids[label_found])
+        slab_structures.append(structure_ids[structure_found])
+        slab_counts.append(counts[label_found, structure_found])
+
+    label_ids = np.unique(
+        np.concatenate([np.zeros(0, dtype=labels.dtype)] + found_labels)
+    )
+    structure_ids, structure_index = np.unique(
+        np.concatenate(
+            [np.zeros(0, dtype=annotations.dtype)] + slab_structures
+        ),
+        return_inverse=True,
+    )
+    counts = np.zeros((len(label_ids), len(structure_ids), 2), dtype=np.int64)
+    if slab_counts:
+        np.add.at(
+            counts,
+            (
+                np.searchsorted(label_ids, np.concatenate(slab_labels)),
+                structure_index.ravel(),
+            ),
+            np.concatenate(slab_counts),
+        )
+    return label_ids, structure_ids, counts
+
+
+def iterate_slabs(length, slab_thickness):
+    """
+    Split an axis into consecutive slabs
+    :param length: Length of the axis
+    :param slab_thickness: Maximum number of planes per slab
+    :return: Generator of slices
+    """
+    for start in range(0, length, slab_thickness):
+        yield slice(start, min(start + slab_thickness, length))
+
+
+def count_structure_voxels(
+    annotations_left, annotations_right, structure_ids=None
 ):
-    zero_index_left = np.where(unique_vals_left == 0)[0][0]
-    counts_left = list(counts_left)
-    counts_left.pop(zero_index_left)
+    """
+    Count the number of voxels of each atlas structure in each hemisphere,
+    using a single bincount over a compacted structure index.
 
-    zero_index_right = np.where(unique_vals_right == 0)[0][0]
-    counts_right = list(counts_right)
-    counts_right.pop(zero_index_right)
+    :param annotations_left: Array of atlas values in the left hemisphere
+    :param annotations_right: Array of atlas values in the right hemisphere
+    :param structure_ids: If the annotations are already a dense index of
+    the atlas values (see AnnotationIndex), the atlas values
+    :return: Tuple (structure_ids, counts_left, counts_right). Structure 0
+    (outside the region) is excluded. Structures are ordered as those found
+    in the left hemisphere, followed by those only found in the right.
+    """
+    annotations_left = np.ravel(annotations_left)
+    annotations_right = np.ravel(annotations_right)
+    if structure_ids is None:
+        structure_ids, compact_index = np.unique(
+            np.concatenate((annotations_left, annotations_right)),
+            return_inverse=True,
+        )
+        # combined (structure, hemisphere) key, so both are counted in one
+        # pass
+        key = 2 * compact_index.ravel()
+        key[len(annotations_left) :] += 1
+        counts = np.bincount(key, minlength=2 * len(structure_ids)).reshape(
+            -1, 2
+        )
+    else:
+        counts = np.stack(
+            (
+                np.bincount(annotations_left, minlength=len(structure_ids)),
+                np.bincount(annotations_right, minlength=len(structure_ids)),
+            ),
+            axis=1,
+        )
+    return select_sampled_structures(structure_ids, counts)
 
-    return sum(counts_left + counts_right)
 
+def count_structure_voxels_by_side(annotations, sides, structure_ids=None):
+    """
+    Count the number of voxels of each atlas structure in each hemisphere,
+    using a single bincount over a combined (structure, hemisphere) index.
 
-def add_structure_volume_to_df(
-    df,
-    atlas_value,
-    atlas_structures,
-    unique_vals_left,
-    unique_vals_right,
+    :param annotations: Array of atlas values
+    :param sides: Array of the hemisphere of each voxel, as encoded in a
+    HemisphereIndex. Voxels not in either hemisphere are not counted.
+    :param structure_ids: If the annotations are already a dense index of
+    the atlas values (see AnnotationIndex), the atlas values
+    :return: Tuple (structure_ids, counts_left, counts_right), as returned
+    by count_structure_voxels
+    """
+    if structure_ids is None:
+        structure_ids, compact_index = np.unique(
+            np.ravel(annotations), return_inverse=True
+        )
+    else:
+        compact_index = np.ravel(annotations).astype(np.intp)
+    key = (NO_HEMISPHERE + 1) * compact_index.ravel() + np.ravel(sides)
+    counts = np.bincount(
+        key, minlength=(NO_HEMISPHERE + 1) * len(structure_ids)
+    ).reshape(-1, NO_HEMISPHERE + 1)
+    return select_sampled_structures(structure_ids, counts[:, :2])
+
+
+def select_sampled_structures(structure_ids, counts):
+    """
+    Select the structures (other than 0) with any voxels in either
+    hemisphere. Structures are ordered as those found in the left
+    hemisphere, followed by those only found in the right.
+
+    :param structure_ids: Array of (K) atlas values
+    :param counts: (K, 2) array of left and right voxel counts
+    :return: Tuple (structure_ids, counts_left, counts_right)
+    """
+    in_left = counts[:, 0] > 0
+    only_in_right = ~in_left & (counts[:, 1] > 0)
+    order = np.concatenate(
+        (np.flatnonzero(in_left), np.flatnonzero(only_in_right))
+    )
+    order = order[structure_ids[order] != 0]
+    return structure_ids[order], counts[order, 0], counts[order, 1]
+
+
+def analyse_region_brain_areas_fused(
+    label_layers,
+    annotations_layer_image,
+    hemispheres,
+    destination_directory,
+    atlas,
+    extension=".csv",
+    ignore_empty=True,
+):
+    """
+    Equivalent to calling analyse_region_brain_areas for each label layer,
+    but the annotations and hemispheres are only read once (within the
+    bounding box of all regions), and the voxels of all layers are counted
+    together in a single (layer, structure, hemisphere) bincount.
+
+    :param label_layers: List of napari labels layers
+    :param ignore_empty: If True, don't analyse empty regions
+    """
+    bounding_boxes = [get_bounding_box(layer.data) for layer in label_layers]
+    layers_to_analyse = [
+        (label_layer, bounding_box)
+        for label_layer, bounding_box in zip(label_layers, bounding_boxes)
+        if bounding_box is not None or not ignore_empty
+    ]
+    if not layers_to_analyse:
+        return
+
+    structure_ids, counts = count_structure_voxels_multi_layer(
+        [label_layer.data for label_layer, _ in layers_to_analyse],
+        [bounding_box for _, bounding_box in layers_to_analyse],
+        annotations_layer_image,
+        hemispheres,
+        left_hemisphere_value=atlas.left_hemisphere_value,
+        right_hemisphere_value=atlas.right_hemisphere_value,
+    )
+    for (label_layer, _), layer_counts in zip(layers_to_analyse, counts):
+        save_structure_volumes(
+            *select_sampled_structures(structure_ids, layer_counts),
+            atlas,
+            destination_directory / (label_layer.name + extension),
+        )
+
+
+def count_structure_voxels_multi_layer(
+    regions,
+    bounding_boxes,
+    annotations,
+    hemispheres,
+    left_hemisphere_value=1,
+    right_hemisphere_value=2,
+):
+    """
+    Count the number of voxels of each atlas structure in each hemisphere,
+    for multiple regions at once.
+
+    :param regions: List of region images (nonzero within the region)
+    :param bounding_boxes: Bounding box of each region (or None if empty)
+    :param annotations: Atlas annotations image or AnnotationIndex
+    :param hemispheres: Hemispheres image or HemisphereIndex
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    :return: Tuple (structure_ids, counts). structure_ids is an array of
+    (K) atlas values, counts a (n_regions, K, 2) array of left and right
+    voxel counts
+    """
+    non_empty = [bbox for bbox in bounding_boxes if bbox is not None]
+    if not non_empty:
+        return np.zeros(0, dtype=annotations.dtype), np.zeros(
+            (len(regions), 0, 2), dtype=np.intp
+        )
+
+    union_bounding_box = tuple(
+        slice(
+            min(bbox[axis].start for bbox in non_empty),
+            max(bbox[axis].stop for bbox in non_empty),
+        )
+        for axis in range(annotations.ndim)
+    )
+    # the voxels of each region, within the union bounding box. The atlas
+    # is only read at these voxels, so the (possibly whole brain) union
+    # bounding box is never copied
+    coordinates = []
+    region_indices = []
+    for region_index, (region, bounding_box) in enumerate(
+        zip(regions, bounding_boxes)
+    ):
+        if bounding_box is None:
+            continue
+        region_coordinates = np.nonzero(np.asarray(region[bounding_box]))
+        coordinates.append(
+            [
+                axis_coordinates + box.start - union_box.start
+                for axis_coordinates, box, union_box in zip(
+                    region_coordinates, bounding_box, union_bounding_box
+                )
+            ]
+        )
+        region_indices.append(
+            np.full(len(region_coordinates[0]), region_index)
+        )
+    coordinates = tuple(
+        np.concatenate(axis_coordinates)
+        for axis_coordinates in zip(*coordinates)
+    )
+    region_indices = np.concatenate(region_indices)
+
+    values, structure_ids = get_annotation_values(
+        annotations[union_bounding_box]
+    )
+    values = values[coordinates]
+    sides = get_hemisphere_sides(
+        hemispheres[union_bounding_box],
+        coordinates,
+        left_hemisphere_value=left_hemisphere_value,
+        right_hemisphere_value=right_hemisphere_value,
+    )
+
+    if structure_ids is None:
+        structure_ids, compact_index = np.unique(values, return_inverse=True)
+    else:
+        compact_index = values.astype(np.intp)
+    n_structures = len(structure_ids)
+    key = (region_indices * n_structures + compact_index.ravel()) * (
+        NO_HEMISPHERE + 1
+    ) + sides
+    counts = np.bincount(
+        key, minlength=len(regions) * n_structures * (NO_HEMISPHERE + 1)
+    ).reshape(len(regions), n_structures, NO_HEMISPHERE + 1)
+    # voxels not in either hemisphere are not counted
+    return structure_ids, counts[..., :2]
+
+
+def structure_volumes_to_df(
+    structure_ids,
     counts_left,
     counts_right,
+    atlas_structures,
     voxel_volume,
-    total_volume_voxels=None,
 ):
-    name = atlas_structures[atlas_value]["name"]
+    """
+    Build the per-structure volume table for a single region in one step.
+
+    :param structure_ids: Atlas values of the structures in the region
+    :param counts_left: Number of voxels of each structure in the left
+    hemisphere
+    :param counts_right: Number of voxels of each structure in the right
+    hemisphere
+    :param atlas_structures: Atlas structures (e.g. atlas.structures)
+    :param voxel_volume: Volume of a single voxel (in mm3)
+    :return: pandas DataFrame, one row per structure
+    """
+    total_volume_voxels = np.sum(counts_left) + np.sum(counts_right)
+
+    names = []
+    known = np.ones(len(structure_ids), dtype=bool)
+    for idx, atlas_value in enumerate(structure_ids):
+        try:
+            names.append(atlas_structures[atlas_value]["name"])
+        except KeyError:
+            known[idx] = False
+            show_info(
+                f"Value: {atlas_value} is not in the atlas structure"
+                f" reference file. Not calculating the volume"
+            )
+
+    counts_left = np.asarray(counts_left)[known]
+    counts_right = np.asarray(counts_right)[known]
 
     left_volume, left_percentage = get_volume_in_hemisphere(
-        atlas_value,
-        unique_vals_left,
-        counts_left,
-        total_volume_voxels,
-        voxel_volume,
+        counts_left, total_volume_voxels, voxel_volume
     )
     right_volume, right_percentage = get_volume_in_hemisphere(
-        atlas_value,
-        unique_vals_right,
-        counts_right,
-        total_volume_voxels,
-        voxel_volume,
+        counts_right, total_volume_voxels, voxel_volume
     )
-    if total_volume_voxels is not None:
-        total_percentage = left_percentage + right_percentage
-    else:
-        total_percentage = 0
-
-    data_to_append = {
-        "structure_name": [name],
-        "left_volume_mm3": [left_volume],
-        "left_percentage_of_total": [left_percentage],
-        "right_volume_mm3": [right_volume],
-        "right_percentage_of_total": [right_percentage],
-        "total_volume_mm3": [left_volume + right_volume],
-        "percentage_of_total": [total_percentage],
-    }
-
-    df_to_append = pd.DataFrame(data_to_append)
-    df = safe_pandas_concat(df, df_to_append)
-    return df
 
+    return pd.DataFrame(
+        {
+            "structure_name": names,
+            "left_volume_mm3": left_volume,
+            "left_percentage_of_total": left_percentage,
+            "right_volume_mm3": right_volume,
+            "right_percentage_of_total": right_percentage,
+            "total_volume_mm3": [
+                left + right for left, right in zip(left_volume, right_volume)
+            ],
+            "percentage_of_total": [
+                left + right
+                for left, right in zip(left_percentage, right_percentage)
+            ],
+        },
+        columns=[
+            "structure_name",
+            "left_volume_mm3",
+            "left_percentage_of_total",
+            "right_volume_mm3",
+            "right_percentage_of_total",
+            "total_volume_mm3",
+            "percentage_of_total",
+        ],
+    )
 
-def get_volume_in_hemisphere(
-    atlas_value, unique_vals, counts, total_volume_voxels, voxel_volume
-):
-    try:
-        index = np.where(unique_vals == atlas_value)[0][0]
-        volume = counts[index] * voxel_volume
-        if total_volume_voxels is not None:
-            percentage = 100 * (counts[index] / total_volume_voxels)
-        else:
-            percentage = 0
-    except IndexError:
-        volume = 0
-        percentage = 0
 
+def get_volume_in_hemisphere(counts, total_volume_voxels, voxel_volume):
+    """
+    Convert voxel counts into volumes and percentages of the region.
+    Structures not found in the hemisphere are reported as (integer) 0, as
+    in previous versions of the output csv files.
+    """
+    volume = [
+        count * voxel_volume if count else 0 for count in counts.tolist()
+    ]
+    percentage = [
+        100 * (count / total_volume_voxels) if count else 0
+        for count in counts.tolist()
+    ]
     return volume, percentage
@@ -0,0 +1,180 @@
+import itertools
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from brainglobe_segmentation.regions.IO import (
+    REGION_CHUNK_SIZE,
+    is_zarr_array_at,
+)
+from brainglobe_segmentation.regions.layers import is_editable
+
+
+class RegionChanges:
+    """
+    Chunks of a label layer that have been edited since it was last saved,
+    so that only those chunks need to be rewritten in the (chunked) saved
+    region, and unchanged layers are not saved at all.
+
+    The chunks are found from the layer's paint events (painting, filling,
+    erasing), and from the edits that are undone or redone. Edits that
+    can't be located (e.g. replacing the data) mark the whole layer as
+    changed, so that it is saved in full.
+    """
+
+    def __init__(
+        self, label_layer, saved_filename=None, chunk_size=REGION_CHUNK_SIZE
+    ):
+        """
+        :param label_layer: napari labels layer to track
+        :param saved_filename: Path of the saved region that the layer
+        currently matches (e.g. that it was loaded from), or None if the
+        layer has not been saved
+        :param chunk_size: Size of the (cubic) chunks of the saved region
+        """
+        self.label_layer = label_layer
+        self.chunk_size = chunk_size
+        self.saved_filename = (
+            None if saved_filename is None else Path(saved_filename).resolve()
+        )
+        self.dirty_chunks = set()
+        self.all_dirty = saved_filename is None
+        self.lock = threading.Lock()
+        self._data = label_layer.data
+        self._history_lengths = self.get_history_lengths()
+
+        label_layer.events.paint.connect(self.on_paint)
+        label_layer.events.set_data.connect(self.on_set_data)
+        label_layer.events.data.connect(self.on_data)
+
+    @classmethod
+    def from_layer(cls, label_layer, filename):
+        """
+        :param label_layer: napari labels layer to track
+        :param filename: Path that the layer is saved to
+        :return: RegionChanges of the layer, which is unchanged if it was
+        opened (lazily) from filename, otherwise entirely changed
+        """
+        saved = is_zarr_array_at(label_layer.data, filename)
+        return cls(label_layer, saved_filename=filename if saved else None)
+
+    def get_history_lengths(self):
+        undo_history = getattr(self.label_layer, "_undo_history", None)
+        redo_history = getattr(self.label_layer, "_redo_history", None)
+        if undo_history is None or redo_history is None:
+            return None
+        return len(undo_history), len(redo_history)
+
+    def on_paint(self, event):
+        self.add_atoms(event.value)
+        self._history_lengths = self.get_history_lengths()
+
+    def on_set_data(self, event=None):
+        # set_data is also emitted when the view is refreshed, so only mark
+        # chunks as changed if the edit history has changed (undo/redo)
+        history_lengths = self.get_history_lengths()
+        if history_lengths == self._history_lengths:
+            return
+        if history_lengths is None or self._history_lengths is None:
+            self.mark_all_dirty()
+        else:
+            undo_change = history_lengths[0] - self._history_lengths[0]
+            redo_change = history_lengths[1] - self._history_lengths[1]
+            if (undo_change, redo_change) == (-1, 1):
+                self.add_atoms(self.label_layer._redo_history[-1])
+            elif (undo_change, redo_change) == (1, -1):
+                self.add_atoms(self.label_layer._undo_history[-1])
+            else:
+                self.mark_all_dirty()
+        self._history_lengths = history_lengths
+
+    def on_data(self, event=None):
+        # loading a lazily opened layer into memory (see load_for_editing)
+        # replaces the data with a copy of itself, which isn't a change
+        data = self.label_layer.data
+        loaded = (
+            not is_editable(self._data)
+            and is_editable(data)
+            and data.shape == self._data.shape
+        )
+        self._data = data
+        if not loaded:
+            self.mark_all_dirty()
+        self._history_lengths = self.get_history_lengths()
+
+    def add_atoms(self, atoms):
+        """
+        Mark the chunks edited by a list of napari paint history "atoms" as
+        changed
+        """
+        chunks = set()
+        for atom in atoms:
+            chunks.update(self.changed_chunks(atom))
+        with self.lock:
+            self.dirty_chunks |= chunks
+
+    def changed_chunks(self, atom):
+        """
+        :param atom: Single napari paint history "atom"
+        :return: List of (tuples of) the indices of the chunks it edits
+        """
+        shape = self.label_layer.data.shape
+        if hasattr(atom, "slice_key"):
+            # mask-based edit (paint, fill, polygon), within slice_key
+            ranges = []
+            for key, size in zip(atom.slice_key, shape):
+                if isinstance(key, slice):
+                    start, stop, _ = key.indices(size)
+                else:
+                    start = stop = int(key)
+                    stop += 1
+                if stop <= start:
+                    return []
+                ranges.append(
+                    range(
+                        start // self.chunk_size,
+                        (stop - 1) // self.chunk_size + 1,
+                    )
+                )
+            return list(itertools.product(*ranges))
+        # (indices, old_values, new_values)
+        indices = np.stack([np.ravel(index) for index in atom[0]], axis=1)
+        chunks = np.unique(indices // self.chunk_size, axis=0)
+        return [tuple(chunk) for chunk in chunks.tolist()]
+
+    def mark_all_dirty(self):
+        with self.lock:
+            self.all_dirty = True
+            self.dirty_chunks = set()
+
+    def begin_save(self, filename):
+        """
+        Get the chunks to write to save the layer, and reset the changes
+        (edits made while saving are tracked for the next save).
+
+        :param filename: Path that the layer is being saved to
+        :return: Set of (tuples of) the indices of the changed chunks, or
+        None if the whole layer needs to be saved (e.g. it has not been
+        saved to filename before)
+        """
+        filename = Path(filename).resolve()
+        with self.lock:
+            if (
+                self.all_dirty
+                or filename != self.saved_filename
+                or not filename.exists()
+            ):
+                chunks = None
+            else:
+                chunks = self.dirty_chunks
+            self.dirty_chunks = set()
+            self.all_dirty = False
+            self.saved_filename = filename
+        return chunks
+
+    def disconnect(self):
+        """Stop tracking the label layer"""
+        self.label_layer.events.paint.disconnect(self.on_paint)
+        self.label_layer.events.set_data.disconnect(self.on_set_data)
+        self.label_layer.events.data.disconnect(self.on_data)
@@ -1,10 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from pathlib import Path
 
 import numpy as np
 import tifffile
+import zarr
 from napari.layers import Labels
 
+from brainglobe_segmentation.image.sparse import SparseArray
+
+# Size of the (cubic) chunks that regions are held in (for new regions) and
+# saved in
+REGION_CHUNK_SIZE = 64
+# Modes in which a labels layer can be edited
+EDITING_MODES = ("paint", "fill", "erase", "polygon")
+# Key of the label ID -> region name table of a multi-label layer, in the
+# layer metadata (and the attributes of its saved zarr array)
+REGION_NAMES_KEY = "region_names"
+# Name of the layer holding all regions, in multi-label mode
+MULTI_LABEL_LAYER_NAME = "regions"
+
 
 def add_new_label_layer(
     viewer,
@@ -15,7 +30,8 @@ def add_new_label_layer(
 ):
     """
     Takes an existing napari viewer, and adds a blank label layer
-    (same shape as base_image)
+    (same shape as base_image). The labels are held in a SparseArray, so
+    only the painted chunks use memory
     :param viewer: Napari viewer instance
     :param np.array base_image: Underlying image (for the labels to be
     referencing)
@@ -24,7 +40,9 @@ def add_new_label_layer(
     :param int brush_size: Default size of the label brush
     :return label_layer: napari labels layer
     """
-    labels = np.zeros(base_image.shape, dtype=np.uint16)
+    labels = SparseArray(
+        base_image.shape, dtype=np.uint16, chunk_size=REGION_CHUNK_SIZE
+    )
     label_layer = viewer.add_labels(labels, name=name)
     label_layer.n_dimensional = True
     label_layer.selected_label = selected_label
@@ -44,28 +62,174 @@ def add_new_region_layer(viewer, label_layers, image_like, brush_size):
     label_layers.append(new_label_layer)
 
 
+def add_new_region_label(viewer, label_layers, image_like, brush_size):
+    """
+    Add a new region as a label of a single, shared multi-label layer
+    (created if there isn't one yet), rather than as a new layer, so that
+    the memory used doesn't increase with the number of regions.
+    :return: Tuple (label_layer, label ID of the new region)
+    """
+    label_layer = next(
+        (layer for layer in label_layers if is_multi_label(layer)), None
+    )
+    if label_layer is None:
+        label_layer = add_new_label_layer(
+            viewer,
+            image_like,
+            name=MULTI_LABEL_LAYER_NAME,
+            brush_size=brush_size,
+        )
+        label_layer.metadata[REGION_NAMES_KEY] = {}
+        label_layers.append(label_layer)
+
+    region_names = get_region_names(label_layer)
+    label_id = max(region_names, default=0) + 1
+    region_names[label_id] = get_new_region_name(label_layers)
+    label_layer.selected_label = label_id
+    label_layer.mode = "PAINT"
+    viewer.layers.selection.active = label_layer
+    return label_layer, label_id
+
+
+def get_new_region_name(label_layers):
+    """
+    :return: The first name "region_<n>" not used by any label layer, or
+    any region of a multi-label layer
+    """
+    names = set()
+    num = 0  # number of regions
+    for label_layer in label_layers:
+        names.add(label_layer.name)
+        region_names = get_region_names(label_layer)
+        if region_names is None:
+            num += 1
+        else:
+            names.update(region_names.values())
+            num += len(region_names)
+    while f"region_{num}" in names:
+        num += 1
+    return f"region_{num}"
+
+
+def is_multi_label(label_layer):
+    """
+    Whether a label layer holds multiple regions (one per label ID), named
+    in a region names table
+    """
+    return get_region_names(label_layer) is not None
+
+
+def get_region_names(label_layer):
+    """
+    :return: Dict of the name of each label ID of a multi-label layer, or
+    None if the layer holds a single region
+    """
+    return label_layer.metadata.get(REGION_NAMES_KEY)
+
+
+def get_label_name(label_layer, label_id):
+    """
+    :return: Name of the region with this label ID in a multi-label layer.
+    Labels not in the table are named after the layer and label ID
+    """
+    return get_region_names(label_layer).get(
+        int(label_id), f"{label_layer.name}_{label_id}"
+    )
+
+
 def add_existing_label_layers(
     viewer,
     label_file,
     selected_label=1,
     brush_size=30,
+    labels=None,
 ):
     """
-    Loads an existing image as a napari labels layer
+    Loads an existing image as a napari labels layer. Zarr arrays are
+    opened lazily (chunks are read as they are displayed), and tiffs are
+    memory-mapped where possible, so they are only loaded into memory if
+    the layer is edited.
     :param viewer: Napari viewer instance
     :param label_file: Filename of the image to be loaded
     :param int selected_label: Label ID to be preselected
     :param int brush_size: Default size of the label brush
+    :param labels: Image already opened from label_file (see
+    load_regions_from_file), if None, the file is opened
     :return label_layer: napari labels layer
     """
     label_file = Path(label_file)
-    labels = tifffile.imread(label_file)
+    if labels is None:
+        labels = load_regions_from_file(label_file)
     label_layer = viewer.add_labels(labels, name=label_file.stem)
+    region_names = load_region_names(labels)
+    if region_names is not None:
+        label_layer.metadata[REGION_NAMES_KEY] = region_names
     label_layer.selected_label = selected_label
     label_layer.brush_size = brush_size
+    if not is_editable(labels):
+        load_for_editing(label_layer)
     return label_layer
 
 
+def load_regions_from_file(label_file):
+    """
+    :param label_file: Path of a saved region image (.zarr or .tiff)
+    :return: Read-only zarr array (for .zarr), otherwise a read-only
+    memory-mapped numpy array, or if the tiff can't be memory-mapped (e.g.
+    it is compressed), a numpy array
+    """
+    if Path(label_file).suffix == ".zarr":
+        return zarr.open_array(str(label_file), mode="r")
+    try:
+        return tifffile.memmap(label_file, mode="r")
+    except ValueError:
+        return tifffile.imread(label_file)
+
+
+def load_region_names(labels):
+    """
+    :param labels: Image opened by load_regions_from_file
+    :return: Dict of the name of each label ID, if saved with the image
+    (see save_region_names), otherwise None
+    """
+    if not isinstance(labels, zarr.Array):
+        return None
+    region_names = labels.attrs.get(REGION_NAMES_KEY)
+    if region_names is None:
+        return None
+    return {int(label_id): name for label_id, name in region_names.items()}
+
+
+def is_editable(data):
+    """
+    Whether labels can be edited in place, i.e. they are a SparseArray or
+    writeable numpy array (rather than e.g. a read-only zarr array or
+    memory map)
+    """
+    if isinstance(data, SparseArray):
+        return True
+    return isinstance(data, np.ndarray) and data.flags.writeable
+
+
+def load_for_editing(label_layer):
+    """
+    Load the data of a lazily opened labels layer into memory, when the
+    layer is switched to an editing mode (e.g. painting). The data is
+    loaded into a SparseArray, so only the chunks holding any regions are
+    allocated, rather than the full image
+    """
+
+    def on_mode_change(event=None):
+        if str(label_layer.mode) in EDITING_MODES and not is_editable(
+            label_layer.data
+        ):
+            label_layer.data = SparseArray.from_array(
+                label_layer.data, chunk_size=REGION_CHUNK_SIZE
+            )
+
+    label_layer.events.mode.connect(on_mode_change)
+
+
 def add_region_from_existing_layer(new_layer, label_layers):
     """
     Adds an existing label layer (e.g. from another plugin) to the list
@@ -77,9 +241,43 @@ def add_region_from_existing_layer(new_layer, label_layers):
 
 
 def add_existing_region_segmentation(
-    directory, viewer, label_layers, file_extension
+    directory,
+    viewer,
+    label_layers,
+    file_extension,
+    legacy_file_extension=None,
+    n_threads=None,
 ):
-    label_files = glob(str(directory) + "/*" + file_extension)
-    if directory and label_files != []:
-        for label_file in label_files:
-            label_layers.append(add_existing_label_layers(viewer, label_file))
+    """
+    Load all saved regions in a directory. The files are found and opened
+    (lazily, see load_regions_from_file) in a pool of threads, and then
+    added to the viewer in order.
+    :param file_extension: File extension of the saved regions
+    :param legacy_file_extension: If given, also load regions saved with
+    this extension (e.g. by previous versions), unless they have also been
+    saved with file_extension
+    :param n_threads: Number of threads to open files with (None for the
+    ThreadPoolExecutor default)
+    """
+    if not directory:
+        return
+    extensions = [file_extension]
+    if legacy_file_extension is not None:
+        extensions.append(legacy_file_extension)
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        found = executor.map(
+            lambda extension: sorted(glob(f"{directory}/*{extension}")),
+            extensions,
+        )
+        label_files = []
+        names = set()
+        for files in found:
+            # regions saved with file_extension take precedence
+            files = [file for file in files if Path(file).stem not in names]
+            names.update(Path(file).stem for file in files)
+            label_files += files
+        images = executor.map(load_regions_from_file, label_files)
+        for label_file, labels in zip(label_files, images):
+            label_layers.append(
+                add_existing_label_layers(viewer, label_file, labels=labels)
+            )
@@ -0,0 +1,199 @@
+import numpy as np
+
+from brainglobe_segmentation.atlas.utils import (
+    NO_HEMISPHERE,
+    index_hemispheres,
+)
+from brainglobe_segmentation.regions.analysis import (
+    count_region_structure_voxels,
+    crop_to_region,
+    select_sampled_structures,
+)
+
+
+class LiveRegionVolumes:
+    """
+    Running count of the voxels of a label layer within each atlas
+    structure and hemisphere. The counts are updated from the layer's paint
+    events (painting, filling, erasing), using only the voxels that changed,
+    so that region volumes are available without re-running the analysis.
+
+    Edits that are not reported as paint events (e.g. undo, redo or
+    replacing the data) mark the counts as stale, and they are then
+    recounted from the whole layer the next time they are needed.
+    """
+
+    def __init__(
+        self,
+        label_layer,
+        annotations,
+        hemispheres,
+        left_hemisphere_value=1,
+        right_hemisphere_value=2,
+    ):
+        """
+        :param label_layer: napari labels layer to track
+        :param annotations: Atlas annotations image or AnnotationIndex (same
+        shape as layer)
+        :param hemispheres: Hemispheres image or HemisphereIndex (same shape
+        as layer)
+        :param left_hemisphere_value: Value encoded in hemispheres image
+        :param right_hemisphere_value: Value encoded in hemispheres image
+        """
+        self.label_layer = label_layer
+        self.annotations = annotations
+        self.hemispheres = hemispheres
+        self.left_hemisphere_value = left_hemisphere_value
+        self.right_hemisphere_value = right_hemisphere_value
+        self.callbacks = []
+
+        self.recount()
+        label_layer.events.paint.connect(self.on_paint)
+        label_layer.events.set_data.connect(self.on_set_data)
+        label_layer.events.data.connect(self.on_set_data)
+
+    @property
+    def n_voxels(self):
+        """Total number of voxels in the region"""
+        if self.stale:
+            self.recount()
+        return self._n_voxels
+
+    @property
+    def counts(self):
+        """
+        :return: Tuple (structure_ids, counts_left, counts_right), as
+        returned by count_structure_voxels
+        """
+        if self.stale:
+            self.recount()
+        return select_sampled_structures(self._structure_ids, self._counts)
+
+    def recount(self):
+        """Count all voxels of the label layer from scratch"""
+        region_crop = crop_to_region(self.label_layer.data)
+        if region_crop is None:
+            self._structure_ids = np.zeros(0, dtype=self.annotations.dtype)
+            self._counts = np.zeros((0, 2), dtype=np.int64)
+            self._n_voxels = 0
+        else:
+            region_bounding_box, region = region_crop
+            structure_ids, counts_left, counts_right = (
+                count_region_structure_voxels(
+                    region,
+                    self.annotations,
+                    self.hemispheres,
+                    left_hemisphere_value=self.left_hemisphere_value,
+                    right_hemisphere_value=self.right_hemisphere_value,
+                    region_bounding_box=region_bounding_box,
+                )
+            )
+            self._structure_ids = structure_ids
+            self._counts = np.stack((counts_left, counts_right), axis=1)
+            self._n_voxels = int(np.count_nonzero(region))
+        self.stale = False
+        self._history_lengths = self.get_history_lengths()
+
+    def get_history_lengths(self):
+        undo_history = getattr(self.label_layer, "_undo_history", None)
+        redo_history = getattr(self.label_layer, "_redo_history", None)
+        if undo_history is None or redo_history is None:
+            return None
+        return len(undo_history), len(redo_history)
+
+    def on_set_data(self, event=None):
+        # set_data is also emitted when the view is refreshed, so only mark
+        # the counts as stale if the edit history has changed (undo/redo).
+        # If the history is not available, assume the data has changed.
+        history_lengths = self.get_history_lengths()
+        if history_lengths is None or history_lengths != (
+            self._history_lengths
+        ):
+            self.stale = True
+            self.notify()
+
+    def on_paint(self, event):
+        if not self.stale:
+            for atom in event.value:
+                self.update(*self.changed_voxels(atom))
+            self._history_lengths = self.get_history_lengths()
+        self.notify()
+
+    def changed_voxels(self, atom):
+        """
+        Get the voxels changed by a single napari paint history "atom"
+        :return: Tuple (old_values, new_values, annotations, hemispheres)
+        """
+        if hasattr(atom, "slice_key"):
+            # mask-based edit (paint, fill, polygon)
+            annotations = np.asarray(self.annotations[atom.slice_key])
+            hemispheres = self.hemispheres[atom.slice_key]
+            if atom.mask is not None:
+                annotations = annotations[atom.mask]
+                hemispheres = hemispheres[atom.mask]
+            old_values = np.asarray(atom.old_values)
+            new_values = atom.new_value
+        else:
+            # (indices, old_values, new_values)
+            indices, old_values, new_values = atom
+            annotations = np.asarray(self.annotations[indices])
+            hemispheres = self.hemispheres[indices]
+            old_values = np.asarray(old_values)
+
+        new_values = np.broadcast_to(new_values, old_values.shape)
+        return old_values, new_values, annotations, hemispheres
+
+    def update(self, old_values, new_values, annotations, hemispheres):
+        """
+        Update the counts from a set of changed voxels
+        :param old_values: Label values before the edit
+        :param new_values: Label values after the edit
+        :param annotations: Atlas values of the changed voxels
+        :param hemispheres: Hemisphere values (or HemisphereIndex) of the
+        changed voxels
+        """
+        change = (np.ravel(new_values) != 0).astype(np.int64) - (
+            np.ravel(old_values) != 0
+        )
+        changed = change != 0
+        if not changed.any():
+            return
+        change = change[changed]
+        annotations = np.ravel(annotations)[changed]
+        sides = np.ravel(
+            index_hemispheres(
+                hemispheres,
+                left_hemisphere_value=self.left_hemisphere_value,
+                right_hemisphere_value=self.right_hemisphere_value,
+            ).sides
+        )[changed]
+        self._n_voxels += int(change.sum())
+
+        in_brain = sides != NO_HEMISPHERE
+
+        structure_ids, index = np.unique(
+            np.concatenate((self._structure_ids, annotations[in_brain])),
+            return_inverse=True,
+        )
+        index = index.ravel()
+        counts = np.zeros((len(structure_ids), 2), dtype=np.int64)
+        n_existing = len(self._structure_ids)
+        counts[index[:n_existing]] = self._counts
+        np.add.at(
+            counts,
+            (index[n_existing:], sides[in_brain]),
+            change[in_brain],
+        )
+        self._structure_ids = structure_ids
+        self._counts = counts
+
+    def notify(self):
+        for callback in self.callbacks:
+            callback(self)
+
+    def disconnect(self):
+        """Stop tracking the label layer"""
+        self.label_layer.events.paint.disconnect(self.on_paint)
+        self.label_layer.events.set_data.disconnect(self.on_set_data)
+        self.label_layer.events.data.disconnect(self.on_set_data)
+        self.callbacks = []
@@ -1,3 +1,5 @@
+import weakref
+from concurrent.futures import Future
 from pathlib import Path
 from typing import List, Optional
 
@@ -10,15 +12,28 @@ from qt_niu.interaction import add_button
 from qtpy import QtCore
 from qtpy.QtWidgets import QFileDialog, QGridLayout, QGroupBox, QLabel, QWidget
 
-from brainglobe_segmentation.atlas.utils import structure_from_viewer
+from brainglobe_segmentation.atlas.cache import (
+    AtlasCache,
+    get_annotation_index,
+    get_hemisphere_index,
+)
+from brainglobe_segmentation.atlas.utils import (
+    structure_from_viewer,
+)
 from brainglobe_segmentation.layout.gui_constants import (
     BOUNDARIES_STRING,
     COLUMN_WIDTH,
     DISPLAY_REGION_INFO,
     HEMISPHERES_STRING,
     LOADING_PANEL_ALIGN,
+    PREBUILD_ATLAS_INDICES,
+    REGION_FILE_EXT,
     SEGM_METHODS_PANEL_ALIGN,
-    TRACK_FILE_EXT,
+    TRACK_STORE_FILENAME,
+)
+from brainglobe_segmentation.parallel import (
+    SharedArrayStore,
+    get_background_executor,
 )
 from brainglobe_segmentation.paths import Paths
 from brainglobe_segmentation.regions.IO import (
@@ -40,6 +55,7 @@ class SegmentationWidget(QWidget):
         viewer: napari.viewer.Viewer,
         boundaries_string=BOUNDARIES_STRING,
         hemispheres_string=HEMISPHERES_STRING,
+        prebuild_indices=PREBUILD_ATLAS_INDICES,
     ):
         super(SegmentationWidget, self).__init__()
 
@@ -56,6 +72,29 @@ class SegmentationWidget(QWidget):
         # Other data
         self.hemispheres_layer: Optional[napari.layers.Labels] = None
         self.hemispheres_data: Optional[np.ndarray] = None
+        # HemisphereIndex of hemispheres_data, and the annotations relabelled
+        # to a dense index (AnnotationIndex) for fast counting (atlas space
+        # only). Built in the background when first needed (or when a
+        # project is loaded, if prebuild_indices), and reused for every
+        # analysis (see get_atlas_index_futures)
+        self.prebuild_indices = prebuild_indices
+        self.atlas_index_executor = get_background_executor("atlas_indices")
+        weakref.finalize(
+            self,
+            self.atlas_index_executor.shutdown,
+            wait=False,
+            cancel_futures=True,
+        )
+        self.annotation_index_future: Optional[Future] = None
+        self.hemisphere_index_future: Optional[Future] = None
+        # Arrays derived from the atlas, saved between sessions (atlas space
+        # only, as otherwise they depend on the registration)
+        self.atlas_cache: Optional[AtlasCache] = None
+        # Atlas arrays published in shared memory for worker processes,
+        # kept for all analyses of the loaded project. Also released if the
+        # widget is deleted without being closed (e.g. at exit)
+        self.shared_store = SharedArrayStore()
+        weakref.finalize(self, self.shared_store.release)
 
         # Track variables
         self.track_layers: List[napari.layers.Tracks] = []
@@ -360,16 +399,109 @@ class SegmentationWidget(QWidget):
         self.annotations_layer = self.viewer.layers[self.metadata["atlas"]]
         if self.atlas_space:
             self.hemispheres_data = self.atlas.hemispheres
+            self.atlas_cache = AtlasCache.from_atlas(self.atlas)
         else:
             self.hemispheres_layer = self.viewer.layers[
                 self.hemispheres_string
             ]
             self.hemispheres_data = self.hemispheres_layer.data
+            self.atlas_cache = None
+        self.reset_atlas_indices()
+        if self.prebuild_indices:
+            self.get_atlas_index_futures()
+        # the arrays shared for the previous project are no longer used
+        self.shared_store.release()
+        self.track_seg.prebuild_brain_surface_tree()
 
         self.initialise_segmentation_interface()
         self.status_label.setText("Ready")
         self.prevent_layer_edit()
 
+    def reset_atlas_indices(self):
+        """
+        Cancel building the atlas indices of the previous project (if any)
+        """
+        for future in (
+            self.annotation_index_future,
+            self.hemisphere_index_future,
+        ):
+            if future is not None:
+                future.cancel()
+        self.annotation_index_future = None
+        self.hemisphere_index_future = None
+
+    def get_atlas_index_futures(self):
+        """
+        Get the annotation and hemisphere indices of the loaded project, as
+        futures, so that building them never blocks the viewer. In atlas
+        space, the indices are loaded (from the atlas cache) or calculated
+        in the background, the first time this is called. In sample space,
+        they would not be cached, and would be held alongside the
+        annotations and hemispheres, so the images themselves are used.
+
+        :return: Tuple (annotation_index_future, hemisphere_index_future)
+        """
+        if self.annotation_index_future is None:
+            if self.atlas_space:
+                self.submit_atlas_indices()
+            else:
+                self.annotation_index_future = completed_future(
+                    self.annotations_layer.data
+                )
+                self.hemisphere_index_future = completed_future(
+                    self.hemispheres_data
+                )
+        return self.annotation_index_future, self.hemisphere_index_future
+
+    def submit_atlas_indices(self):
+        self.annotation_index_future = self.atlas_index_executor.submit(
+            get_annotation_index,
+            self.annotations_layer.data,
+            cache=self.atlas_cache,
+        )
+        self.hemisphere_index_future = self.atlas_index_executor.submit(
+            get_hemisphere_index,
+            self.hemispheres_data,
+            left_hemisphere_value=self.atlas.left_hemisphere_value,
+            right_hemisphere_value=self.atlas.right_hemisphere_value,
+            cache=self.atlas_cache,
+        )
+
+    @property
+    def annotation_index(self):
+        """
+        AnnotationIndex of the annotations layer (or in sample space, the
+        annotations), waiting for it to be built. Use get_atlas_index_futures
+        to avoid waiting on the main thread
+        """
+        if self.annotations_layer is None:
+            return None
+        return self.get_atlas_index_futures()[0].result()
+
+    @property
+    def hemisphere_index(self):
+        """
+        HemisphereIndex of the hemispheres (or in sample space, the
+        hemispheres), waiting for it to be built. Use get_atlas_index_futures
+        to avoid waiting on the main thread
+        """
+        if self.annotations_layer is None:
+            return None
+        return self.get_atlas_index_futures()[1].result()
+
+    def release_resources(self):
+        """
+        Release the resources held for the loaded project (e.g. shared
+        memory), when the widget is closed
+        """
+        self.shared_store.release()
+        self.atlas_index_executor.shutdown(wait=False, cancel_futures=True)
+        self.track_seg.release_resources()
+
+    def closeEvent(self, event):
+        self.release_resources()
+        super().closeEvent(event)
+
     def collate_widget_layers(self):
         """
         Populate self.editable_widget_layers and
@@ -470,6 +602,8 @@ class SegmentationWidget(QWidget):
                 self.viewer.layers.remove(layer)
                 self.track_layers = []
                 self.label_layers = []
+            self.region_seg.clear_live_volumes()
+            self.region_seg.clear_region_changes()
         return True
 
     def save(self, override=True):
@@ -494,7 +628,9 @@ class SegmentationWidget(QWidget):
             self.paths.tracks_directory,
             self.label_layers,
             self.track_layers,
-            track_file_extension=TRACK_FILE_EXT,
+            region_file_extension=REGION_FILE_EXT,
+            track_store_filename=TRACK_STORE_FILENAME,
+            region_changes=self.region_seg.region_changes,
         )
         worker.start()
 
@@ -516,13 +652,22 @@ class SegmentationWidget(QWidget):
                 self.label_layers,
                 self.track_seg.splines,
                 self.track_seg.spline_names,
-                self.atlas.resolution[0],
+                self.atlas.resolution,
             )
             worker.start()
         else:
             print('Not exporting because user chose "Cancel" \n')
 
 
+def completed_future(result):
+    """
+    :return: Future that is already done, with this result
+    """
+    future = Future()
+    future.set_result(result)
+    return future
+
+
 @thread_worker
 def export_all(
     regions_directory,
@@ -532,6 +677,10 @@ def export_all(
     spline_names,
     resolution,
 ):
+    """
+    :param resolution: Size of a voxel along each axis (e.g.
+    atlas.resolution), so that anisotropic atlases are exported correctly
+    """
     if label_layers:
         export_label_layers(regions_directory, label_layers, resolution)
 
@@ -546,15 +695,22 @@ def save_all(
     tracks_directory,
     label_layers,
     points_layers,
-    track_file_extension=".points",
+    region_file_extension=".zarr",
+    track_store_filename="tracks.npz",
+    region_changes=None,
 ):
     if label_layers:
-        save_label_layers(regions_directory, label_layers)
+        save_label_layers(
+            regions_directory,
+            label_layers,
+            image_extension=region_file_extension,
+            region_changes=region_changes,
+        )
 
     if points_layers:
         save_track_layers(
             tracks_directory,
             points_layers,
-            track_file_extension=track_file_extension,
+            track_store_filename=track_store_filename,
         )
     print("Finished!\n")
@@ -1,23 +1,33 @@
+import numpy as np
+from brainglobe_utils.general.system import get_cores_available
+from napari.qt.threading import thread_worker
 from napari.utils.notifications import show_info
 from qt_niu.dialog import display_info, display_warning
-from qt_niu.interaction import add_button, add_checkbox
-from qtpy.QtWidgets import QGridLayout, QGroupBox
+from qt_niu.interaction import add_button, add_checkbox, add_int_box
+from qtpy.QtWidgets import QGridLayout, QGroupBox, QLabel
 
 from brainglobe_segmentation.layout.gui_constants import (
     BRUSH_SIZE,
     CALCULATE_VOLUMES_DEFAULT,
     COLUMN_WIDTH,
+    FUSED_REGION_ANALYSIS,
     IMAGE_FILE_EXT,
+    MULTI_LABEL_REGIONS_DEFAULT,
+    N_PROCESSES_DEFAULT,
+    REGION_FILE_EXT,
     SAVE_DEFAULT,
     SEGM_METHODS_PANEL_ALIGN,
     SUMMARIZE_VOLUMES_DEFAULT,
 )
 from brainglobe_segmentation.regions.analysis import region_analysis
+from brainglobe_segmentation.regions.changes import RegionChanges
 from brainglobe_segmentation.regions.layers import (
     add_existing_region_segmentation,
+    add_new_region_label,
     add_new_region_layer,
     add_region_from_existing_layer,
 )
+from brainglobe_segmentation.regions.live_volumes import LiveRegionVolumes
 
 
 class RegionSeg(QGroupBox):
@@ -34,6 +44,10 @@ class RegionSeg(QGroupBox):
         save_default=SAVE_DEFAULT,
         brush_size=BRUSH_SIZE,
         image_file_extension=IMAGE_FILE_EXT,
+        region_file_extension=REGION_FILE_EXT,
+        fused_analysis=FUSED_REGION_ANALYSIS,
+        n_processes_default=N_PROCESSES_DEFAULT,
+        multi_label_default=MULTI_LABEL_REGIONS_DEFAULT,
     ):
         super(RegionSeg, self).__init__()
         self.parent = parent
@@ -41,6 +55,9 @@ class RegionSeg(QGroupBox):
         self.calculate_volumes_default = calculate_volumes_default
         self.summarise_volumes_default = summarise_volumes_default
         self.save_default = save_default
+        self.fused_analysis = fused_analysis
+        self.n_processes_default = n_processes_default
+        self.multi_label_default = multi_label_default
 
         # Brushes / ...
         self.brush_size_default = BRUSH_SIZE  # Keep track of default
@@ -48,6 +65,12 @@ class RegionSeg(QGroupBox):
 
         # File formats
         self.image_file_extension = image_file_extension
+        self.region_file_extension = region_file_extension
+
+        # Voxel counts of new regions, updated while painting
+        self.live_volumes = []
+        # Chunks of each region edited since it was saved
+        self.region_changes = []
 
     def add_region_panel(self, row):
         self.region_panel = QGroupBox("Region analysis")
@@ -57,7 +80,7 @@ class RegionSeg(QGroupBox):
             "Add new region",
             region_layout,
             self.add_new_region,
-            row=3,
+            row=5,
             column=0,
             tooltip="Create a new empty segmentation layer "
             "to manually segment a new region.",
@@ -67,7 +90,7 @@ class RegionSeg(QGroupBox):
             "Analyse regions",
             region_layout,
             self.run_region_analysis,
-            row=3,
+            row=5,
             column=1,
             tooltip="Analyse the spatial distribution of the "
             "segmented regions.",
@@ -76,7 +99,7 @@ class RegionSeg(QGroupBox):
             "Add region from selected layer",
             region_layout,
             self.add_region_from_existing_layer,
-            row=4,
+            row=6,
             column=0,
             tooltip="Adds a region from a selected labels layer (e.g. "
             "from another plugin). Make sure this region "
@@ -109,6 +132,32 @@ class RegionSeg(QGroupBox):
             row=2,
             tooltip="Save the segmentation layers during analysis.",
         )
+        self.multi_label_checkbox = add_checkbox(
+            region_layout,
+            self.multi_label_default,
+            "Single layer for all regions",
+            row=3,
+            tooltip="Add new regions as labels of a single layer, rather "
+            "than as separate layers (uses much less memory for many "
+            "regions).",
+        )
+        self.n_processes = add_int_box(
+            region_layout,
+            self.n_processes_default,
+            1,
+            get_cores_available(),
+            "Processes",
+            row=4,
+            tooltip="Number of processes to analyse regions in parallel "
+            "(each region is analysed by a single process).",
+        )
+
+        self.live_volume_label = QLabel()
+        self.live_volume_label.setWordWrap(True)
+        self.live_volume_label.setToolTip(
+            "Volume of the region being painted, updated live."
+        )
+        region_layout.addWidget(self.live_volume_label, 7, 0, 1, 2)
 
         region_layout.setColumnMinimumWidth(1, COLUMN_WIDTH)
         self.region_panel.setLayout(region_layout)
@@ -151,22 +200,122 @@ class RegionSeg(QGroupBox):
                 )
 
     def check_saved_region(self):
+        n_existing = len(self.parent.label_layers)
         add_existing_region_segmentation(
             self.parent.paths.regions_directory,
             self.parent.viewer,
             self.parent.label_layers,
-            self.image_file_extension,
+            self.region_file_extension,
+            legacy_file_extension=self.image_file_extension,
         )
+        for label_layer in self.parent.label_layers[n_existing:]:
+            self.track_changes(label_layer)
 
     def add_new_region(self):
         show_info("Adding a new region")
         self.region_panel.setVisible(True)  # Should be visible by default!
+        if self.multi_label_checkbox.isChecked():
+            n_layers = len(self.parent.label_layers)
+            add_new_region_label(
+                self.parent.viewer,
+                self.parent.label_layers,
+                self.parent.base_layer.data,
+                self.brush_size,
+            )
+            # live volumes are of a single region, so aren't tracked for
+            # the shared layer
+            if len(self.parent.label_layers) > n_layers:
+                self.track_changes(self.parent.label_layers[-1])
+            return
         add_new_region_layer(
             self.parent.viewer,
             self.parent.label_layers,
             self.parent.base_layer.data,
             self.brush_size,
         )
+        self.track_live_volumes(self.parent.label_layers[-1])
+        self.track_changes(self.parent.label_layers[-1])
+
+    def track_changes(self, label_layer):
+        self.region_changes.append(
+            RegionChanges.from_layer(
+                label_layer,
+                self.parent.paths.regions_directory
+                / (label_layer.name + self.region_file_extension),
+            )
+        )
+
+    def clear_region_changes(self):
+        for region_changes in self.region_changes:
+            region_changes.disconnect()
+        self.region_changes = []
+
+    def track_live_volumes(self, label_layer):
+        """
+        Count the volumes of a region while it is painted. If the atlas
+        indices are still being built (in the background), counting starts
+        once they are ready, rather than blocking the viewer until then
+        """
+        futures = self.parent.get_atlas_index_futures()
+        if all(future.done() for future in futures):
+            self.start_live_volumes(
+                label_layer, futures, [future.result() for future in futures]
+            )
+        else:
+            worker = wait_for_futures(futures)
+            worker.returned.connect(
+                lambda indices: self.start_live_volumes(
+                    label_layer, futures, indices
+                )
+            )
+            worker.start()
+
+    def start_live_volumes(self, label_layer, futures, indices):
+        """
+        :param label_layer: napari labels layer to track
+        :param futures: Futures the atlas indices were built in
+        :param indices: Tuple (annotation_index, hemisphere_index)
+        """
+        if label_layer not in self.parent.label_layers or futures != (
+            self.parent.annotation_index_future,
+            self.parent.hemisphere_index_future,
+        ):
+            # the region, or the project, has been closed since
+            return
+        annotation_index, hemisphere_index = indices
+        live_volumes = LiveRegionVolumes(
+            label_layer,
+            annotation_index,
+            hemisphere_index,
+            left_hemisphere_value=self.parent.atlas.left_hemisphere_value,
+            right_hemisphere_value=self.parent.atlas.right_hemisphere_value,
+        )
+        live_volumes.callbacks.append(self.display_live_volumes)
+        self.live_volumes.append(live_volumes)
+
+    def clear_live_volumes(self):
+        for live_volumes in self.live_volumes:
+            live_volumes.disconnect()
+        self.live_volumes = []
+        self.live_volume_label.setText("")
+
+    def display_live_volumes(self, live_volumes):
+        voxel_volume_in_mm = np.prod(self.parent.atlas.resolution) / (1000**3)
+        structure_ids, counts_left, counts_right = live_volumes.counts
+        text = (
+            f"{live_volumes.label_layer.name}: "
+            f"{live_volumes.n_voxels * voxel_volume_in_mm:.3f} mm3"
+        )
+        if len(structure_ids):
+            largest = structure_ids[np.argmax(counts_left + counts_right)]
+            try:
+                text += (
+                    f", mostly in "
+                    f"{self.parent.atlas.structures[largest]['name']}"
+                )
+            except KeyError:
+                pass
+        self.live_volume_label.setText(text)
 
     def add_region_from_existing_layer(self, override=False):
         show_info("Adding region from existing layer")
@@ -175,6 +324,7 @@ class RegionSeg(QGroupBox):
             add_region_from_existing_layer(
                 selected_layer, self.parent.label_layers
             )
+            self.track_changes(selected_layer)
             if not override:
                 display_info(
                     self.parent,
@@ -213,15 +363,22 @@ class RegionSeg(QGroupBox):
                     self.parent.label_layers,
                     self.parent.annotations_layer.data,
                 ):
+                    annotation_index_future, hemisphere_index_future = (
+                        self.parent.get_atlas_index_futures()
+                    )
                     worker = region_analysis(
                         self.parent.label_layers,
-                        self.parent.annotations_layer.data,
+                        annotation_index_future,
                         self.parent.atlas,
-                        self.parent.hemispheres_data,
+                        hemisphere_index_future,
                         self.parent.paths.regions_directory,
                         output_csv_file=self.parent.paths.region_summary_csv,
                         volumes=self.calculate_volumes_checkbox.isChecked(),
                         summarise=self.summarise_volumes_checkbox.isChecked(),
+                        fused=self.fused_analysis,
+                        n_processes=self.n_processes.value(),
+                        live_volumes=self.live_volumes,
+                        shared_store=self.parent.shared_store,
                     )
                     worker.start()
                 else:
@@ -233,6 +390,15 @@ class RegionSeg(QGroupBox):
             show_info("No regions found")
 
 
+@thread_worker
+def wait_for_futures(futures):
+    """
+    :param futures: List of concurrent.futures.Future
+    :return: List of their results, once they are all ready
+    """
+    return [future.result() for future in futures]
+
+
 def check_segmentation_in_correct_space(label_layers, annotations_layer_image):
     for label_layer in label_layers:
         if label_layer.data.shape != annotations_layer_image.shape:
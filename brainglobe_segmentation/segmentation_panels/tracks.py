@@ -1,7 +1,9 @@
 # TrackSeg
-from glob import glob
+import threading
+import weakref
 
 import numpy as np
+from brainglobe_utils.general.system import get_cores_available
 from napari.utils.notifications import show_info
 from qt_niu.dialog import display_info, display_warning
 from qt_niu.interaction import (
@@ -11,24 +13,32 @@ from qt_niu.interaction import (
     add_int_box,
 )
 from qtpy.QtWidgets import QGridLayout, QGroupBox
+from scipy.spatial import cKDTree
 
-from brainglobe_segmentation.image.utils import create_KDTree_from_image
+from brainglobe_segmentation.atlas.cache import get_surface_points
 from brainglobe_segmentation.layout.gui_constants import (
     COLUMN_WIDTH,
     FIT_DEGREE_DEFAULT,
+    N_PROCESSES_DEFAULT,
     POINT_SIZE,
     SAVE_DEFAULT,
     SEGM_METHODS_PANEL_ALIGN,
     SPLINE_POINTS_DEFAULT,
     SPLINE_SIZE,
     SPLINE_SMOOTHING_DEFAULT,
+    SPLINE_STEP_DEFAULT,
+    STRAIGHT_TRACKS_DEFAULT,
     SUMMARISE_TRACK_DEFAULT,
     TRACK_FILE_EXT,
+    TRACK_STORE_FILENAME,
 )
-from brainglobe_segmentation.tracks.analysis import track_analysis
+from brainglobe_segmentation.parallel import get_background_executor
+from brainglobe_segmentation.tracks.analysis import track_analysis_worker
+from brainglobe_segmentation.tracks.IO import load_tracks
 from brainglobe_segmentation.tracks.layers import (
-    add_existing_track_layers,
     add_new_track_layer,
+    add_saved_track_layer,
+    add_spline_layer,
     add_track_from_existing_layer,
 )
 
@@ -45,17 +55,34 @@ class TrackSeg(QGroupBox):
         point_size=POINT_SIZE,
         spline_size=SPLINE_SIZE,
         track_file_extension=TRACK_FILE_EXT,
+        track_store_filename=TRACK_STORE_FILENAME,
         spline_points_default=SPLINE_POINTS_DEFAULT,
         spline_smoothing_default=SPLINE_SMOOTHING_DEFAULT,
+        spline_step_default=SPLINE_STEP_DEFAULT,
         fit_degree_default=FIT_DEGREE_DEFAULT,
         summarise_track_default=SUMMARISE_TRACK_DEFAULT,
+        straight_default=STRAIGHT_TRACKS_DEFAULT,
         save_default=SAVE_DEFAULT,
+        n_processes_default=N_PROCESSES_DEFAULT,
     ):
         super(TrackSeg, self).__init__()
         self.parent = parent
         self.tree = None
+        # the brain surface tree is built in the background (see
+        # prebuild_brain_surface_tree), on a single thread. Setting
+        # tree_cancelled stops a build that has been superseded
+        self.tree_future = None
+        self.tree_cancelled = threading.Event()
+        self.tree_executor = get_background_executor("brain_surface_tree")
+        weakref.finalize(
+            self,
+            self.tree_executor.shutdown,
+            wait=False,
+            cancel_futures=True,
+        )
 
         self.summarise_track_default = summarise_track_default
+        self.straight_default = straight_default
 
         # Point / Spline fitting settings
         self.point_size_default = POINT_SIZE  # Keep track of default
@@ -64,15 +91,19 @@ class TrackSeg(QGroupBox):
         self.spline_size_default = SPLINE_SIZE  # Keep track of default
         self.spline_size = spline_size  # Initialise
         self.spline_smoothing_default = spline_smoothing_default
+        self.spline_step_default = spline_step_default
         self.fit_degree_default = fit_degree_default
         self.save_default = save_default
+        self.n_processes_default = n_processes_default
 
         # File formats
         self.track_file_extension = track_file_extension
+        self.track_store_filename = track_store_filename
 
         # Initialise spline and spline names
         self.splines = None
         self.spline_names = None
+        self.track_analysis_worker = None
 
     def add_track_panel(self, row):
         self.track_panel = QGroupBox("Track tracing")
@@ -82,7 +113,7 @@ class TrackSeg(QGroupBox):
             "Add track",
             track_layout,
             self.add_track,
-            row=6,
+            row=8,
             column=0,
             tooltip="Create a new empty segmentation layer "
             "to manually annotate a new track.",
@@ -92,7 +123,7 @@ class TrackSeg(QGroupBox):
             "Trace tracks",
             track_layout,
             self.run_track_analysis,
-            row=6,
+            row=8,
             column=1,
             tooltip="Join up the points using a spline fit "
             "and save the distribution of the track in "
@@ -103,7 +134,7 @@ class TrackSeg(QGroupBox):
             "Add track from selected layer",
             track_layout,
             self.add_track_from_existing_layer,
-            row=7,
+            row=9,
             column=0,
             tooltip="Adds a track from a selected points layer (e.g. "
             "from another plugin). Make sure this track "
@@ -115,7 +146,7 @@ class TrackSeg(QGroupBox):
             "Add surface points",
             track_layout,
             self.add_surface_points,
-            row=7,
+            row=9,
             column=1,
             tooltip="Add an additional first point at the surface of the "
             "brain. Selecting this option will add an additional "
@@ -123,6 +154,16 @@ class TrackSeg(QGroupBox):
             "first point, so that the track starts there.",
         )
 
+        add_button(
+            "Cancel tracing",
+            track_layout,
+            self.cancel_track_analysis,
+            row=10,
+            column=1,
+            tooltip="Stop tracing tracks (tracks that have already been "
+            "traced are kept).",
+        )
+
         self.summarise_track_checkbox = add_checkbox(
             track_layout,
             self.summarise_track_default,
@@ -140,13 +181,22 @@ class TrackSeg(QGroupBox):
             tooltip="Save the traced layers during analysis.",
         )
 
+        self.straight_checkbox = add_checkbox(
+            track_layout,
+            self.straight_default,
+            "Straight tracks",
+            row=2,
+            tooltip="Fit a straight line to each track, rather than a "
+            "spline (e.g. for straight probes).",
+        )
+
         self.fit_degree = add_int_box(
             track_layout,
             self.fit_degree_default,
             2,
             5,
             "Fit degree",
-            row=2,
+            row=3,
             tooltip="Degree of polynomial to fit to the track.",
         )
 
@@ -157,7 +207,7 @@ class TrackSeg(QGroupBox):
             1,
             "Spline smoothing",
             0.1,
-            row=3,
+            row=4,
             tooltip="How closely or not to fit the points "
             "(lower numbers fit more closely, for "
             "a less smooth interpolation).",
@@ -169,11 +219,35 @@ class TrackSeg(QGroupBox):
             1,
             10000,
             "Spline points",
-            row=4,
+            row=5,
             tooltip="How many points are sampled from the "
             "interpolation (used for the summary).",
         )
 
+        self.spline_step = add_float_box(
+            track_layout,
+            self.spline_step_default,
+            0,
+            10000,
+            "Spline step (um)",
+            1,
+            row=6,
+            tooltip="If not 0, sample the interpolation at this distance "
+            "(in microns) along the track, rather than at a fixed "
+            "number of spline points.",
+        )
+
+        self.n_processes = add_int_box(
+            track_layout,
+            self.n_processes_default,
+            1,
+            get_cores_available(),
+            "Processes",
+            row=7,
+            tooltip="Number of processes to trace tracks in parallel "
+            "(each track is traced by a single process).",
+        )
+
         track_layout.setColumnMinimumWidth(1, COLUMN_WIDTH)
         self.track_panel.setLayout(track_layout)
         self.parent.layout.addWidget(self.track_panel, row, 0, 1, 2)
@@ -218,17 +292,19 @@ class TrackSeg(QGroupBox):
                 )
 
     def check_saved_track(self):
-        track_files = glob(
-            str(self.parent.paths.tracks_directory)
-            + "/*"
-            + self.track_file_extension
-        )
-        if self.parent.paths.tracks_directory.exists() and track_files != []:
-            for track_file in track_files:
+        tracks_directory = self.parent.paths.tracks_directory
+        if tracks_directory.exists():
+            tracks = load_tracks(
+                tracks_directory,
+                track_store_filename=self.track_store_filename,
+                track_file_extension=self.track_file_extension,
+            )
+            for track_name, points in tracks.items():
                 self.parent.track_layers.append(
-                    add_existing_track_layers(
+                    add_saved_track_layer(
                         self.parent.viewer,
-                        track_file,
+                        points,
+                        track_name,
                         self.point_size,
                     )
                 )
@@ -272,25 +348,61 @@ class TrackSeg(QGroupBox):
             if self.tree is None:
                 self.create_brain_surface_tree()
 
+            track_layers = []
             for track_layer in self.parent.track_layers:
-                try:
-                    _, index = self.tree.query(track_layer.data[0])
-                except IndexError:
+                if len(track_layer.data) == 0:
                     show_info(
                         f"{track_layer.name} does not appear to hold any data"
                     )
                     continue
-                surface_point = self.tree.data[index]
-                track_layer.data = np.vstack((surface_point, track_layer.data))
+                track_layers.append(track_layer)
+
+            if track_layers:
+                # find the surface points of all tracks at once
+                _, indices = self.tree.query(
+                    [track_layer.data[0] for track_layer in track_layers]
+                )
+                for track_layer, index in zip(track_layers, indices):
+                    surface_point = self.tree.data[index]
+                    track_layer.data = np.vstack(
+                        (surface_point, track_layer.data)
+                    )
             show_info("Finished!")
         else:
             show_info("No tracks found.")
 
-    def create_brain_surface_tree(self):
-        self.tree = create_KDTree_from_image(
-            self.parent.annotations_layer.data
+    def prebuild_brain_surface_tree(self):
+        """
+        Start building the brain surface tree (for add_surface_points) in
+        the background, e.g. when a project is loaded, so that it is usually
+        ready before it is needed. Any previous build is cancelled (or, if
+        it has started, stopped as soon as possible).
+        """
+        self.cancel_brain_surface_tree()
+        self.tree = None
+        self.tree_cancelled = threading.Event()
+        self.tree_future = self.tree_executor.submit(
+            build_brain_surface_tree,
+            self.parent.annotations_layer.data,
+            cache=self.parent.atlas_cache,
+            cancelled=self.tree_cancelled,
         )
 
+    def cancel_brain_surface_tree(self):
+        if self.tree_future is not None:
+            self.tree_cancelled.set()
+            self.tree_future.cancel()
+            self.tree_future = None
+
+    def create_brain_surface_tree(self):
+        """
+        Get the brain surface tree, waiting for it to be built in the
+        background (or starting to build it, if this hasn't started)
+        """
+        if self.tree_future is None:
+            self.prebuild_brain_surface_tree()
+        self.tree = self.tree_future.result()
+
     def run_track_analysis(self, override=False):
         if self.parent.track_layers:
             if not override:
@@ -309,20 +421,78 @@ class TrackSeg(QGroupBox):
                     self.parent.run_save()
 
                 show_info("Running track analysis")
-                self.splines, self.spline_names = track_analysis(
-                    self.parent.viewer,
+                # filled in as each track is traced, so any tracks traced
+                # before cancelling are kept
+                self.splines = []
+                self.spline_names = []
+                n_tracks = sum(
+                    len(track_layer.data) != 0
+                    for track_layer in self.parent.track_layers
+                )
+                worker = track_analysis_worker(
                     self.parent.annotations_layer.data,
                     self.parent.atlas,
                     self.parent.paths.tracks_directory,
                     self.parent.track_layers,
-                    self.spline_size,
                     spline_points=self.spline_points.value(),
                     fit_degree=self.fit_degree.value(),
                     spline_smoothing=self.spline_smoothing.value(),
                     summarise_track=self.summarise_track_checkbox.isChecked(),
+                    spline_step=self.spline_step.value() or None,
+                    n_processes=self.n_processes.value(),
+                    straight=self.straight_checkbox.isChecked(),
+                    shared_store=self.parent.shared_store,
+                    _progress={"total": n_tracks, "desc": "Tracing tracks"},
                 )
-                show_info("Finished!")
+                worker.yielded.connect(self.add_spline_layer)
+                worker.returned.connect(self.finish_track_analysis)
+                worker.aborted.connect(self.abort_track_analysis)
+                self.track_analysis_worker = worker
+                worker.start()
             else:
                 show_info("Preventing analysis as user chose 'Cancel'")
         else:
             show_info("No tracks found.")
+
+    def add_spline_layer(self, track):
+        _, spline, name = track
+        self.splines.append(spline)
+        self.spline_names.append(name)
+        add_spline_layer(self.parent.viewer, spline, name, self.spline_size)
+
+    def finish_track_analysis(self, result):
+        # in the order of the track layers, rather than as traced
+        self.splines, self.spline_names = result
+        self.track_analysis_worker = None
+        show_info("Finished!")
+
+    def abort_track_analysis(self):
+        self.track_analysis_worker = None
+        show_info("Track analysis cancelled")
+
+    def cancel_track_analysis(self):
+        if self.track_analysis_worker is not None:
+            self.track_analysis_worker.quit()
+
+    def release_resources(self):
+        """
+        Stop building the brain surface tree, and shut down the thread it
+        is built on, when the widget is closed
+        """
+        self.cancel_brain_surface_tree()
+        self.tree_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def build_brain_surface_tree(annotations, cache=None, cancelled=None):
+    """
+    :param annotations: Atlas annotations image
+    :param cache: AtlasCache of the atlas of the annotations (or None)
+    :param cancelled: threading.Event, which if set (e.g. because a new
+    project was loaded) stops the build before the tree is created
+    :return: scipy.spatial.cKDTree of the background voxels on the brain
+    surface, or None if cancelled
+    """
+    surface_points = get_surface_points(annotations, cache=cache)
+    if cancelled is not None and cancelled.is_set():
+        return None
+    return cKDTree(surface_points)
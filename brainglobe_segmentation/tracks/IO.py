@@ -1,22 +1,31 @@
+import os
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
 
+from brainglobe_segmentation.image.utils import scale_to_resolution
+
 
 def save_track_layers(
     tracks_directory,
     points_layers,
-    track_file_extension=".points",
+    track_store_filename="tracks.npz",
 ):
+    """
+    Save the points of each layer to the project's track store (see
+    update_track_store), replacing any saved tracks of the same name
+    """
     print(f"Saving tracks to: {tracks_directory}")
     tracks_directory.mkdir(parents=True, exist_ok=True)
 
-    for points_layer in points_layers:
-        save_single_track(
-            points_layer.data,
-            points_layer.name,
-            tracks_directory,
-            track_file_extension=track_file_extension,
-        )
+    update_track_store(
+        tracks_directory / track_store_filename,
+        {
+            points_layer.name: np.asarray(points_layer.data)
+            for points_layer in points_layers
+        },
+    )
 
 
 def save_single_track(
@@ -25,12 +34,104 @@ def save_single_track(
     output_directory,
     track_file_extension=".points",
 ):
+    """
+    Save a single track to its own (legacy format) HDF5 file
+    """
     output_filename = output_directory / (name + track_file_extension)
     points = pd.DataFrame(points)
     points.to_hdf(output_filename, key="df", mode="w")
 
 
+def load_tracks(
+    tracks_directory,
+    track_store_filename="tracks.npz",
+    track_file_extension=".points",
+):
+    """
+    Load all saved tracks of a project: those in the track store (in a
+    single read), and any in (legacy) individual files, that are not also
+    in the store.
+
+    :return: Dict of track name to (N, 3) array of points
+    """
+    tracks = load_track_store(tracks_directory / track_store_filename)
+    for track_file in sorted(
+        tracks_directory.glob("*" + track_file_extension)
+    ):
+        if track_file.stem not in tracks:
+            tracks[track_file.stem] = np.asarray(pd.read_hdf(track_file))
+    return tracks
+
+
+def load_track_store(track_store_path):
+    """
+    The track store is a single .npz file of the points of all the tracks
+    of a project. Each point has the index of its track (in a "track_index"
+    column), and the names of the tracks are stored separately, so tracks
+    of any length are stored as only three arrays.
+
+    :param track_store_path: Path to the track store
+    :return: Dict of track name to (N, 3) array of points (empty if there is
+    no track store)
+    """
+    if not Path(track_store_path).exists():
+        return {}
+    with np.load(track_store_path) as store:
+        points = store["points"]
+        track_index = store["track_index"]
+        names = store["names"]
+    # points are stored grouped by track, in order
+    ends = np.searchsorted(track_index, np.arange(len(names)), side="right")
+    return dict(zip(names.tolist(), np.split(points, ends[:-1])))
+
+
+def save_track_store(track_store_path, tracks):
+    """
+    Write all tracks to the track store (replacing it). The store is written
+    to a temporary file first, so an interrupted save doesn't lose tracks.
+
+    :param track_store_path: Path to the track store
+    :param tracks: Dict of track name to (N, 3) array of points
+    """
+    track_points = [
+        np.asarray(points, dtype=float).reshape(-1, 3)
+        for points in tracks.values()
+    ]
+    lengths = [len(points) for points in track_points]
+    temporary_path = Path(str(track_store_path) + ".tmp")
+    with open(temporary_path, "wb") as store_file:
+        np.savez(
+            store_file,
+            points=(
+                np.concatenate(track_points)
+                if track_points
+                else np.zeros((0, 3))
+            ),
+            track_index=np.repeat(np.arange(len(lengths)), lengths),
+            names=np.array(list(tracks), dtype=str),
+        )
+    os.replace(temporary_path, track_store_path)
+
+
+def update_track_store(track_store_path, tracks):
+    """
+    Add tracks to the track store, replacing saved tracks of the same name
+    (other saved tracks are kept)
+
+    :param track_store_path: Path to the track store
+    :param tracks: Dict of track name to (N, 3) array of points
+    """
+    saved_tracks = load_track_store(track_store_path)
+    saved_tracks.update(tracks)
+    save_track_store(track_store_path, saved_tracks)
+
+
 def export_splines(tracks_directory, splines, spline_names, resolution):
+    """
+    Export splines (in voxels) for brainrender, in the units of resolution
+    :param resolution: Size of a voxel (a single value, or one per axis,
+    e.g. atlas.resolution)
+    """
     print(f"Exporting tracks to: {tracks_directory}")
     tracks_directory.mkdir(parents=True, exist_ok=True)
 
@@ -46,4 +147,4 @@ def export_single_spline(
     spline_file_extension=".npy",
 ):
     output_filename = output_directory / (name + spline_file_extension)
-    np.save(str(output_filename), spline * resolution)
+    np.save(str(output_filename), scale_to_resolution(spline, resolution))
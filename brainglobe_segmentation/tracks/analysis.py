@@ -1,8 +1,18 @@
+from concurrent.futures import as_completed
+from types import SimpleNamespace
+
 import numpy as np
 import pandas as pd
-from scipy.spatial.distance import euclidean
+from napari.qt.threading import thread_worker
 
-from brainglobe_segmentation.tracks.fit import spline_fit
+from brainglobe_segmentation.parallel import get_executor, shared_arrays
+from brainglobe_segmentation.tracks.fit import (
+    fit_tracks,
+    get_path_distances,
+    spline_fit,
+)
+from brainglobe_segmentation.tracks.layers import add_spline_layer
+from brainglobe_segmentation.tracks.traversal import traverse_voxels
 
 
 def track_analysis(
@@ -16,46 +26,188 @@ def track_analysis(
     fit_degree=3,
     spline_smoothing=0.05,
     summarise_track=True,
+    spline_step=None,
+    n_processes=1,
+    straight=False,
+    straight_tolerance=None,
+    shared_store=None,
 ):
-    tracks_directory.mkdir(parents=True, exist_ok=True)
+    """
+    Fit a spline to (and optionally summarise) each track, and display the
+    spline fits. See trace_tracks for the other parameters (or
+    track_analysis_worker to run the analysis in the background).
 
-    print(
-        f"Fitting splines with {spline_points} segments, of degree "
-        f"'{fit_degree}' to the points"
+    :param viewer: napari viewer to add the spline fits to (or None to not
+    display them)
+    :param napari_spline_size: Size of the points of the displayed spline
+    fits
+    :return: Tuple (splines, spline_names), in the order of the (non-empty)
+    track layers
+    """
+    tracing = trace_tracks(
+        annotations_layer_image,
+        atlas,
+        tracks_directory,
+        track_layers,
+        spline_points=spline_points,
+        fit_degree=fit_degree,
+        spline_smoothing=spline_smoothing,
+        summarise_track=summarise_track,
+        spline_step=spline_step,
+        n_processes=n_processes,
+        straight=straight,
+        straight_tolerance=straight_tolerance,
+        shared_store=shared_store,
     )
-    splines = []
-    spline_names = []
-
-    for track_layer in track_layers:
-        if len(track_layer.data) != 0:
-            spline = run_track_analysis(
-                track_layer.data,
-                track_layer.name,
-                tracks_directory,
-                annotations_layer_image,
-                atlas,
-                summarise_track=summarise_track,
-                spline_smoothing=spline_smoothing,
-                spline_points=spline_points,
-                fit_degree=fit_degree,
-            )
-
-            splines.append(spline)
-
-            viewer.add_points(
-                spline,
-                size=napari_spline_size,
-                border_color="cyan",
-                face_color="cyan",
-                blending="additive",
-                opacity=0.7,
-                name=track_layer.name + "_fit",
-            )
-
-            spline_names.append(track_layer.name)
+    while True:
+        try:
+            next(tracing)
+        except StopIteration as finished:
+            splines, spline_names = finished.value
+            break
+    if viewer is not None:
+        for spline, name in zip(splines, spline_names):
+            add_spline_layer(viewer, spline, name, napari_spline_size)
     return splines, spline_names
 
 
+@thread_worker
+def track_analysis_worker(*args, **kwargs):
+    """
+    Run trace_tracks in a napari worker, which yields each track as it is
+    traced, and can be cancelled (with quit) between tracks. Takes the
+    arguments of trace_tracks.
+    """
+    return (yield from trace_tracks(*args, **kwargs))
+
+
+def trace_tracks(
+    annotations_layer_image,
+    atlas,
+    tracks_directory,
+    track_layers,
+    spline_points=100,
+    fit_degree=3,
+    spline_smoothing=0.05,
+    summarise_track=True,
+    spline_step=None,
+    n_processes=1,
+    straight=False,
+    straight_tolerance=None,
+    shared_store=None,
+):
+    """
+    Fit a spline to (and optionally summarise) each track. All tracks are
+    fitted first, in a batch (see fit_tracks), then as each track is
+    summarised, (index, spline, name) is yielded, so the splines can be
+    displayed as they are ready (and the analysis cancelled between
+    tracks, by closing the generator).
+
+    :param track_layers: List of napari points layers. Empty layers are
+    skipped
+    :param n_processes: Number of processes to spread the tracks across
+    :param straight: If True, fit all tracks with a straight line
+    :param straight_tolerance: If given, also fit tracks with a straight
+    line if all points are within this distance (in microns) of the line
+    :param shared_store: SharedArrayStore to publish the annotations to
+    the worker processes in (e.g. once per loaded project). If None, they
+    are shared for this analysis only
+    :return: Tuple (splines, spline_names), in the order of the (non-empty)
+    track layers
+    """
+    tracks_directory.mkdir(parents=True, exist_ok=True)
+
+    if spline_step is None:
+        print(
+            f"Fitting splines with {spline_points} segments, of degree "
+            f"'{fit_degree}' to the points"
+        )
+    else:
+        print(
+            f"Fitting splines sampled every {spline_step}um, of degree "
+            f"'{fit_degree}' to the points"
+        )
+    tracks = [
+        (remove_duplicate_points(track_layer.data), track_layer.name)
+        for track_layer in track_layers
+        if len(track_layer.data) != 0
+    ]
+    spline_names = [name for _, name in tracks]
+    splines = [None] * len(tracks)
+
+    with get_executor(n_processes) as executor:
+        fits = fit_tracks(
+            [points for points, _ in tracks],
+            smoothing=spline_smoothing,
+            k=fit_degree,
+            n_points=spline_points,
+            step=spline_step,
+            resolution=atlas.resolution,
+            straight=straight,
+            straight_tolerance=straight_tolerance,
+            executor=executor,
+        )
+        if executor is None:
+            for index, (points, name) in enumerate(tracks):
+                splines[index] = run_track_analysis(
+                    points,
+                    name,
+                    tracks_directory,
+                    annotations_layer_image,
+                    atlas,
+                    summarise_track=summarise_track,
+                    spline=fits[index],
+                )
+                yield index, splines[index], name
+        else:
+            with shared_arrays(
+                annotations_layer_image, store=shared_store
+            ) as (shared_annotations,):
+                atlas_summary = summarise_atlas(atlas)
+                futures = {
+                    executor.submit(
+                        run_track_analysis,
+                        points,
+                        name,
+                        tracks_directory,
+                        shared_annotations,
+                        atlas_summary,
+                        summarise_track=summarise_track,
+                        spline=fits[index],
+                    ): index
+                    for index, (points, name) in enumerate(tracks)
+                }
+                try:
+                    for future in as_completed(futures):
+                        index = futures[future]
+                        splines[index] = future.result()
+                        yield index, splines[index], spline_names[index]
+                finally:
+                    # if cancelled, don't start any more tracks
+                    for future in futures:
+                        future.cancel()
+
+    return splines, spline_names
+
+
+def summarise_atlas(atlas):
+    """
+    Get the parts of an atlas needed to analyse a track, which (unlike the
+    atlas itself) are small enough to send to other processes.
+
+    :param atlas: brainglobe atlas class
+    :return: Object with structures (dict of atlas value to id, acronym and
+    name) and resolution attributes
+    """
+    structures = {
+        atlas_value: {key: structure[key] for key in ("id", "acronym", "name")}
+        for atlas_value, structure in atlas.structures.items()
+    }
+    return SimpleNamespace(
+        structures=structures, resolution=tuple(atlas.resolution)
+    )
+
+
 def run_track_analysis(
     points,
     track_name,
@@ -66,6 +218,8 @@ def run_track_analysis(
     spline_points=100,
     fit_degree=3,
     summarise_track=True,
+    spline_step=None,
+    spline=None,
 ):
     """
     For each set of points, run a spline fit, and (if required) determine which
@@ -81,42 +235,65 @@ def run_track_analysis(
     interpolated path
     :param fit_degree: spline fit degree
     :param summarise_track: If True, save a csv with the atlas region for
-    all parts of the spline fit
+    all parts of the spline fit, a csv of the segments of the spline fit in
+    each region, and a csv of the atlas regions crossed by the spline fit
+    :param spline_step: If given, sample the interpolated path every
+    spline_step microns (using the atlas resolution), rather than at
+    spline_points
+    :param spline: If given, the (already fitted) spline fit to the points,
+    which is summarised rather than fitting the points again
     :return np.array: spline fit
     """
-    # Duplicate points causes fit ValueError
-    # 2 stage process to ensure ordering
-    _, indices = np.unique(points, return_index=True, axis=0)
-    points = points[np.sort(indices)]
-
-    spline = spline_fit(
-        points,
-        smoothing=spline_smoothing,
-        k=fit_degree,
-        n_points=spline_points,
-    )
+    if spline is None:
+        spline = spline_fit(
+            remove_duplicate_points(points),
+            smoothing=spline_smoothing,
+            k=fit_degree,
+            n_points=spline_points,
+            step=spline_step,
+            resolution=atlas.resolution,
+        )
     if summarise_track:
         summary_csv_file = tracks_directory / (track_name + ".csv")
+        segments_csv_file = tracks_directory / (track_name + "_segments.csv")
         analyse_track_anatomy(
-            annotations_layer_image, atlas, spline, summary_csv_file
+            annotations_layer_image,
+            atlas,
+            spline,
+            summary_csv_file,
+            segments_file_path=segments_csv_file,
+        )
+        crossings_csv_file = tracks_directory / (track_name + "_crossings.csv")
+        analyse_track_crossings(
+            annotations_layer_image, atlas, spline, crossings_csv_file
         )
 
     return spline
 
 
+def remove_duplicate_points(points):
+    """
+    Remove repeated points (which cause a spline fit ValueError), keeping
+    the first occurrence of each, in order
+    """
+    points = np.asarray(points)
+    # 2 stage process to ensure ordering
+    _, indices = np.unique(points, return_index=True, axis=0)
+    return points[np.sort(indices)]
+
+
 def get_distances(spline, voxel_size=10):
     """
-    For a given spline, calculate the distance between each point.
-    Assumes a customisable isotropic voxel size (default 10) in microns.
+    For a given spline, calculate the distance along it to each point.
+    The voxel size (default 10) in microns can be a single (isotropic)
+    value, or one per axis (e.g. atlas.resolution).
     """
-    distances = [0]
-    for i in range(len(spline) - 1):
-        distance = round(euclidean(spline[i], spline[i + 1]) * voxel_size, 3)
-        distances.append(distances[i] + distance)
-    return distances
+    return get_path_distances(spline, resolution=voxel_size, decimals=3)
 
 
-def analyse_track_anatomy(annotations_layer_image, atlas, spline, file_path):
+def analyse_track_anatomy(
+    annotations_layer_image, atlas, spline, file_path, segments_file_path=None
+):
     """
     For a given spline, find the atlas region that each
     "segment" is in, and save to csv.
@@ -126,67 +303,172 @@ def analyse_track_anatomy(annotations_layer_image, atlas, spline, file_path):
     :param atlas: brainglobe atlas class
     :param spline: numpy array defining the spline interpolation
     :param file_path: path to save the results to
-    :param bool verbose: Whether to print the progress
+    :param segments_file_path: If given, also save a (much shorter) csv
+    with one row per contiguous run of points in the same region. Each run
+    starts at its first point, and ends at the first point of the next run
+    (or the last point of the spline)
     """
-    spline_regions = []
-    for coord in spline.tolist():
-        try:
-            coord = tuple(int(c) for c in coord)
-            atlas_value = annotations_layer_image[coord]
-            spline_regions.append(atlas.structures[atlas_value])
-        except KeyError:
-            spline_regions.append(None)
-
-    distances = get_distances(spline, voxel_size=atlas.resolution[0])
+    atlas_values, in_volume = get_atlas_values(annotations_layer_image, spline)
+    region_ids, region_acronyms, region_names = lookup_structures(
+        atlas_values, in_volume, atlas.structures
+    )
+    distances = get_distances(spline, voxel_size=atlas.resolution)
 
     df = pd.DataFrame(
-        columns=[
-            "Index",
-            "Distance from first position [um]",
-            "Region ID",
-            "Region acronym",
-            "Region name",
-        ]
+        {
+            "Index": np.arange(len(spline)),
+            "Distance from first position [um]": distances,
+            "Region ID": region_ids,
+            "Region acronym": region_acronyms,
+            "Region name": region_names,
+        }
     )
-    for idx, spline_region in enumerate(spline_regions):
-        if spline_region is None:
-            df = pd.concat(
-                [
-                    df,
-                    pd.DataFrame(
-                        [
-                            {
-                                "Index": idx,
-                                "Distance from first position [um]": distances[
-                                    idx
-                                ],
-                                "Region ID": "Not found in brain",
-                                "Region acronym": "Not found in brain",
-                                "Region name": "Not found in brain",
-                            }
-                        ]
-                    ),
-                ]
-            )
+    df.to_csv(file_path, index=False)
 
-        else:
-            df = pd.concat(
-                [
-                    df,
-                    pd.DataFrame(
-                        [
-                            {
-                                "Index": idx,
-                                "Distance from first position [um]": distances[
-                                    idx
-                                ],
-                                "Region ID": spline_region["id"],
-                                "Region acronym": spline_region["acronym"],
-                                "Region name": spline_region["name"],
-                            }
-                        ]
-                    ),
-                ]
-            )
+    if segments_file_path is not None:
+        end_distances = np.append(distances[1:], distances[-1:])
+        segments_df = region_segments_to_df(
+            *get_region_segments(atlas_values, distances, end_distances),
+            atlas.structures,
+        )
+        segments_df.to_csv(segments_file_path, index=False)
+
+
+def analyse_track_crossings(annotations_layer_image, atlas, spline, file_path):
+    """
+    For a given spline, find every atlas region it crosses (in order), with
+    the distances at which it enters and leaves the region, and save to csv.
+    Unlike analyse_track_anatomy, this does not depend on how finely the
+    spline is sampled, because every voxel along the spline is visited
+    (see traverse_voxels), so the length within each region is exact.
 
+    :param annotations_layer_image: 3D numpy array of the (possibly registered)
+    annotations image
+    :param atlas: brainglobe atlas class
+    :param spline: numpy array defining the spline interpolation
+    :param file_path: path to save the results to
+    """
+    voxels, entry_distances, exit_distances = traverse_voxels(
+        spline, resolution=atlas.resolution
+    )
+    atlas_values, _ = get_atlas_values(annotations_layer_image, voxels)
+    df = region_segments_to_df(
+        *get_region_segments(atlas_values, entry_distances, exit_distances),
+        atlas.structures,
+    )
     df.to_csv(file_path, index=False)
+
+
+def region_segments_to_df(
+    atlas_values, start_distances, end_distances, atlas_structures
+):
+    """
+    :param atlas_values: Atlas value of each segment of a track (0, e.g.
+    outside the annotations image, is not found in the brain)
+    :param start_distances: Distance along the track to the start of each
+    segment
+    :param end_distances: Distance along the track to the end of each
+    segment
+    :param atlas_structures: Atlas structures (e.g. atlas.structures)
+    :return: pandas DataFrame with one row per segment
+    """
+    region_ids, region_acronyms, region_names = lookup_structures(
+        atlas_values, np.asarray(atlas_values) != 0, atlas_structures
+    )
+    start_distances = np.round(start_distances, 3)
+    end_distances = np.round(end_distances, 3)
+    return pd.DataFrame(
+        {
+            "Region ID": region_ids,
+            "Region acronym": region_acronyms,
+            "Region name": region_names,
+            "Start distance [um]": start_distances,
+            "End distance [um]": end_distances,
+            "Length [um]": np.round(end_distances - start_distances, 3),
+        }
+    )
+
+
+def get_region_segments(atlas_values, start_distances, end_distances):
+    """
+    Merge consecutive parts of a track in the same atlas region into a
+    single segment.
+
+    :param atlas_values: Atlas value of each part of the track, in order
+    :param start_distances: Distance along the track to the start of each
+    part
+    :param end_distances: Distance along the track to the end of each part
+    :return: Tuple (atlas_values, start_distances, end_distances) of each
+    segment
+    """
+    atlas_values = np.asarray(atlas_values)
+    if len(atlas_values) == 0:
+        return atlas_values, start_distances, end_distances
+    changes = np.flatnonzero(np.diff(atlas_values) != 0) + 1
+    first = np.concatenate(([0], changes))
+    last = np.concatenate((changes - 1, [len(atlas_values) - 1]))
+    return (
+        atlas_values[first],
+        np.asarray(start_distances)[first],
+        np.asarray(end_distances)[last],
+    )
+
+
+def get_atlas_values(annotations_layer_image, coordinates):
+    """
+    Get the atlas value at each coordinate, in a single gather.
+
+    :param annotations_layer_image: 3D numpy array of the (possibly registered)
+    annotations image
+    :param coordinates: (N, 3) array of coordinates (truncated to voxels)
+    :return: Tuple (atlas_values, in_volume). Coordinates outside the image
+    have an atlas value of 0, and are False in in_volume
+    """
+    voxels = (
+        np.asarray(coordinates)
+        .astype(np.intp)
+        .reshape(-1, len(annotations_layer_image.shape))
+    )
+    in_volume = np.all(
+        (voxels >= 0) & (voxels < annotations_layer_image.shape), axis=1
+    )
+    atlas_values = np.zeros(len(voxels), dtype=annotations_layer_image.dtype)
+    atlas_values[in_volume] = annotations_layer_image[
+        tuple(voxels[in_volume].T)
+    ]
+    return atlas_values, in_volume
+
+
+def lookup_structures(
+    atlas_values, in_brain, atlas_structures, not_found="Not found in brain"
+):
+    """
+    Look up the ID, acronym and name of the atlas structure of each value.
+    Each distinct value is only looked up once.
+
+    :param atlas_values: Array of atlas values
+    :param in_brain: Boolean array, False for values that should not be
+    looked up (e.g. outside the annotations image)
+    :param atlas_structures: Atlas structures (e.g. atlas.structures)
+    :param not_found: Entry for values not in the atlas (e.g. 0)
+    :return: Tuple of object arrays (ids, acronyms, names)
+    """
+    unique_values, inverse = np.unique(atlas_values, return_inverse=True)
+    inverse = inverse.ravel()
+    ids = np.full(len(unique_values), not_found, dtype=object)
+    acronyms = ids.copy()
+    names = ids.copy()
+    for idx, atlas_value in enumerate(unique_values.tolist()):
+        try:
+            structure = atlas_structures[atlas_value]
+        except KeyError:
+            continue
+        ids[idx] = structure["id"]
+        acronyms[idx] = structure["acronym"]
+        names[idx] = structure["name"]
+
+    ids, acronyms, names = ids[inverse], acronyms[inverse], names[inverse]
+    ids[~in_brain] = not_found
+    acronyms[~in_brain] = not_found
+    names[~in_brain] = not_found
+    return ids, acronyms, names
@@ -1,8 +1,18 @@
+from functools import partial
+
 import numpy as np
 from scipy.interpolate import splev, splprep
 
+from brainglobe_segmentation.image.utils import scale_to_resolution
+
+# Number of points used to measure the length of a spline, when resampling
+# it at a fixed step
+ARC_LENGTH_SAMPLES = 10000
 
-def spline_fit(points, smoothing=0.2, k=3, n_points=100):
+
+def spline_fit(
+    points, smoothing=0.2, k=3, n_points=100, step=None, resolution=1
+):
     """Given an input set of 2/3D points, returns a new set of points
     representing the spline interpolation
     Parameters
@@ -15,6 +25,13 @@ def spline_fit(points, smoothing=0.2, k=3, n_points=100):
         Spline degree
     n_points : int
         How many points used to define the resulting interpolated path
+        (ignored if step is given)
+    step : float, optional
+        If given, the interpolated path is sampled every step (in the units
+        of resolution, e.g. microns) along its length, rather than at
+        n_points
+    resolution : float or sequence of float
+        Size of a voxel (along each axis), used with step
     Returns
     ----------
     new_points : np.ndarray
@@ -29,6 +46,197 @@ def spline_fit(points, smoothing=0.2, k=3, n_points=100):
     tck, _ = splprep(points.T, s=smoothing, k=k)
 
     # evaluate bspline
-    spline_fit_points = splev(np.linspace(0, 1, n_points), tck)
+    if step is None:
+        u = np.linspace(0, 1, n_points)
+    else:
+        u = get_fixed_step_parameters(tck, step, resolution)
+    spline_fit_points = splev(u, tck)
 
     return np.array(spline_fit_points).T
+
+
+def fit_tracks(
+    tracks,
+    smoothing=0.2,
+    k=3,
+    n_points=100,
+    step=None,
+    resolution=1,
+    straight=False,
+    straight_tolerance=None,
+    executor=None,
+):
+    """
+    Fit many tracks at once. Straight tracks are fitted with a straight
+    line, all in a single vectorised pass (see line_fit), and the others
+    are fitted with a spline (see spline_fit), spread across processes.
+
+    :param tracks: List of (N, ndim) arrays of points (without duplicates)
+    :param smoothing: Spline smoothing factor
+    :param k: Spline degree
+    :param n_points: How many points used to define each interpolated path
+    (ignored if step is given)
+    :param step: If given, each interpolated path is sampled every step
+    (in the units of resolution, e.g. microns) along its length
+    :param resolution: Size of a voxel (along each axis)
+    :param straight: If True, fit all tracks with a straight line
+    :param straight_tolerance: If given, also fit tracks with a straight
+    line if no point is further than this (in the units of resolution)
+    from the line
+    :param executor: If given, executor (e.g. from get_executor) to fit the
+    splines with, otherwise they are fitted in this process
+    :return: List of arrays of points defining each interpolation
+    """
+    fits = [None] * len(tracks)
+    if len(tracks) and (straight or straight_tolerance is not None):
+        lines, residuals = line_fit(
+            tracks, n_points=n_points, step=step, resolution=resolution
+        )
+        for index, (line, residual) in enumerate(zip(lines, residuals)):
+            if straight or residual <= straight_tolerance:
+                fits[index] = line
+
+    curved = [index for index, fit in enumerate(fits) if fit is None]
+    fit_spline = partial(
+        spline_fit,
+        smoothing=smoothing,
+        k=k,
+        n_points=n_points,
+        step=step,
+        resolution=resolution,
+    )
+    map_function = map if executor is None else executor.map
+    for index, fit in zip(
+        curved, map_function(fit_spline, [tracks[index] for index in curved])
+    ):
+        fits[index] = fit
+    return fits
+
+
+def line_fit(tracks, n_points=100, step=None, resolution=1):
+    """
+    Fit a straight line to each track, all at once (rather than one track at
+    a time). Each line passes through the centroid of the points, along
+    their principal direction (i.e. the first singular vector of the
+    centred points, found from the (ndim, ndim) scatter matrix of each
+    track), and runs between the projections of the outermost points, from
+    the end nearest the first point.
+
+    :param tracks: List of (N, ndim) arrays of points
+    :param n_points: How many points used to define each line (ignored if
+    step is given)
+    :param step: If given, each line is sampled every step (in the units of
+    resolution, e.g. microns) along its length, and at its far end
+    :param resolution: Size of a voxel (along each axis). Lines are fitted
+    in these units
+    :return: Tuple (lines, residuals). lines is a list of arrays of points
+    defining each line, and residuals is an array of the largest distance
+    (in the units of resolution) of any point of each track from its line
+    """
+    lengths = np.array([len(track) for track in tracks])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    ends = starts + lengths - 1
+    track_index = np.repeat(np.arange(len(tracks)), lengths)
+    points = np.concatenate(tracks).astype(float)
+    resolution = np.broadcast_to(
+        np.asarray(resolution, dtype=float), points.shape[1:]
+    )
+    points = points * resolution
+
+    centroids = np.add.reduceat(points, starts) / lengths[:, np.newaxis]
+    centred = points - centroids[track_index]
+    scatter = np.add.reduceat(
+        centred[:, :, np.newaxis] * centred[:, np.newaxis, :], starts
+    )
+    # eigenvalues are in ascending order, so the last eigenvector is the
+    # principal direction
+    directions = np.linalg.eigh(scatter)[1][:, :, -1]
+    positions = np.einsum("ij,ij->i", centred, directions[track_index])
+    # orient each line from the first point towards the last
+    reverse = positions[ends] < positions[starts]
+    directions[reverse] *= -1
+    positions[reverse[track_index]] *= -1
+
+    offsets = centred - positions[:, np.newaxis] * directions[track_index]
+    residuals = np.maximum.reduceat(np.linalg.norm(offsets, axis=1), starts)
+    first_positions = np.minimum.reduceat(positions, starts)
+    line_lengths = np.maximum.reduceat(positions, starts) - first_positions
+
+    if step is None:
+        n_line_points = np.full(len(tracks), n_points)
+        line_positions = (
+            np.linspace(0, 1, n_points) * line_lengths[:, np.newaxis]
+        ).ravel()
+    else:
+        # as get_step_positions, then the far end of each line
+        n_steps = np.ceil(line_lengths / step).astype(np.intp)
+        n_steps[
+            (n_steps > 1) & np.isclose(step * (n_steps - 1), line_lengths)
+        ] -= 1
+        n_line_points = n_steps + 1
+        line_positions = step * (
+            np.arange(n_line_points.sum(), dtype=float)
+            - np.repeat(
+                np.cumsum(n_line_points) - n_line_points, n_line_points
+            )
+        )
+        line_ends = np.cumsum(n_line_points) - 1
+        line_positions[line_ends] = line_lengths
+    line_index = np.repeat(np.arange(len(tracks)), n_line_points)
+    line_points = (
+        centroids[line_index]
+        + (first_positions[line_index] + line_positions)[:, np.newaxis]
+        * directions[line_index]
+    ) / resolution
+    lines = np.split(line_points, np.cumsum(n_line_points)[:-1])
+    return lines, residuals
+
+
+def get_fixed_step_parameters(tck, step, resolution=1):
+    """
+    Find the spline parameters of points at a fixed distance along a
+    spline, by measuring its length at many closely spaced points.
+
+    :param tck: Spline representation (from splprep)
+    :param step: Distance between points (in the units of resolution)
+    :param resolution: Size of a voxel (along each axis)
+    :return: Array of spline parameters, starting at 0 and ending at 1 (so
+    the last step is shorter, unless the length is a multiple of step)
+    """
+    u = np.linspace(0, 1, ARC_LENGTH_SAMPLES)
+    distances = get_path_distances(np.array(splev(u, tck)).T, resolution)
+    return np.append(
+        np.interp(get_step_positions(distances[-1], step), distances, u), 1
+    )
+
+
+def get_step_positions(length, step):
+    """
+    :param length: Length of a path
+    :param step: Distance between points
+    :return: Array of the distances every step along the path, from 0, and
+    excluding the end of the path (or a step within rounding error of it)
+    """
+    positions = np.arange(0, length, step)
+    if len(positions) > 1 and np.isclose(positions[-1], length):
+        positions = positions[:-1]
+    return positions
+
+
+def get_path_distances(points, resolution=1, decimals=None):
+    """
+    Calculate the distance along a path, at each point.
+
+    :param points: (N, ndim) array of points defining a path
+    :param resolution: Size of a voxel (a single value, or per axis)
+    :param decimals: If given, round the distance between each pair of
+    points to this many decimals (before adding them up)
+    :return: Array of N distances, starting at 0
+    """
+    points = np.asarray(points, dtype=float)
+    steps = np.linalg.norm(
+        scale_to_resolution(np.diff(points, axis=0), resolution), axis=1
+    )
+    if decimals is not None:
+        steps = np.round(steps, decimals)
+    return np.concatenate(([0.0], np.cumsum(steps)))
@@ -18,16 +18,40 @@ def add_new_track_layer(viewer, track_layers, point_size):
 
 def add_existing_track_layers(viewer, track_file, point_size):
     points = pd.read_hdf(track_file)
+    return add_saved_track_layer(
+        viewer, points, Path(track_file).stem, point_size
+    )
+
+
+def add_saved_track_layer(viewer, points, track_name, point_size):
+    """
+    Add a layer for a previously saved track
+    """
     new_points_layer = viewer.add_points(
         points,
         n_dimensional=True,
         size=point_size,
-        name=Path(track_file).stem,
+        name=track_name,
     )
     new_points_layer.mode = "ADD"
     return new_points_layer
 
 
+def add_spline_layer(viewer, spline, track_name, spline_size):
+    """
+    Display the spline fit to a track
+    """
+    return viewer.add_points(
+        spline,
+        size=spline_size,
+        border_color="cyan",
+        face_color="cyan",
+        blending="additive",
+        opacity=0.7,
+        name=track_name + "_fit",
+    )
+
+
 def add_track_from_existing_layer(selected_layer, track_layers):
     """
     Adds an existing tracks layer (e.g. from another plugin) to the list
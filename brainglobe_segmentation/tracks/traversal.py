@@ -0,0 +1,90 @@
+import numpy as np
+
+
+def traverse_voxels(points, resolution=1):
+    """
+    Find every voxel crossed by a path (e.g. a fitted spline), in order,
+    with the distance along the path at which each voxel is entered and
+    exited.
+
+    This is the voxel traversal of Amanatides & Woo (1987), vectorised:
+    rather than stepping from voxel to voxel, every crossing of a voxel
+    boundary (along each axis) is found at once, and the crossings are
+    then merged in the order they occur along the path. Run time is
+    proportional to the number of voxels crossed.
+
+    :param points: (N, ndim) array of points defining the path (as straight
+    lines between consecutive points), in voxel coordinates. Voxel i spans
+    coordinates [i, i + 1), i.e. coordinates are truncated to voxels.
+    :param resolution: Size of a voxel (a single value, or per axis), used
+    to calculate the distances
+    :return: Tuple (voxels, entry_distances, exit_distances). voxels is an
+    (M, ndim) array of the voxels crossed, and can contain the same voxel
+    more than once, if the path leaves and re-enters it
+    """
+    points = np.asarray(points, dtype=float)
+    n_segments = len(points) - 1
+    if n_segments < 1:
+        voxels = np.floor(points).astype(np.intp)
+        return voxels, np.zeros(len(voxels)), np.zeros(len(voxels))
+
+    starts = points[:-1]
+    ends = points[1:]
+    # positions along the path are given as segment index + fraction of the
+    # segment, and include each point, so that each interval between
+    # crossings lies within a single segment
+    crossings = [np.arange(n_segments + 1, dtype=float)]
+    for axis in range(points.shape[1]):
+        crossings.append(
+            get_boundary_crossings(starts[:, axis], ends[:, axis])
+        )
+    crossings = np.unique(np.concatenate(crossings))
+
+    # voxel of each interval between crossings, from its midpoint
+    midpoints = (crossings[:-1] + crossings[1:]) / 2
+    segments = np.minimum(midpoints.astype(np.intp), n_segments - 1)
+    fractions = (midpoints - segments)[:, np.newaxis]
+    positions = starts[segments] + fractions * (ends - starts)[segments]
+    voxels = np.floor(positions).astype(np.intp)
+
+    segment_lengths = np.linalg.norm(
+        (ends - starts) * np.asarray(resolution, dtype=float), axis=1
+    )
+    distances = np.interp(
+        crossings,
+        np.arange(n_segments + 1),
+        np.concatenate(([0.0], np.cumsum(segment_lengths))),
+    )
+
+    # merge intervals in the same voxel (split by a point of the path)
+    first = np.concatenate(([True], np.any(voxels[1:] != voxels[:-1], axis=1)))
+    last = np.concatenate((first[1:], [True]))
+    return voxels[first], distances[:-1][first], distances[1:][last]
+
+
+def get_boundary_crossings(starts, ends):
+    """
+    Find where each straight line crosses voxel boundaries along one axis.
+
+    :param starts: Coordinate of the start of each line
+    :param ends: Coordinate of the end of each line
+    :return: Array of the positions of the crossings, as line index +
+    fraction of the line
+    """
+    first = np.floor(starts)
+    last = np.floor(ends)
+    n_crossings = np.abs(last - first).astype(np.intp)
+
+    lines = np.repeat(np.arange(len(starts)), n_crossings)
+    crossing_number = np.arange(n_crossings.sum()) - np.repeat(
+        np.cumsum(n_crossings) - n_crossings, n_crossings
+    )
+    # moving up, lines cross boundaries first + 1, first + 2 ..., moving
+    # down, they cross first, first - 1, ...
+    boundaries = np.where(
+        (last > first)[lines],
+        first[lines] + 1 + crossing_number,
+        first[lines] - crossing_number,
+    )
+    fractions = (boundaries - starts[lines]) / (ends - starts)[lines]
+    return lines + fractions
@@ -1,6 +1,8 @@
 import shutil
 from pathlib import Path
+from types import SimpleNamespace
 
+import numpy as np
 import pytest
 from brainglobe_atlasapi import BrainGlobeAtlas
 
@@ -15,6 +17,33 @@ def allen_mouse_50um_atlas():
     return BrainGlobeAtlas(atlas_name)
 
 
+@pytest.fixture
+def toy_atlas():
+    """
+    Minimal stand-in for a BrainGlobeAtlas, with two hemispheres split
+    along the last axis
+    """
+    annotation = np.zeros((4, 6, 8), dtype=np.uint32)
+    annotation[:, :3] = 10
+    annotation[:, 3:] = 500000000
+    annotation[:2, :, 2:6] = 7
+    hemispheres = np.ones_like(annotation, dtype=np.uint8)
+    hemispheres[..., 4:] = 2
+    structures = {
+        7: {"name": "structure_7"},
+        10: {"name": "structure_10"},
+        500000000: {"name": "structure_500000000"},
+    }
+    return SimpleNamespace(
+        annotation=annotation,
+        hemispheres=hemispheres,
+        structures=structures,
+        resolution=(100, 100, 100),
+        left_hemisphere_value=1,
+        right_hemisphere_value=2,
+    )
+
+
 @pytest.fixture
 def segmentation_widget(make_napari_viewer):
     """
@@ -7,6 +7,8 @@ import pandas as pd
 import pytest
 from tifffile import imread
 
+from brainglobe_segmentation.regions.layers import load_regions_from_file
+
 brainreg_dir = Path.cwd() / "tests" / "data" / "brainreg_output"
 validate_regions_dir = (
     brainreg_dir / "segmentation" / "atlas_space" / "regions"
@@ -80,7 +82,7 @@ def test_region_analysis_without_save(
     check_analysis(test_regions_dir, validate_regions_dir)
 
     # check saving didn't happen (default)
-    test_saved_region = Path(test_regions_dir / "test_region.tiff")
+    test_saved_region = Path(test_regions_dir / "test_region.zarr")
     assert test_saved_region.exists() is False
 
 
@@ -142,5 +144,7 @@ def check_analysis(test_regions_dir, validate_regions_dir):
 
 def check_saving(test_regions_dir, validate_regions_dir):
     image_validate = imread(validate_regions_dir / "test_region.tiff")
-    image_test = imread(test_regions_dir / "test_region.tiff")
+    image_test = load_regions_from_file(test_regions_dir / "test_region.zarr")[
+        :
+    ]
     np.testing.assert_array_equal(image_test, image_validate)
@@ -1,4 +1,4 @@
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import numpy as np
 import pytest
@@ -285,11 +285,8 @@ def test_analyse_region_brain_areas_show_info_on_missing_structure(
         patch(
             "brainglobe_segmentation.regions.analysis.show_info"
         ) as mock_show_info,
-        # mock missing structure by raising KeyError
-        patch(
-            "brainglobe_segmentation.regions.analysis.add_structure_volume_to_df",
-            side_effect=KeyError,
-        ),
+        # mock missing structure by removing all atlas structures
+        patch.object(widget.atlas, "structures", {}),
     ):
 
         analyse_region_brain_areas(
@@ -440,11 +437,14 @@ def test_run_track_analysis_show_info(
             return_value=True,
         ),
         patch(
-            "brainglobe_segmentation.segmentation_panels.tracks.track_analysis",
-            return_value=(None, None),
-        ),
+            "brainglobe_segmentation.segmentation_panels.tracks.track_analysis_worker",
+            return_value=MagicMock(),
+        ) as mock_track_analysis,
     ):
         widget.track_seg.run_track_analysis()
-
         mock_show_info.assert_any_call("Running track analysis")
+        mock_track_analysis.return_value.start.assert_called_once()
+
+        # analysis runs in the background, and reports when it is finished
+        widget.track_seg.finish_track_analysis(([], []))
         mock_show_info.assert_any_call("Finished!")
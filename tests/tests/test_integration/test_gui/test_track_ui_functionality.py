@@ -5,6 +5,8 @@ import numpy as np
 import pandas as pd
 import pytest
 
+from brainglobe_segmentation.tracks.IO import load_track_store
+
 brainreg_dir = Path.cwd() / "tests" / "data" / "brainreg_output"
 validate_tracks_dir = brainreg_dir / "segmentation" / "atlas_space" / "tracks"
 
@@ -69,21 +71,33 @@ def test_add_surface_point(
     )
 
 
+def wait_for_track_analysis(track_seg, qtbot):
+    qtbot.waitUntil(
+        lambda: track_seg.track_analysis_worker is None, timeout=60000
+    )
+
+
 def test_track_analysis_without_save(
-    segmentation_widget_with_data_atlas_space, test_tracks_dir
+    segmentation_widget_with_data_atlas_space, test_tracks_dir, qtbot
 ):
     segmentation_widget_with_data_atlas_space.track_seg.run_track_analysis(
         override=True
     )
+    wait_for_track_analysis(
+        segmentation_widget_with_data_atlas_space.track_seg, qtbot
+    )
     # check saving didn't happen (default)
-    test_saved_track = Path(test_tracks_dir / "test_track.points")
-    assert test_saved_track.exists() is False
+    test_saved_tracks = Path(test_tracks_dir / "tracks.npz")
+    assert test_saved_tracks.exists() is False
 
     check_analysis(test_tracks_dir, validate_tracks_dir)
 
 
 def test_track_analysis_with_save(
-    segmentation_widget_with_data_atlas_space, test_tracks_dir, rtol=1e-10
+    segmentation_widget_with_data_atlas_space,
+    test_tracks_dir,
+    qtbot,
+    rtol=1e-10,
 ):
     segmentation_widget_with_data_atlas_space.track_seg.save_checkbox.setChecked(
         True
@@ -91,6 +105,9 @@ def test_track_analysis_with_save(
     segmentation_widget_with_data_atlas_space.track_seg.run_track_analysis(
         override=True
     )
+    wait_for_track_analysis(
+        segmentation_widget_with_data_atlas_space.track_seg, qtbot
+    )
 
     check_analysis(test_tracks_dir, validate_tracks_dir)
     check_saving(test_tracks_dir, validate_tracks_dir, rtol)
@@ -107,11 +124,14 @@ def test_track_save(
 
 
 def test_track_export(
-    segmentation_widget_with_data_atlas_space, test_tracks_dir
+    segmentation_widget_with_data_atlas_space, test_tracks_dir, qtbot
 ):
     segmentation_widget_with_data_atlas_space.track_seg.run_track_analysis(
         override=True
     )
+    wait_for_track_analysis(
+        segmentation_widget_with_data_atlas_space.track_seg, qtbot
+    )
     segmentation_widget_with_data_atlas_space.export_to_brainrender(
         override=True
     )
@@ -151,5 +171,7 @@ def check_analysis(test_tracks_dir, validate_tracks_dir):
 
 def check_saving(test_tracks_dir, validate_tracks_dir, rtol):
     points_validate = pd.read_hdf(validate_tracks_dir / "test_track.points")
-    points_test = pd.read_hdf(test_tracks_dir / "test_track.points")
+    points_test = load_track_store(test_tracks_dir / "tracks.npz")[
+        "test_track"
+    ]
     np.testing.assert_allclose(points_validate, points_test, rtol=rtol)
@@ -1,9 +1,17 @@
 from pathlib import Path
+from types import SimpleNamespace
 
 import numpy as np
 import pandas as pd
+import pytest
+from napari.components import ViewerModel
+from napari.layers import Points
 
-from brainglobe_segmentation.tracks.analysis import run_track_analysis
+from brainglobe_segmentation.tracks.analysis import (
+    run_track_analysis,
+    track_analysis,
+    track_analysis_worker,
+)
 
 tracks_dir = Path.cwd() / "tests" / "data" / "tracks"
 
@@ -36,3 +44,134 @@ def test_run_track_analysis(allen_mouse_50um_atlas, tmp_path, rtol=1e-10):
     tracks_test = pd.read_csv(tmp_path / "track.csv")
 
     pd.testing.assert_frame_equal(tracks_test, tracks_validate)
+
+
+@pytest.fixture
+def toy_track_atlas():
+    annotation = np.zeros((20, 30, 40), dtype=np.uint32)
+    annotation[5:15, 5:25, 5:35] = 614454277
+    annotation[8:12, 10:20, 10:30] = 7
+    structures = {
+        614454277: {"id": 614454277, "acronym": "ST", "name": "struct"},
+        7: {"id": 7, "acronym": "S7", "name": "seven"},
+    }
+    atlas = SimpleNamespace(structures=structures, resolution=(10, 10, 10))
+    return annotation, atlas
+
+
+@pytest.fixture
+def toy_track_layers():
+    rng = np.random.default_rng(0)
+    track_layers = []
+    for idx in range(3):
+        start = rng.uniform(2, 8, 3)
+        end = np.array([18, 28, 38]) - rng.uniform(0, 6, 3)
+        points = np.linspace(start, end, 5) + rng.normal(0, 0.5, (5, 3))
+        track_layers.append(Points(points, name=f"track_{idx}"))
+    track_layers.insert(1, Points(np.zeros((0, 3)), name="empty"))
+    return track_layers
+
+
+@pytest.mark.parametrize("n_processes", [1, 2])
+def test_track_analysis(
+    toy_track_atlas, toy_track_layers, tmp_path, n_processes
+):
+    annotation, atlas = toy_track_atlas
+    traced = []
+    worker = track_analysis_worker(
+        annotation,
+        atlas,
+        tmp_path,
+        toy_track_layers,
+        spline_points=20,
+        n_processes=n_processes,
+    )
+    worker.yielded.connect(traced.append)
+    splines, spline_names = worker.work()
+
+    assert spline_names == ["track_0", "track_1", "track_2"]
+    assert sorted(index for index, _, _ in traced) == [0, 1, 2]
+    for index, spline, name in traced:
+        assert spline_names[index] == name
+        np.testing.assert_array_equal(spline, splines[index])
+
+    for spline, name in zip(splines, spline_names):
+        points = next(
+            layer.data for layer in toy_track_layers if layer.name == name
+        )
+        expected_directory = tmp_path / "expected"
+        expected_directory.mkdir(exist_ok=True)
+        expected = run_track_analysis(
+            points,
+            name,
+            expected_directory,
+            annotation,
+            atlas,
+            spline_points=20,
+        )
+        np.testing.assert_allclose(spline, expected)
+        assert (tmp_path / f"{name}.csv").read_text() == (
+            expected_directory / f"{name}.csv"
+        ).read_text()
+
+
+def test_track_analysis_runs_in_place(
+    toy_track_atlas, toy_track_layers, tmp_path
+):
+    annotation, atlas = toy_track_atlas
+    viewer = ViewerModel()
+    splines, spline_names = track_analysis(
+        viewer,
+        annotation,
+        atlas,
+        tmp_path / "tracks",
+        toy_track_layers,
+        3,
+        spline_points=20,
+    )
+    worker = track_analysis_worker(
+        annotation, atlas, tmp_path, toy_track_layers, spline_points=20
+    )
+    expected_splines, expected_names = worker.work()
+
+    assert spline_names == expected_names
+    for spline, expected in zip(splines, expected_splines):
+        np.testing.assert_array_equal(spline, expected)
+    assert [layer.name for layer in viewer.layers] == [
+        f"{name}_fit" for name in spline_names
+    ]
+    np.testing.assert_array_equal(viewer.layers[0].data, splines[0])
+    assert (tmp_path / "tracks" / "track_0.csv").exists()
+
+
+def test_track_analysis_cancel(toy_track_atlas, toy_track_layers, tmp_path):
+    annotation, atlas = toy_track_atlas
+    worker = track_analysis_worker(
+        annotation, atlas, tmp_path, toy_track_layers
+    )
+    aborted = []
+    worker.yielded.connect(lambda _: worker.quit())
+    worker.aborted.connect(lambda: aborted.append(True))
+    assert worker.work() is None
+    assert aborted
+    assert (tmp_path / "track_0.csv").exists()
+    assert not (tmp_path / "track_1.csv").exists()
+
+
+def test_track_analysis_straight(toy_track_atlas, toy_track_layers, tmp_path):
+    annotation, atlas = toy_track_atlas
+    worker = track_analysis_worker(
+        annotation,
+        atlas,
+        tmp_path,
+        toy_track_layers,
+        spline_points=20,
+        straight=True,
+    )
+    splines, _ = worker.work()
+
+    for spline in splines:
+        assert len(spline) == 20
+        steps = np.diff(spline, axis=0)
+        np.testing.assert_allclose(steps, steps[:1].repeat(19, axis=0))
+    assert (tmp_path / "track_0.csv").exists()
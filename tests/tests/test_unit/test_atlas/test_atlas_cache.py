@@ -0,0 +1,137 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from brainglobe_segmentation.atlas import cache as atlas_cache
+from brainglobe_segmentation.atlas.utils import (
+    index_annotations,
+    index_hemispheres,
+)
+from brainglobe_segmentation.image.utils import get_points_from_image
+
+
+def test_atlas_cache_from_atlas(tmp_path):
+    atlas = SimpleNamespace(
+        atlas_name="example_mouse_100um",
+        metadata={"version": "1.2"},
+        resolution=(100, 100, 12.5),
+    )
+    cache = atlas_cache.AtlasCache.from_atlas(atlas, cache_directory=tmp_path)
+    assert (
+        cache.directory == tmp_path / "example_mouse_100um_v1.2_100_100_12.5um"
+    )
+
+
+def test_atlas_cache_get(tmp_path):
+    cache = atlas_cache.AtlasCache(tmp_path / "atlas")
+    array = np.arange(24, dtype=np.uint16).reshape(2, 3, 4)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return array
+
+    assert cache.load("array") is None
+    np.testing.assert_array_equal(cache.get("array", compute), array)
+    cached = cache.get("array", compute)
+    assert isinstance(cached, np.memmap)
+    np.testing.assert_array_equal(cached, array)
+    assert cached.dtype == array.dtype
+    assert len(calls) == 1
+
+    # an array modified since it was saved is recomputed
+    array_path = cache.directory / "array.npy"
+    modified_time = os.stat(array_path).st_mtime_ns
+    corrupted = np.load(array_path, mmap_mode="r+")
+    corrupted[0, 0, 0] = 100
+    corrupted.flush()
+    del corrupted, cached
+    os.utime(array_path, ns=(modified_time + 10**9, modified_time + 10**9))
+    assert cache.load("array") is None
+    np.testing.assert_array_equal(cache.get("array", compute), array)
+    assert len(calls) == 2
+    np.testing.assert_array_equal(cache.load("array"), array)
+
+    # as is a partially written array
+    with open(array_path, "r+b") as array_file:
+        array_file.truncate(os.path.getsize(array_path) - 1)
+    assert cache.load("array") is None
+
+
+def test_atlas_cache_load_does_not_read_array(tmp_path, monkeypatch):
+    cache = atlas_cache.AtlasCache(tmp_path / "atlas")
+    array = np.arange(24, dtype=np.uint16).reshape(2, 3, 4)
+    cache.save("array", array)
+
+    def get_checksum(array):
+        raise AssertionError("the checksum is only verified when saving")
+
+    monkeypatch.setattr(atlas_cache, "get_checksum", get_checksum)
+    np.testing.assert_array_equal(cache.load("array"), array)
+
+
+def test_atlas_cache_unwritable(tmp_path):
+    not_a_directory = tmp_path / "file"
+    not_a_directory.write_text("")
+    cache = atlas_cache.AtlasCache(not_a_directory)
+    np.testing.assert_array_equal(cache.get("array", lambda: [1, 2]), [1, 2])
+    assert cache.load("array") is None
+
+
+def test_get_annotation_index(toy_atlas, tmp_path):
+    cache = atlas_cache.AtlasCache(tmp_path)
+    expected = index_annotations(toy_atlas.annotation)
+    for _ in range(2):
+        annotation_index = atlas_cache.get_annotation_index(
+            toy_atlas.annotation, cache=cache
+        )
+        np.testing.assert_array_equal(
+            annotation_index.structure_ids, expected.structure_ids
+        )
+        np.testing.assert_array_equal(
+            annotation_index.compact, expected.compact
+        )
+    assert isinstance(annotation_index.compact, np.memmap)
+    np.testing.assert_array_equal(
+        np.asarray(annotation_index), toy_atlas.annotation
+    )
+
+    # only the atlas values are recomputed if the relabelled image is cached
+    (tmp_path / "structure_ids.npy").unlink()
+    annotation_index = atlas_cache.get_annotation_index(
+        toy_atlas.annotation, cache=cache
+    )
+    np.testing.assert_array_equal(
+        annotation_index.structure_ids, expected.structure_ids
+    )
+    assert cache.load("structure_ids") is not None
+
+
+def test_get_hemisphere_index(toy_atlas, tmp_path):
+    hemispheres = toy_atlas.hemispheres
+    not_planar = hemispheres.copy()
+    not_planar[0, 0, 0] = 2
+    for name, image in [("planar", hemispheres), ("not", not_planar)]:
+        cache = atlas_cache.AtlasCache(tmp_path / name)
+        expected = index_hemispheres(image)
+        for _ in range(2):
+            hemisphere_index = atlas_cache.get_hemisphere_index(
+                image, cache=cache
+            )
+            assert hemisphere_index.midline == expected.midline
+            np.testing.assert_array_equal(
+                hemisphere_index.sides, expected.sides
+            )
+    assert hemisphere_index.midline is None
+
+
+def test_get_surface_points(toy_atlas, tmp_path):
+    annotation = np.zeros((6, 8, 10), dtype=np.uint32)
+    annotation[1:5, 1:7, 1:9] = toy_atlas.annotation
+    cache = atlas_cache.AtlasCache(tmp_path)
+    expected = get_points_from_image(annotation, boundary_only=True)
+    for _ in range(2):
+        np.testing.assert_array_equal(
+            atlas_cache.get_surface_points(annotation, cache=cache), expected
+        )
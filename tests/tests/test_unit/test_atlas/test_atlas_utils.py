@@ -1,3 +1,5 @@
+import pickle
+
 import numpy as np
 
 from brainglobe_segmentation.atlas import utils as atlas_utils
@@ -20,3 +22,164 @@ def test_lateralise_atlas_image(allen_mouse_50um_atlas):
     total_vals_out = len(annotations_left) + len(annotations_right)
 
     assert total_vals_in == total_vals_out
+
+
+def test_index_hemispheres():
+    hemispheres = np.array([[0, 1, 2], [2, 1, 3]])
+    hemisphere_index = atlas_utils.index_hemispheres(hemispheres)
+    np.testing.assert_array_equal(
+        hemisphere_index.sides,
+        [
+            [
+                atlas_utils.NO_HEMISPHERE,
+                atlas_utils.LEFT_HEMISPHERE,
+                atlas_utils.RIGHT_HEMISPHERE,
+            ],
+            [
+                atlas_utils.RIGHT_HEMISPHERE,
+                atlas_utils.LEFT_HEMISPHERE,
+                atlas_utils.NO_HEMISPHERE,
+            ],
+        ],
+    )
+    assert hemisphere_index.shape == hemispheres.shape
+    assert atlas_utils.index_hemispheres(hemisphere_index) is hemisphere_index
+
+    crop = hemisphere_index[1:, :2]
+    assert isinstance(crop, atlas_utils.HemisphereIndex)
+    np.testing.assert_array_equal(
+        crop.sides,
+        [[atlas_utils.RIGHT_HEMISPHERE, atlas_utils.LEFT_HEMISPHERE]],
+    )
+
+    # other hemisphere values
+    hemisphere_index = atlas_utils.index_hemispheres(
+        hemispheres, left_hemisphere_value=2, right_hemisphere_value=3
+    )
+    np.testing.assert_array_equal(
+        hemisphere_index.sides, [[2, 2, 0], [0, 2, 1]]
+    )
+
+
+def test_find_midline():
+    hemispheres = np.full((3, 4, 5), 2, dtype=np.uint8)
+    hemispheres[:, :, 3:] = 1
+    assert atlas_utils.find_midline(hemispheres) == (2, 3, False)
+    assert atlas_utils.find_midline(hemispheres.transpose(2, 0, 1)) == (
+        0,
+        3,
+        False,
+    )
+    assert atlas_utils.find_midline(3 - hemispheres) == (2, 3, True)
+    assert atlas_utils.find_midline(np.ones((3, 4, 5))) == (2, 5, True)
+
+    not_planar = hemispheres.copy()
+    not_planar[1, 1, 1] = 1
+    assert atlas_utils.find_midline(not_planar) is None
+    not_planar = hemispheres.copy()
+    not_planar[..., 0] = 0
+    assert atlas_utils.find_midline(not_planar) is None
+
+
+def test_index_hemispheres_midline():
+    hemispheres = np.full((3, 4, 5), 2, dtype=np.uint8)
+    hemispheres[:, :, 3:] = 1
+    hemisphere_index = atlas_utils.index_hemispheres(hemispheres)
+    assert hemisphere_index.midline == (2, 3, False)
+    expected_sides = np.where(
+        hemispheres == 1,
+        atlas_utils.LEFT_HEMISPHERE,
+        atlas_utils.RIGHT_HEMISPHERE,
+    )
+    np.testing.assert_array_equal(hemisphere_index.sides, expected_sides)
+
+    left, right = hemisphere_index.split()
+    assert np.all(hemispheres[left] == 1)
+    assert np.all(hemispheres[right] == 2)
+
+    crop = hemisphere_index[1:, :2, 2:4]
+    assert crop.midline == (2, 1, False)
+    np.testing.assert_array_equal(crop.sides, expected_sides[1:, :2, 2:4])
+    assert hemisphere_index[..., 4:].midline == (2, 0, False)
+    assert hemisphere_index[hemispheres == 1].midline is None
+
+    unpickled = pickle.loads(pickle.dumps(hemisphere_index))
+    assert unpickled.midline == hemisphere_index.midline
+    np.testing.assert_array_equal(unpickled.sides, expected_sides)
+
+
+def test_get_hemisphere_sides():
+    hemispheres = np.zeros((3, 4, 5), dtype=np.uint8)
+    hemispheres[:, :2] = 1
+    hemispheres[:, 2:, 1:] = 2
+    coordinates = (np.array([0, 2, 1]), np.array([1, 3, 2]), [4, 0, 1])
+    expected_sides = atlas_utils.index_hemispheres(hemispheres).sides[
+        coordinates
+    ]
+    np.testing.assert_array_equal(
+        atlas_utils.get_hemisphere_sides(hemispheres, coordinates),
+        expected_sides,
+    )
+    np.testing.assert_array_equal(
+        expected_sides,
+        [
+            atlas_utils.LEFT_HEMISPHERE,
+            atlas_utils.NO_HEMISPHERE,
+            atlas_utils.RIGHT_HEMISPHERE,
+        ],
+    )
+
+    hemispheres[:, 2:] = 2
+    hemisphere_index = atlas_utils.index_hemispheres(hemispheres)
+    assert hemisphere_index.midline is not None
+    np.testing.assert_array_equal(
+        atlas_utils.get_hemisphere_sides(hemisphere_index, coordinates),
+        atlas_utils.get_hemisphere_sides(hemispheres, coordinates),
+    )
+
+
+def test_lateralise_atlas_image_midline():
+    hemispheres = np.full((3, 4, 5), 2, dtype=np.uint8)
+    hemispheres[:, :, 3:] = 1
+    annotations = np.arange(hemispheres.size).reshape(hemispheres.shape)
+    expected_left, expected_right = atlas_utils.lateralise_atlas_image(
+        annotations, hemispheres
+    )
+    hemisphere_index = atlas_utils.index_hemispheres(hemispheres)
+    annotations_left, annotations_right = atlas_utils.lateralise_atlas_image(
+        annotations, hemisphere_index
+    )
+    # views of the annotations, rather than copies
+    assert np.shares_memory(annotations_left, annotations)
+    np.testing.assert_array_equal(
+        np.sort(annotations_left, axis=None), expected_left
+    )
+    np.testing.assert_array_equal(
+        np.sort(annotations_right, axis=None), expected_right
+    )
+
+
+def test_index_annotations():
+    values = np.array([0, 7, 614454277, 10], dtype=np.uint32)
+    annotations = np.random.default_rng(0).choice(values, size=(5, 4, 3))
+    annotation_index = atlas_utils.index_annotations(
+        annotations, slab_thickness=2
+    )
+    np.testing.assert_array_equal(
+        annotation_index.structure_ids, [0, 7, 10, 614454277]
+    )
+    assert annotation_index.compact.dtype == np.uint8
+    np.testing.assert_array_equal(
+        annotation_index.structure_ids[annotation_index.compact], annotations
+    )
+    assert annotation_index.shape == annotations.shape
+    assert annotation_index.dtype == annotations.dtype
+    assert atlas_utils.index_annotations(annotation_index) is annotation_index
+    np.testing.assert_array_equal(
+        atlas_utils.index_annotations(annotations, relabel=False),
+        annotation_index.structure_ids,
+    )
+
+    crop = annotation_index[1:3, :, 1]
+    assert isinstance(crop, atlas_utils.AnnotationIndex)
+    np.testing.assert_array_equal(np.asarray(crop), annotations[1:3, :, 1])
@@ -1,6 +1,9 @@
 import numpy as np
 
-from brainglobe_segmentation.image.utils import create_KDTree_from_image
+from brainglobe_segmentation.image.utils import (
+    create_KDTree_from_image,
+    get_bounding_box,
+)
 
 image = np.array(
     (
@@ -38,3 +41,42 @@ def test_create_KDTree_from_image():
 
     tree = create_KDTree_from_image(image, value=1)
     assert (tree.data == data_1).all()
+
+
+def test_create_KDTree_from_image_boundary_only():
+    tree = create_KDTree_from_image(image, boundary_only=True)
+    np.testing.assert_array_equal(
+        tree.data,
+        [[0, 2], [1, 1], [1, 3], [2, 0], [2, 3], [3, 1], [3, 2]],
+    )
+
+    rng = np.random.default_rng(0)
+    image_3d = np.zeros((20, 22, 24), dtype=np.uint8)
+    image_3d[4:16, 3:18, 5:20] = 1
+    image_3d[rng.random(image_3d.shape) < 0.05] = 0
+    query_points = np.argwhere(image_3d != 0) + rng.uniform(
+        -0.49, 0.49, (np.count_nonzero(image_3d), 3)
+    )
+
+    full_tree = create_KDTree_from_image(image_3d)
+    boundary_tree = create_KDTree_from_image(image_3d, boundary_only=True)
+    assert boundary_tree.n < full_tree.n / 5
+    np.testing.assert_allclose(
+        boundary_tree.query(query_points)[0],
+        full_tree.query(query_points)[0],
+    )
+
+
+def test_get_bounding_box():
+    assert get_bounding_box(image) == (slice(1, 3), slice(1, 3))
+
+    image_3d = np.zeros((10, 12, 14), dtype=np.uint16)
+    image_3d[2, 5, 7] = 1
+    image_3d[6, 3, 9] = 4
+    assert get_bounding_box(image_3d) == (
+        slice(2, 7),
+        slice(3, 6),
+        slice(7, 10),
+    )
+
+    assert get_bounding_box(np.zeros_like(image_3d)) is None
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+from napari.layers import Labels
+
+from brainglobe_segmentation.image.sparse import SparseArray
+from brainglobe_segmentation.image.utils import get_bounding_box
+from brainglobe_segmentation.regions import IO as region_IO
+from brainglobe_segmentation.regions.layers import (
+    add_new_label_layer,
+    load_regions_from_file,
+)
+
+SHAPE = (50, 70, 40)
+
+
+@pytest.fixture
+def arrays():
+    sparse = SparseArray(SHAPE, chunk_size=16)
+    dense = np.zeros(SHAPE, dtype=np.uint16)
+    for array in (sparse, dense):
+        array[3:10, 20:40, 5] = 2
+        array[30, 60:, :] = np.arange(40)
+        array[..., 39] = 3
+    return sparse, dense
+
+
+def test_sparse_array_indexing(arrays):
+    sparse, dense = arrays
+    np.testing.assert_array_equal(np.asarray(sparse), dense)
+    for key in [
+        (5, slice(15, 45), 5),
+        (slice(None, None, 3), 30),
+        (Ellipsis, 39),
+        -20,
+        (slice(10, 40, 7), slice(2, 70, 5), -1),
+        (slice(20, 10),),
+    ]:
+        np.testing.assert_array_equal(sparse[key], dense[key])
+
+    indices = (
+        np.array([3, 30, 49]),
+        np.array([20, 65, 0]),
+        np.array([5, 5, -1]),
+    )
+    np.testing.assert_array_equal(sparse[indices], dense[indices])
+    sparse[indices] = [7, 8, 9]
+    dense[indices] = [7, 8, 9]
+    np.testing.assert_array_equal(np.asarray(sparse), dense)
+
+
+def test_sparse_array_allocation():
+    sparse = SparseArray(SHAPE, chunk_size=16)
+    assert not sparse[:, :, :].any()
+    sparse[:20, :20, :20] = 0
+    assert sparse.nbytes == 0
+
+    sparse[17, 17, 17] = 1
+    assert list(sparse.chunks) == [(1, 1, 1)]
+    assert sparse.nbytes == 16**3 * 2
+    assert get_bounding_box(sparse) == (
+        slice(17, 18),
+        slice(17, 18),
+        slice(17, 18),
+    )
+
+    # erased chunks are freed
+    sparse[(np.array([17]), np.array([17]), np.array([17]))] = 0
+    assert sparse.nbytes == 0
+    assert get_bounding_box(sparse) is None
+
+
+def test_sparse_array_from_array(arrays, tmp_path):
+    sparse, dense = arrays
+    for array in (dense, load_regions_from_file(save_zarr(dense, tmp_path))):
+        copy = SparseArray.from_array(array, chunk_size=16)
+        assert copy.dtype == dense.dtype
+        assert copy.chunk_shape == sparse.chunk_shape
+        # only the chunks with nonzero values are allocated
+        assert copy.chunks.keys() == sparse.chunks.keys()
+        np.testing.assert_array_equal(np.asarray(copy), dense)
+
+
+def save_zarr(array, directory):
+    region_IO.save_regions_to_file(Labels(array, name="array"), directory)
+    return directory / "array.zarr"
+
+
+def test_sparse_labels_layer(arrays):
+    sparse, dense = arrays
+    viewer = ViewerModel()
+    layers = [viewer.add_labels(sparse), viewer.add_labels(dense)]
+    for layer in layers:
+        layer.n_edit_dimensions = 3
+        layer.brush_size = 5
+        layer.paint((25, 35, 20), 4)
+        layer.fill((25, 35, 20), 6)
+        layer.paint((6, 30, 5), 0)
+        layer.undo()
+    assert isinstance(layers[0].data, SparseArray)
+    np.testing.assert_array_equal(np.asarray(layers[0].data), layers[1].data)
+    assert get_bounding_box(sparse) == get_bounding_box(dense)
+
+
+def test_new_label_layer_is_sparse():
+    viewer = ViewerModel()
+    label_layer = add_new_label_layer(viewer, np.zeros(SHAPE))
+    assert isinstance(label_layer.data, SparseArray)
+    assert label_layer.data.shape == SHAPE
+    assert label_layer.data.nbytes == 0
+
+
+def test_save_sparse_array(arrays, tmp_path):
+    _, dense = arrays
+    for chunk_size in (16, 64):
+        # chunks the same as those saved are written directly
+        sparse = SparseArray(SHAPE, chunk_size=chunk_size)
+        sparse[:] = dense
+        name = f"sparse_{chunk_size}"
+        region_IO.save_regions_to_file(Labels(sparse, name=name), tmp_path)
+        saved = load_regions_from_file(tmp_path / f"{name}.zarr")
+        np.testing.assert_array_equal(saved[:], dense)
+        # the regions span both chunks along the second axis
+        assert saved.nchunks_initialized == 2
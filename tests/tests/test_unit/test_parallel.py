@@ -0,0 +1,67 @@
+import pickle
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+from brainglobe_segmentation.parallel import (
+    SharedArrayStore,
+    get_executor,
+    shared_arrays,
+)
+
+
+def sum_shared_array(shared_array, key):
+    return np.asarray(shared_array[key]).sum()
+
+
+def test_get_executor_serial():
+    with get_executor(1) as executor:
+        assert executor is None
+
+
+def test_shared_arrays():
+    image = np.arange(60, dtype=np.uint32).reshape(3, 4, 5)
+    hemispheres = np.ones((3, 4, 5), dtype=np.uint8)
+    with shared_arrays(image, hemispheres) as (
+        shared_image,
+        shared_hemispheres,
+    ):
+        assert shared_image.shape == image.shape
+        assert shared_image.dtype == image.dtype
+        np.testing.assert_array_equal(shared_image[1:, 2], image[1:, 2])
+        np.testing.assert_array_equal(shared_hemispheres, hemispheres)
+
+        with pytest.raises(ValueError):
+            shared_image.array[0, 0, 0] = 1
+
+        # only a reference to the shared memory is pickled
+        unpickled = pickle.loads(pickle.dumps(shared_image))
+        assert len(pickle.dumps(shared_image)) < image.nbytes
+        np.testing.assert_array_equal(unpickled, image)
+
+
+def test_shared_arrays_in_worker_processes():
+    image = np.arange(1000, dtype=np.int64).reshape(10, 100)
+    with get_executor(2) as executor, shared_arrays(image) as (shared,):
+        sums = [
+            executor.submit(sum_shared_array, shared, idx).result()
+            for idx in range(len(image))
+        ]
+    assert sums == list(image.sum(axis=1))
+
+
+def test_shared_array_store():
+    image = np.arange(60, dtype=np.uint32).reshape(3, 4, 5)
+    store = SharedArrayStore()
+    with shared_arrays(image, store=store) as (shared_image,):
+        pass
+    # kept after the context exits, and reused when shared again
+    np.testing.assert_array_equal(shared_image, image)
+    with shared_arrays(image, store=store) as (shared_again,):
+        assert shared_again.name == shared_image.name
+    assert store.share(image.copy()).name != shared_image.name
+
+    store.release()
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=shared_image.name)
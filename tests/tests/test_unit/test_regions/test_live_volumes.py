@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+from napari.layers import Labels
+
+from brainglobe_segmentation.atlas.utils import (
+    index_annotations,
+    index_hemispheres,
+)
+from brainglobe_segmentation.regions.analysis import (
+    analyse_region_brain_areas,
+    count_region_structure_voxels,
+    save_live_volumes,
+)
+from brainglobe_segmentation.regions.live_volumes import LiveRegionVolumes
+
+
+@pytest.fixture(params=[False, True], ids=["images", "indexed"])
+def live_volumes(toy_atlas, request):
+    labels_layer = Labels(
+        np.zeros(toy_atlas.annotation.shape, dtype=np.uint16)
+    )
+    labels_layer.n_edit_dimensions = 3
+    annotations = toy_atlas.annotation
+    hemispheres = toy_atlas.hemispheres
+    if request.param:
+        annotations = index_annotations(annotations)
+        hemispheres = index_hemispheres(hemispheres)
+    return LiveRegionVolumes(
+        labels_layer,
+        annotations,
+        hemispheres,
+        left_hemisphere_value=toy_atlas.left_hemisphere_value,
+        right_hemisphere_value=toy_atlas.right_hemisphere_value,
+    )
+
+
+def check_counts(live_volumes):
+    data = live_volumes.label_layer.data
+    expected = count_region_structure_voxels(
+        data, live_volumes.annotations, live_volumes.hemispheres
+    )
+    for counts, expected_counts in zip(live_volumes.counts, expected):
+        np.testing.assert_array_equal(counts, expected_counts)
+    assert live_volumes.n_voxels == np.count_nonzero(data)
+
+
+def test_live_volumes_paint(live_volumes):
+    labels_layer = live_volumes.label_layer
+    updates = []
+    live_volumes.callbacks.append(updates.append)
+    assert live_volumes.n_voxels == 0
+
+    labels_layer.brush_size = 3
+    labels_layer.paint((1, 2, 3), 1)
+    assert not live_volumes.stale
+    assert len(updates) == 1
+    check_counts(live_volumes)
+
+    # painting over the region with a different label doesn't change it
+    labels_layer.paint((1, 2, 3), 2)
+    check_counts(live_volumes)
+
+    labels_layer.paint((2, 4, 5), 1)
+    labels_layer.data_setitem(
+        (np.array([0, 3]), np.array([0, 5]), np.array([7, 7])), 1
+    )
+    check_counts(live_volumes)
+
+    # erasing
+    labels_layer.paint((1, 2, 3), 0)
+    assert not live_volumes.stale
+    check_counts(live_volumes)
+
+
+def test_live_volumes_fill(live_volumes):
+    labels_layer = live_volumes.label_layer
+    labels_layer.fill((0, 0, 0), 1)
+    assert not live_volumes.stale
+    check_counts(live_volumes)
+
+
+def test_live_volumes_undo(live_volumes):
+    labels_layer = live_volumes.label_layer
+    labels_layer.paint((1, 2, 3), 1)
+    labels_layer.paint((2, 4, 5), 1)
+
+    labels_layer.undo()
+    assert live_volumes.stale
+    check_counts(live_volumes)
+    assert not live_volumes.stale
+
+    labels_layer.redo()
+    check_counts(live_volumes)
+
+    # refreshing without changing the data doesn't invalidate the counts
+    labels_layer.refresh()
+    assert not live_volumes.stale
+
+    labels_layer.data = np.ones_like(labels_layer.data)
+    check_counts(live_volumes)
+
+
+def test_save_live_volumes(live_volumes, toy_atlas, tmp_path):
+    labels_layer = live_volumes.label_layer
+    labels_layer.name = "region"
+    labels_layer.brush_size = 3
+    labels_layer.paint((1, 2, 3), 1)
+    labels_layer.paint((2, 4, 5), 1)
+    other_layer = Labels(np.ones_like(labels_layer.data), name="other")
+
+    live_directory = tmp_path / "live"
+    analysed_directory = tmp_path / "analysed"
+    live_directory.mkdir()
+    analysed_directory.mkdir()
+
+    remaining = save_live_volumes(
+        [labels_layer, other_layer],
+        [live_volumes],
+        live_volumes.annotations,
+        live_volumes.hemispheres,
+        live_directory,
+        toy_atlas,
+    )
+    assert remaining == [other_layer]
+
+    analyse_region_brain_areas(
+        labels_layer,
+        toy_atlas.annotation,
+        toy_atlas.hemispheres,
+        analysed_directory,
+        toy_atlas,
+    )
+    assert (live_directory / "region.csv").read_text() == (
+        analysed_directory / "region.csv"
+    ).read_text()
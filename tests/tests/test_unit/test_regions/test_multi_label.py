@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+from napari.components import ViewerModel
+from napari.layers import Labels
+
+from brainglobe_segmentation.atlas.utils import (
+    index_annotations,
+    index_hemispheres,
+)
+from brainglobe_segmentation.regions import IO as region_IO
+from brainglobe_segmentation.regions.analysis import (
+    analyse_multi_label_brain_areas,
+    analyse_region_brain_areas,
+    summarise_brain_regions,
+    summarise_single_brain_region_chunked,
+)
+from brainglobe_segmentation.regions.layers import (
+    REGION_NAMES_KEY,
+    add_existing_region_segmentation,
+    add_new_region_label,
+    get_region_names,
+)
+
+
+@pytest.fixture
+def multi_label_layer(toy_atlas):
+    data = np.zeros(toy_atlas.annotation.shape, dtype=np.uint16)
+    data[:3, 1:5, 1:7] = 1
+    data[1:, 4:, 3:] = 2
+    data[0, 0, 0] = 5  # not in the region names
+    return Labels(
+        data,
+        name="regions",
+        metadata={REGION_NAMES_KEY: {1: "region_a", 2: "region_b"}},
+    )
+
+
+def single_region_layers(multi_label_layer):
+    data = multi_label_layer.data
+    return [
+        Labels((data == 1).astype(np.uint16), name="region_a"),
+        Labels((data == 2).astype(np.uint16), name="region_b"),
+        Labels((data == 5).astype(np.uint16), name="regions_5"),
+    ]
+
+
+def test_add_new_region_label():
+    viewer = ViewerModel()
+    image = np.zeros((10, 20, 30))
+    label_layers = [viewer.add_labels(np.zeros((10, 20, 30), dtype=int))]
+    label_layers[0].name = "region_0"
+
+    for label_id in (1, 2):
+        label_layer, new_label_id = add_new_region_label(
+            viewer, label_layers, image, 5
+        )
+        assert new_label_id == label_id
+        assert label_layer.selected_label == label_id
+    assert len(label_layers) == 2
+    assert label_layers[1] is label_layer
+    assert label_layer.data.shape == image.shape
+    assert get_region_names(label_layer) == {1: "region_1", 2: "region_2"}
+    assert get_region_names(label_layers[0]) is None
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+@pytest.mark.parametrize("slab_thickness", [1, 64])
+def test_analyse_multi_label_brain_areas(
+    multi_label_layer, toy_atlas, tmp_path, indexed, slab_thickness
+):
+    annotations = toy_atlas.annotation
+    hemispheres = toy_atlas.hemispheres
+    if indexed:
+        annotations = index_annotations(annotations)
+        hemispheres = index_hemispheres(hemispheres)
+    multi_label_directory = tmp_path / "multi_label"
+    single_directory = tmp_path / "single"
+    multi_label_directory.mkdir()
+    single_directory.mkdir()
+
+    analyse_multi_label_brain_areas(
+        multi_label_layer,
+        annotations,
+        hemispheres,
+        multi_label_directory,
+        toy_atlas,
+        slab_thickness=slab_thickness,
+    )
+    for label_layer in single_region_layers(multi_label_layer):
+        analyse_region_brain_areas(
+            label_layer, annotations, hemispheres, single_directory, toy_atlas
+        )
+
+    filenames = sorted(path.name for path in single_directory.iterdir())
+    assert filenames == ["region_a.csv", "region_b.csv", "regions_5.csv"]
+    assert (
+        sorted(path.name for path in multi_label_directory.iterdir())
+        == filenames
+    )
+    for filename in filenames:
+        pd.testing.assert_frame_equal(
+            pd.read_csv(multi_label_directory / filename),
+            pd.read_csv(single_directory / filename),
+        )
+
+
+def test_summarise_multi_label_regions(multi_label_layer, tmp_path):
+    summarise_brain_regions(
+        [multi_label_layer], tmp_path / "multi_label.csv", (100, 100, 100)
+    )
+    summarise_brain_regions(
+        single_region_layers(multi_label_layer),
+        tmp_path / "single.csv",
+        (100, 100, 100),
+    )
+    multi_label_summary = pd.read_csv(tmp_path / "multi_label.csv")
+    pd.testing.assert_frame_equal(
+        multi_label_summary, pd.read_csv(tmp_path / "single.csv")
+    )
+
+    chunked = summarise_single_brain_region_chunked(
+        multi_label_layer, slab_thickness=1
+    )
+    assert list(chunked["region"]) == ["region_a", "region_b", "regions_5"]
+
+
+def test_save_multi_label_layer(multi_label_layer, tmp_path):
+    region_IO.save_label_layers(tmp_path, [multi_label_layer])
+
+    label_layers = []
+    add_existing_region_segmentation(
+        tmp_path, ViewerModel(), label_layers, ".zarr"
+    )
+    (label_layer,) = label_layers
+    assert get_region_names(label_layer) == {1: "region_a", 2: "region_b"}
+    np.testing.assert_array_equal(
+        np.asarray(label_layer.data), multi_label_layer.data
+    )
+
+
+def test_export_multi_label_regions(multi_label_layer, tmp_path):
+    multi_label_directory = tmp_path / "multi_label"
+    single_directory = tmp_path / "single"
+    region_IO.export_label_layers(
+        multi_label_directory, [multi_label_layer], 100
+    )
+    region_IO.export_label_layers(
+        single_directory, single_region_layers(multi_label_layer)[:2], 100
+    )
+    for filename in ("region_a.obj", "region_b.obj"):
+        assert (multi_label_directory / filename).read_text() == (
+            single_directory / filename
+        ).read_text()
+    assert (multi_label_directory / "regions_5.obj").exists()
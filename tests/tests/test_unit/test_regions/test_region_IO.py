@@ -1,9 +1,18 @@
 from filecmp import cmp
 from pathlib import Path
 
+import numpy as np
 import tifffile
+from napari.components import ViewerModel
+from napari.layers import Labels
 
+from brainglobe_segmentation.image.sparse import SparseArray
 from brainglobe_segmentation.regions import IO as region_IO
+from brainglobe_segmentation.regions.analysis import is_lazy_array
+from brainglobe_segmentation.regions.layers import (
+    add_existing_region_segmentation,
+    load_regions_from_file,
+)
 
 regions_dir = Path.cwd() / "tests" / "data" / "regions"
 VOXEL_SIZE = 100
@@ -15,3 +24,136 @@ def test_export_regions_to_file(tmp_path):
     region_IO.export_regions_to_file(image, filename, VOXEL_SIZE)
 
     cmp(regions_dir / "region.obj", tmp_path / "region.obj")
+
+
+def test_save_regions_to_zarr(tmp_path):
+    data = np.zeros((100, 130, 70), dtype=np.uint16)
+    data[10:20, 70:80, 5:15] = 2
+    data[15, 75, 10] = 40000
+    label_layer = Labels(data, name="region")
+    region_IO.save_regions_to_file(label_layer, tmp_path)
+
+    saved = load_regions_from_file(tmp_path / "region.zarr")
+    assert saved.dtype == data.dtype
+    np.testing.assert_array_equal(saved[:], data)
+    # empty chunks are not stored
+    assert saved.nchunks_initialized == 1
+
+    # unedited layers opened from the file are not saved again
+    region_IO.save_regions_to_file(Labels(saved, name="region"), tmp_path)
+    np.testing.assert_array_equal(saved[:], data)
+
+    region_IO.save_regions_to_file(Labels(data * 0, name="empty"), tmp_path)
+    assert not (tmp_path / "empty.zarr").exists()
+
+
+def test_add_existing_region_segmentation(tmp_path):
+    data = np.zeros((20, 30, 40), dtype=np.uint16)
+    data[5:10, 5:10, 5:10] = 1
+    region_IO.save_regions_to_file(Labels(data, name="new"), tmp_path)
+    region_IO.save_regions_to_file(
+        Labels(data, name="new"), tmp_path, image_extension=".tiff"
+    )
+    region_IO.save_regions_to_file(
+        Labels(data * 3, name="legacy"), tmp_path, image_extension=".tiff"
+    )
+
+    viewer = ViewerModel()
+    label_layers = []
+    add_existing_region_segmentation(
+        tmp_path,
+        viewer,
+        label_layers,
+        ".zarr",
+        legacy_file_extension=".tiff",
+    )
+    assert [layer.name for layer in label_layers] == ["new", "legacy"]
+    new_layer, legacy_layer = label_layers
+    np.testing.assert_array_equal(legacy_layer.data, data * 3)
+
+    # opened lazily, and loaded into memory to be edited
+    assert not isinstance(new_layer.data, np.ndarray)
+    np.testing.assert_array_equal(np.asarray(new_layer.data), data)
+    new_layer.mode = "paint"
+    assert isinstance(new_layer.data, SparseArray)
+    np.testing.assert_array_equal(np.asarray(new_layer.data), data)
+    new_layer.paint((15, 15, 15), 2)
+    region_IO.save_regions_to_file(new_layer, tmp_path)
+    assert load_regions_from_file(tmp_path / "new.zarr")[15, 15, 15] == 2
+
+
+def test_add_existing_region_segmentation_memmap(tmp_path):
+    data = np.zeros((20, 30, 40), dtype=np.int16)
+    data[5:10, 5:10, 5:10] = 1
+    for name in ("a", "b", "c"):
+        region_IO.save_regions_to_file(
+            Labels(data, name=name), tmp_path, image_extension=".tiff"
+        )
+
+    viewer = ViewerModel()
+    label_layers = []
+    add_existing_region_segmentation(
+        tmp_path, viewer, label_layers, ".tiff", n_threads=2
+    )
+    assert [layer.name for layer in label_layers] == ["a", "b", "c"]
+
+    # legacy tiffs are memory-mapped, and analysed as lazy arrays
+    layer = label_layers[0]
+    assert isinstance(layer.data, np.memmap)
+    assert not layer.data.flags.writeable
+    assert is_lazy_array(layer.data)
+
+    # saving an unedited memory-mapped region leaves the file unchanged
+    region_IO.save_regions_to_file(layer, tmp_path, image_extension=".tiff")
+    np.testing.assert_array_equal(layer.data, data)
+
+    # loaded into memory to be edited
+    layer.mode = "paint"
+    assert isinstance(layer.data, SparseArray)
+    np.testing.assert_array_equal(np.asarray(layer.data), data)
+    layer.paint((15, 15, 15), 2)
+    region_IO.save_regions_to_file(layer, tmp_path, image_extension=".tiff")
+    assert tifffile.imread(tmp_path / "a.tiff")[15, 15, 15] == 2
+
+
+def test_edit_saved_region_loads_written_chunks(tmp_path):
+    data = np.zeros((200, 150, 260), dtype=np.uint16)
+    data[10:20, 70:80, 5:15] = 2
+    data[150:160, 140:150, 250:256] = 3
+    region_IO.save_regions_to_file(Labels(data, name="region"), tmp_path)
+
+    viewer = ViewerModel()
+    label_layers = []
+    add_existing_region_segmentation(tmp_path, viewer, label_layers, ".zarr")
+    layer = label_layers[0]
+    layer.mode = "paint"
+
+    # only the chunks holding the regions are loaded into memory
+    assert isinstance(layer.data, SparseArray)
+    assert len(layer.data.chunks) == 2
+    assert layer.data.nbytes < data.nbytes / 10
+    np.testing.assert_array_equal(np.asarray(layer.data), data)
+
+
+def test_export_label_layers_anisotropic(tmp_path):
+    image = np.zeros((10, 12, 14), dtype=np.uint16)
+    image[2:5, 3:9, 4:12] = 1
+    resolution = (10, 20, 50)
+    region_IO.export_label_layers(
+        tmp_path, [Labels(image, name="region")], resolution
+    )
+    verts = np.array(
+        [
+            line.split()[1:]
+            for line in (tmp_path / "region.obj").read_text().splitlines()
+            if line.startswith("v ")
+        ],
+        dtype=float,
+    )
+    # the surface (at threshold 0) passes through the surrounding voxels
+    np.testing.assert_allclose(
+        verts.min(axis=0), np.array([1, 2, 3]) * resolution
+    )
+    np.testing.assert_allclose(
+        verts.max(axis=0), np.array([5, 9, 12]) * resolution
+    )
@@ -1,15 +1,35 @@
+import tracemalloc
+from concurrent.futures import Future
 from pathlib import Path
 
+import dask.array as da
 import numpy as np
 import pandas as pd
 import pytest
 import tifffile
 from napari.layers import Labels
+from skimage.measure import regionprops_table
 
+from brainglobe_segmentation.atlas.utils import (
+    index_annotations,
+    index_hemispheres,
+)
+from brainglobe_segmentation.parallel import SharedArrayStore, get_executor
 from brainglobe_segmentation.regions.analysis import (
+    analyse_region_brain_areas,
+    analyse_region_brain_areas_chunked,
+    analyse_region_brain_areas_fused,
+    analyse_region_brain_areas_parallel,
     check_list_only_nones,
+    count_region_structure_voxels,
+    count_structure_voxels,
+    count_structure_voxels_by_side,
+    count_structure_voxels_multi_label,
+    count_structure_voxels_multi_layer,
+    region_analysis,
     summarise_brain_regions,
     summarise_single_brain_region,
+    summarise_single_brain_region_chunked,
 )
 
 region_image_path = Path(
@@ -152,3 +172,432 @@ def test_summarise_brain_regions_all_empty(
         )
         is None
     )
+
+
+def test_count_structure_voxels():
+    annotations_left = np.array([0, 0, 3, 3, 5, 0])
+    annotations_right = np.array([0, 1, 3, 1, 0, 8, 1])
+    structure_ids, counts_left, counts_right = count_structure_voxels(
+        annotations_left, annotations_right
+    )
+    # structures in the left hemisphere first, then right-only structures
+    np.testing.assert_array_equal(structure_ids, [3, 5, 1, 8])
+    np.testing.assert_array_equal(counts_left, [2, 1, 0, 0])
+    np.testing.assert_array_equal(counts_right, [1, 0, 3, 1])
+
+
+def test_count_structure_voxels_by_side():
+    annotations = np.array([0, 3, 3, 5, 1, 3, 8, 1, 1, 5])
+    sides = np.array([0, 0, 0, 0, 1, 1, 1, 1, 1, 2])
+    structure_ids, counts_left, counts_right = count_structure_voxels_by_side(
+        annotations, sides
+    )
+    # voxels not in either hemisphere (2) are not counted
+    np.testing.assert_array_equal(structure_ids, [3, 5, 1, 8])
+    np.testing.assert_array_equal(counts_left, [2, 1, 0, 0])
+    np.testing.assert_array_equal(counts_right, [1, 0, 3, 1])
+
+
+def test_count_region_structure_voxels_hemisphere_index(toy_atlas):
+    hemispheres = toy_atlas.hemispheres.copy()
+    hemispheres[:, :, 0] = 0  # outside the brain
+    region = np.zeros(toy_atlas.annotation.shape, dtype=np.uint16)
+    region[1:3, 1:5, :5] = 1
+    hemisphere_index = index_hemispheres(hemispheres)
+
+    expected = count_region_structure_voxels(
+        region, toy_atlas.annotation, hemispheres
+    )
+    for counts, expected_counts in zip(
+        count_region_structure_voxels(
+            region, toy_atlas.annotation, hemisphere_index
+        ),
+        expected,
+    ):
+        np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_array_equal(expected[0], [7, 10, 500000000])
+    np.testing.assert_array_equal(expected[1] + expected[2], [12, 10, 10])
+
+
+def test_analyse_region_brain_areas(toy_atlas, tmp_path):
+    region = np.zeros(toy_atlas.annotation.shape, dtype=np.uint16)
+    region[1:3, 2:5, 3:6] = 1
+    labels_layer = Labels(region, name=label_name)
+
+    analyse_region_brain_areas(
+        labels_layer,
+        toy_atlas.annotation,
+        toy_atlas.hemispheres,
+        tmp_path,
+        toy_atlas,
+    )
+    df = pd.read_csv(tmp_path / f"{label_name}.csv")
+
+    voxel_volume = 0.001
+    total_voxels = np.count_nonzero(region)
+    assert list(df["structure_name"]) == [
+        "structure_7",
+        "structure_10",
+        "structure_500000000",
+    ]
+    expected_left = np.array([3, 1, 2])
+    expected_right = np.array([6, 2, 4])
+    np.testing.assert_allclose(
+        df["left_volume_mm3"], expected_left * voxel_volume
+    )
+    np.testing.assert_allclose(
+        df["right_volume_mm3"], expected_right * voxel_volume
+    )
+    np.testing.assert_allclose(
+        df["total_volume_mm3"],
+        (expected_left + expected_right) * voxel_volume,
+    )
+    np.testing.assert_allclose(
+        df["percentage_of_total"],
+        100 * (expected_left + expected_right) / total_voxels,
+    )
+    assert df["percentage_of_total"].sum() == pytest.approx(100)
+
+
+def test_analyse_region_brain_areas_empty(toy_atlas, tmp_path):
+    labels_layer = Labels(
+        np.zeros(toy_atlas.annotation.shape, dtype=np.uint16),
+        name=label_name,
+    )
+    analyse_region_brain_areas(
+        labels_layer,
+        toy_atlas.annotation,
+        toy_atlas.hemispheres,
+        tmp_path,
+        toy_atlas,
+    )
+    assert not (tmp_path / f"{label_name}.csv").exists()
+
+
+def test_summarise_single_brain_region_offset():
+    """
+    Summary is calculated within the region bounding box, check the
+    coordinates are relative to the full image
+    """
+    region = np.zeros((20, 30, 40), dtype=np.uint16)
+    region[5:9, 12:20, 30:33] = 1
+    region[7, 21, 29] = 1
+    df = summarise_single_brain_region(Labels(region, name=label_name))
+
+    expected = regionprops_table(
+        region, properties=["area", "bbox", "centroid"]
+    )
+    for key, value in expected.items():
+        np.testing.assert_allclose(df[key], value)
+
+
+def test_analyse_region_brain_areas_fused(toy_atlas, tmp_path):
+    """
+    Analysing all regions together should give the same results as
+    analysing them one at a time
+    """
+    shape = toy_atlas.annotation.shape
+    regions = [np.zeros(shape, dtype=np.uint16) for _ in range(3)]
+    regions[0][1:3, 2:5, 3:6] = 1
+    regions[2][:, 4:, :] = 1
+    label_layers = [
+        Labels(region, name=f"region_{idx}")
+        for idx, region in enumerate(regions)
+    ]
+
+    single_directory = tmp_path / "single"
+    fused_directory = tmp_path / "fused"
+    single_directory.mkdir()
+    fused_directory.mkdir()
+    for label_layer in label_layers:
+        analyse_region_brain_areas(
+            label_layer,
+            toy_atlas.annotation,
+            toy_atlas.hemispheres,
+            single_directory,
+            toy_atlas,
+        )
+    analyse_region_brain_areas_fused(
+        label_layers,
+        toy_atlas.annotation,
+        toy_atlas.hemispheres,
+        fused_directory,
+        toy_atlas,
+    )
+
+    # empty region is not analysed
+    assert not (fused_directory / "region_1.csv").exists()
+    for name in ["region_0.csv", "region_2.csv"]:
+        pd.testing.assert_frame_equal(
+            pd.read_csv(fused_directory / name),
+            pd.read_csv(single_directory / name),
+        )
+
+
+def test_count_structure_voxels_spread_regions_memory():
+    """
+    Regions at opposite corners of the atlas span the whole atlas, but only
+    their voxels should be read, rather than copies of the whole atlas
+    """
+    shape = (100, 120, 140)
+    annotations = index_annotations(
+        np.arange(np.prod(shape), dtype=np.uint32).reshape(shape) % 7
+    )
+    hemispheres = np.ones(shape, dtype=np.uint8)
+    hemispheres[..., 70:] = 2
+    hemispheres = index_hemispheres(hemispheres)
+    regions = [np.zeros(shape, dtype=np.uint8) for _ in range(2)]
+    regions[0][:3, :3, :3] = 1
+    regions[1][-3:, -3:, -3:] = 1
+    labels = regions[0] + 2 * regions[1]
+    bounding_boxes = [
+        (slice(0, 3),) * 3,
+        tuple(slice(size - 3, size) for size in shape),
+    ]
+
+    tracemalloc.start()
+    structure_ids, counts = count_structure_voxels_multi_layer(
+        regions, bounding_boxes, annotations, hemispheres
+    )
+    _, multi_layer_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    label_ids, _, label_counts = count_structure_voxels_multi_label(
+        labels, annotations, hemispheres, slab_thickness=shape[0]
+    )
+    _, multi_label_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert counts.sum() == label_counts.sum() == 2 * 27
+    assert multi_layer_peak < np.prod(shape) / 100
+    assert multi_label_peak < np.prod(shape) / 100
+
+
+@pytest.mark.parametrize("planar", [True, False])
+def test_analyse_region_brain_areas_indexed(toy_atlas, tmp_path, planar):
+    """
+    Analysing regions with indexed annotations and hemispheres should give
+    the same results as with the original images
+    """
+    hemispheres = toy_atlas.hemispheres.copy()
+    if not planar:
+        hemispheres[:, :, 0] = 0
+    annotation_index = index_annotations(toy_atlas.annotation)
+    hemisphere_index = index_hemispheres(hemispheres)
+    assert (hemisphere_index.midline is not None) == planar
+
+    shape = toy_atlas.annotation.shape
+    regions = [np.zeros(shape, dtype=np.uint16) for _ in range(2)]
+    regions[0][1:3, 2:5, :6] = 1
+    regions[1][:, 4:, :] = 1
+    label_layers = [
+        Labels(region, name=f"region_{idx}")
+        for idx, region in enumerate(regions)
+    ]
+
+    directories = {}
+    for name in ["original", "single", "fused", "parallel"]:
+        directories[name] = tmp_path / name
+        directories[name].mkdir()
+    for label_layer in label_layers:
+        analyse_region_brain_areas(
+            label_layer,
+            toy_atlas.annotation,
+            hemispheres,
+            directories["original"],
+            toy_atlas,
+        )
+        analyse_region_brain_areas(
+            label_layer,
+            annotation_index,
+            hemisphere_index,
+            directories["single"],
+            toy_atlas,
+        )
+    analyse_region_brain_areas_fused(
+        label_layers,
+        annotation_index,
+        hemisphere_index,
+        directories["fused"],
+        toy_atlas,
+    )
+    with get_executor(2) as executor:
+        analyse_region_brain_areas_parallel(
+            label_layers,
+            annotation_index,
+            hemisphere_index,
+            directories["parallel"],
+            toy_atlas,
+            executor,
+        )
+
+    for label_layer in label_layers:
+        expected = (
+            directories["original"] / f"{label_layer.name}.csv"
+        ).read_text()
+        for name in ["single", "fused", "parallel"]:
+            assert (
+                directories[name] / f"{label_layer.name}.csv"
+            ).read_text() == expected
+
+
+def test_analyse_region_brain_areas_parallel(toy_atlas, tmp_path):
+    shape = toy_atlas.annotation.shape
+    regions = [np.zeros(shape, dtype=np.uint16) for _ in range(3)]
+    regions[0][1:3, 2:5, 3:6] = 1
+    regions[2][:, 4:, :] = 1
+    label_layers = [
+        Labels(region, name=f"region_{idx}")
+        for idx, region in enumerate(regions)
+    ]
+
+    serial_directory = tmp_path / "serial"
+    parallel_directory = tmp_path / "parallel"
+    stored_directory = tmp_path / "stored"
+    serial_directory.mkdir()
+    parallel_directory.mkdir()
+    stored_directory.mkdir()
+    for label_layer in label_layers:
+        analyse_region_brain_areas(
+            label_layer,
+            toy_atlas.annotation,
+            toy_atlas.hemispheres,
+            serial_directory,
+            toy_atlas,
+        )
+    with get_executor(2) as executor:
+        analyse_region_brain_areas_parallel(
+            label_layers,
+            toy_atlas.annotation,
+            toy_atlas.hemispheres,
+            parallel_directory,
+            toy_atlas,
+            executor,
+        )
+        summarise_brain_regions(
+            label_layers,
+            parallel_directory / "summary.csv",
+            atlas_resolution,
+            executor=executor,
+        )
+
+        # the atlas is only shared once for repeated analyses
+        shared_store = SharedArrayStore()
+        hemisphere_index = index_hemispheres(
+            np.asarray(toy_atlas.hemispheres).copy()
+        )
+        for _ in range(2):
+            analyse_region_brain_areas_parallel(
+                label_layers,
+                toy_atlas.annotation,
+                hemisphere_index,
+                stored_directory,
+                toy_atlas,
+                executor,
+                shared_store=shared_store,
+            )
+            assert len(shared_store.shared) == 1 + (
+                hemisphere_index.midline is None
+            )
+        shared_store.release()
+    summarise_brain_regions(
+        label_layers, serial_directory / "summary.csv", atlas_resolution
+    )
+
+    assert not (parallel_directory / "region_1.csv").exists()
+    for name in ["region_0.csv", "region_2.csv", "summary.csv"]:
+        pd.testing.assert_frame_equal(
+            pd.read_csv(parallel_directory / name),
+            pd.read_csv(serial_directory / name),
+        )
+    for name in ["region_0.csv", "region_2.csv"]:
+        pd.testing.assert_frame_equal(
+            pd.read_csv(stored_directory / name),
+            pd.read_csv(serial_directory / name),
+        )
+
+
+def test_analyse_region_brain_areas_chunked(toy_atlas, tmp_path):
+    """
+    Lazy label layers are analysed in slabs, which should give the same
+    results as analysing the whole image at once
+    """
+    region = np.zeros(toy_atlas.annotation.shape, dtype=np.uint16)
+    region[1:4, 2:5, 3:6] = 1
+    region[0, 0, 0] = 2
+    labels_layer = Labels(region, name="in_memory")
+    lazy_labels_layer = Labels(da.from_array(region, chunks=2), name="lazy")
+
+    analyse_region_brain_areas(
+        labels_layer,
+        toy_atlas.annotation,
+        toy_atlas.hemispheres,
+        tmp_path,
+        toy_atlas,
+    )
+    analyse_region_brain_areas_chunked(
+        lazy_labels_layer,
+        toy_atlas.annotation,
+        toy_atlas.hemispheres,
+        tmp_path,
+        toy_atlas,
+        slab_thickness=1,
+    )
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "lazy.csv"),
+        pd.read_csv(tmp_path / "in_memory.csv"),
+    )
+
+    summary = summarise_single_brain_region(labels_layer)
+    summary_chunked = summarise_single_brain_region_chunked(
+        lazy_labels_layer, slab_thickness=1
+    )
+    summary_chunked["region"] = summary["region"]
+    pd.testing.assert_frame_equal(summary_chunked, summary)
+
+
+def test_chunked_empty(toy_atlas, tmp_path):
+    lazy_labels_layer = Labels(
+        da.zeros(toy_atlas.annotation.shape, dtype=np.uint16, chunks=2),
+        name=label_name,
+    )
+    analyse_region_brain_areas_chunked(
+        lazy_labels_layer,
+        toy_atlas.annotation,
+        toy_atlas.hemispheres,
+        tmp_path,
+        toy_atlas,
+    )
+    assert not (tmp_path / f"{label_name}.csv").exists()
+    assert summarise_single_brain_region_chunked(lazy_labels_layer) is None
+
+
+def test_region_analysis_lazy_and_in_memory(toy_atlas, tmp_path):
+    region = np.zeros(toy_atlas.annotation.shape, dtype=np.uint16)
+    region[1:4, 2:5, 3:6] = 1
+    label_layers = [
+        Labels(region, name="in_memory"),
+        Labels(da.from_array(region, chunks=2), name="lazy"),
+    ]
+    # the atlas indices can be passed while still being built
+    annotation_index = Future()
+    annotation_index.set_result(index_annotations(toy_atlas.annotation))
+    worker = region_analysis(
+        label_layers,
+        annotation_index,
+        toy_atlas,
+        toy_atlas.hemispheres,
+        tmp_path,
+        output_csv_file=tmp_path / "summary.csv",
+        slab_thickness=2,
+    )
+    worker.run()
+
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "lazy.csv"),
+        pd.read_csv(tmp_path / "in_memory.csv"),
+    )
+    summary = pd.read_csv(tmp_path / "summary.csv")
+    assert list(summary["region"]) == ["in_memory", "lazy"]
+    pd.testing.assert_frame_equal(
+        summary.iloc[[0], 1:], summary.iloc[[1], 1:].set_index(pd.Index([0]))
+    )
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+import zarr
+from napari.layers import Labels
+
+from brainglobe_segmentation.regions import IO as region_IO
+from brainglobe_segmentation.regions.changes import RegionChanges
+from brainglobe_segmentation.regions.layers import load_regions_from_file
+
+SHAPE = (100, 130, 70)
+
+
+@pytest.fixture
+def label_layer():
+    data = np.zeros(SHAPE, dtype=np.uint16)
+    data[10:20, 70:80, 5:15] = 2
+    label_layer = Labels(data, name="region")
+    label_layer.n_edit_dimensions = 3
+    label_layer.brush_size = 5
+    return label_layer
+
+
+def mark_saved_chunk(filename, key=(99, 129, 69), value=123):
+    # write to the saved array directly, to check which chunks a save
+    # rewrites
+    zarr.open_array(str(filename), mode="r+")[key] = value
+
+
+def test_region_changes_paint(label_layer, tmp_path):
+    changes = RegionChanges(label_layer)
+    filename = tmp_path / "region.zarr"
+    assert changes.begin_save(filename) is None
+
+    label_layer.paint((70, 70, 30), 3)
+    label_layer.fill((15, 75, 10), 4)
+    assert changes.dirty_chunks == {(1, 1, 0), (0, 1, 0)}
+
+    # saved to a different file
+    assert changes.begin_save(tmp_path / "other.zarr") is None
+
+
+def test_region_changes_undo(label_layer):
+    changes = RegionChanges(label_layer, saved_filename="region.zarr")
+    assert not changes.all_dirty
+    label_layer.paint((10, 10, 10), 3)
+    label_layer.paint((90, 120, 50), 3)
+    changes.dirty_chunks = set()
+    label_layer.undo()
+    assert changes.dirty_chunks == {(1, 1, 0)}
+    label_layer.undo()
+    label_layer.redo()
+    assert changes.dirty_chunks == {(0, 0, 0), (1, 1, 0)}
+    assert not changes.all_dirty
+
+    # refreshing the view doesn't change the data
+    label_layer.refresh()
+    assert not changes.all_dirty
+
+    label_layer.data = np.zeros(SHAPE, dtype=np.uint16)
+    assert changes.all_dirty
+
+
+def test_save_region_changes(label_layer, tmp_path):
+    filename = tmp_path / "region.zarr"
+    changes = RegionChanges(label_layer)
+    region_IO.save_label_layers(
+        tmp_path, [label_layer], region_changes=[changes]
+    )
+    np.testing.assert_array_equal(
+        load_regions_from_file(filename)[:], label_layer.data
+    )
+
+    # unchanged layers aren't saved
+    mark_saved_chunk(filename)
+    region_IO.save_label_layers(
+        tmp_path, [label_layer], region_changes=[changes]
+    )
+    assert load_regions_from_file(filename)[99, 129, 69] == 123
+
+    # only the changed chunks are saved
+    label_layer.paint((70, 70, 30), 3)
+    label_layer.paint((15, 75, 10), 0)
+    region_IO.save_label_layers(
+        tmp_path, [label_layer], region_changes=[changes]
+    )
+    saved = load_regions_from_file(filename)[:]
+    assert saved[99, 129, 69] == 123
+    saved[99, 129, 69] = 0
+    np.testing.assert_array_equal(saved, label_layer.data)
+
+    # anything else is saved in full
+    label_layer.data = label_layer.data.copy()
+    region_IO.save_label_layers(
+        tmp_path, [label_layer], region_changes=[changes]
+    )
+    np.testing.assert_array_equal(
+        load_regions_from_file(filename)[:], label_layer.data
+    )
+
+
+def test_save_loaded_region_changes(label_layer, tmp_path):
+    filename = tmp_path / "region.zarr"
+    region_IO.save_regions_to_file(label_layer, tmp_path)
+    mark_saved_chunk(filename)
+
+    loaded = Labels(load_regions_from_file(filename), name="region")
+    changes = RegionChanges.from_layer(loaded, filename)
+    assert not changes.all_dirty
+    assert RegionChanges.from_layer(loaded, tmp_path / "other.zarr").all_dirty
+
+    # loading into memory to edit isn't a change
+    loaded.data = np.asarray(loaded.data)
+    assert not changes.all_dirty
+    loaded.n_edit_dimensions = 3
+    loaded.paint((50, 50, 50), 5)
+    region_IO.save_regions_to_file(loaded, tmp_path, changes=changes)
+    saved = load_regions_from_file(filename)
+    assert saved[50, 50, 50] == 5
+    assert saved[99, 129, 69] == 123
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from brainglobe_segmentation.atlas.utils import AnnotationIndex
+
+
+def load_toy_project(widget, atlas, atlas_space):
+    widget.atlas_space = atlas_space
+    widget.atlas = atlas
+    widget.annotations_layer = SimpleNamespace(data=atlas.annotation)
+    widget.hemispheres_data = atlas.hemispheres
+    widget.atlas_cache = None
+    widget.reset_atlas_indices()
+
+
+def test_atlas_indices_sample_space(segmentation_widget, toy_atlas):
+    load_toy_project(segmentation_widget, toy_atlas, atlas_space=False)
+    annotation_future, hemisphere_future = (
+        segmentation_widget.get_atlas_index_futures()
+    )
+    # the images are used directly, rather than building an index
+    assert annotation_future.done() and hemisphere_future.done()
+    assert annotation_future.result() is toy_atlas.annotation
+    assert hemisphere_future.result() is toy_atlas.hemispheres
+
+
+def test_atlas_indices_built_on_first_use(segmentation_widget, toy_atlas):
+    load_toy_project(segmentation_widget, toy_atlas, atlas_space=True)
+    assert not segmentation_widget.prebuild_indices
+    # nothing is built when a project is loaded
+    assert segmentation_widget.annotation_index_future is None
+    assert segmentation_widget.hemisphere_index_future is None
+
+    futures = segmentation_widget.get_atlas_index_futures()
+    annotation_index = segmentation_widget.annotation_index
+    assert isinstance(annotation_index, AnnotationIndex)
+    np.testing.assert_array_equal(
+        annotation_index.structure_ids[annotation_index.compact],
+        toy_atlas.annotation,
+    )
+    # built once, and reused
+    assert segmentation_widget.get_atlas_index_futures() == futures
+
+    segmentation_widget.reset_atlas_indices()
+    assert segmentation_widget.annotation_index_future is None
@@ -1,7 +1,15 @@
+from concurrent.futures import Future
+from types import SimpleNamespace
+
 import numpy as np
 from napari.layers import Labels
 
+from brainglobe_segmentation.atlas.utils import (
+    index_annotations,
+    index_hemispheres,
+)
 from brainglobe_segmentation.segmentation_panels.regions import (
+    RegionSeg,
     check_segmentation_in_correct_space,
 )
 
@@ -15,3 +23,36 @@ def test_check_segmentation_in_correct_space():
     assert not check_segmentation_in_correct_space(
         [labels_layer_10], labels_layer_15.data
     )
+
+
+def test_track_live_volumes_waits_for_atlas_indices(qtbot, toy_atlas):
+    annotation_index_future = Future()
+    hemisphere_index_future = Future()
+    label_layer = Labels(np.zeros(toy_atlas.annotation.shape, dtype=np.uint16))
+    parent = SimpleNamespace(
+        atlas=toy_atlas,
+        label_layers=[label_layer],
+        annotation_index_future=annotation_index_future,
+        hemisphere_index_future=hemisphere_index_future,
+        get_atlas_index_futures=lambda: (
+            annotation_index_future,
+            hemisphere_index_future,
+        ),
+    )
+    region_seg = RegionSeg(parent)
+    qtbot.addWidget(region_seg)
+
+    # doesn't wait on the main thread for the indices to be built
+    region_seg.track_live_volumes(label_layer)
+    assert region_seg.live_volumes == []
+
+    annotation_index_future.set_result(index_annotations(toy_atlas.annotation))
+    hemisphere_index_future.set_result(
+        index_hemispheres(toy_atlas.hemispheres)
+    )
+    qtbot.waitUntil(lambda: len(region_seg.live_volumes) == 1)
+    assert region_seg.live_volumes[0].label_layer is label_layer
+    assert (
+        region_seg.live_volumes[0].annotations
+        is annotation_index_future.result()
+    )
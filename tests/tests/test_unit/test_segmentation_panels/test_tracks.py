@@ -0,0 +1,80 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+from napari.layers import Points
+
+from brainglobe_segmentation.segmentation_panels import tracks
+from brainglobe_segmentation.segmentation_panels.tracks import TrackSeg
+
+
+def test_add_surface_points(qtbot):
+    annotation = np.zeros((10, 12, 14), dtype=np.uint32)
+    annotation[2:8, 3:9, 4:12] = 5
+    annotation[4:6, 3:5, 4:6] = 0
+    track_points = [
+        [[5, 6, 8], [6, 6, 8]],
+        [[3.4, 8.2, 11.1]],
+        [[5, 4.6, 4.4]],
+    ]
+    track_layers = [Points(points) for points in track_points]
+    empty_layer = Points(np.empty((0, 3)))
+    parent = SimpleNamespace(
+        annotations_layer=SimpleNamespace(data=annotation),
+        atlas_cache=None,
+        track_layers=track_layers + [empty_layer],
+    )
+    track_seg = TrackSeg(parent)
+    qtbot.addWidget(track_seg)
+
+    track_seg.prebuild_brain_surface_tree()
+    track_seg.add_surface_points()
+
+    background = np.argwhere(annotation == 0)
+    for track_layer, points in zip(track_layers, track_points):
+        distances = np.linalg.norm(background - points[0], axis=1)
+        assert len(track_layer.data) == len(points) + 1
+        np.testing.assert_allclose(track_layer.data[1:], points)
+        np.testing.assert_allclose(
+            np.linalg.norm(track_layer.data[0] - points[0]), distances.min()
+        )
+    assert len(empty_layer.data) == 0
+
+
+def test_prebuild_brain_surface_tree_supersedes(qtbot, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    get_surface_points = tracks.get_surface_points
+
+    def slow_get_surface_points(annotations, cache=None):
+        started.set()
+        release.wait()
+        return get_surface_points(annotations, cache=cache)
+
+    monkeypatch.setattr(tracks, "get_surface_points", slow_get_surface_points)
+    annotation = np.zeros((6, 6, 6), dtype=np.uint32)
+    annotation[1:5, 1:5, 1:5] = 5
+    parent = SimpleNamespace(
+        annotations_layer=SimpleNamespace(data=annotation),
+        atlas_cache=None,
+    )
+    track_seg = TrackSeg(parent)
+    qtbot.addWidget(track_seg)
+
+    track_seg.prebuild_brain_surface_tree()
+    started.wait()
+    running_future = track_seg.tree_future
+    track_seg.prebuild_brain_surface_tree()
+    queued_future = track_seg.tree_future
+    track_seg.prebuild_brain_surface_tree()
+
+    # the queued build is cancelled, and the running build stops early
+    assert queued_future.cancelled()
+    release.set()
+    assert running_future.result() is None
+    track_seg.create_brain_surface_tree()
+    assert len(track_seg.tree.data) > 0
+
+    track_seg.release_resources()
+    assert track_seg.tree_future is None
+    assert track_seg.tree_executor._shutdown
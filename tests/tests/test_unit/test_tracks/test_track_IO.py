@@ -36,6 +36,47 @@ def test_save_single_track_layer(tmp_path, rtol=1e-10):
     np.testing.assert_allclose(points, points_test, rtol=rtol)
 
 
+def test_track_store(tmp_path):
+    store_path = tmp_path / "tracks.npz"
+    assert IO.load_track_store(store_path) == {}
+
+    tracks = {
+        "track_0": np.array([[1.0, 2, 3], [4, 5, 6]]),
+        "empty": np.zeros((0, 3)),
+        "track_1": np.array([[7.0, 8, 9]]),
+    }
+    IO.save_track_store(store_path, tracks)
+    loaded = IO.load_track_store(store_path)
+    assert list(loaded) == list(tracks)
+    for name, points in tracks.items():
+        np.testing.assert_array_equal(loaded[name], points)
+
+    # upsert by track name
+    IO.update_track_store(
+        store_path,
+        {"track_1": np.array([[0.0, 0, 0], [1, 1, 1]]), "new": spline},
+    )
+    loaded = IO.load_track_store(store_path)
+    assert list(loaded) == ["track_0", "empty", "track_1", "new"]
+    np.testing.assert_array_equal(loaded["track_0"], tracks["track_0"])
+    np.testing.assert_array_equal(loaded["track_1"], [[0, 0, 0], [1, 1, 1]])
+    np.testing.assert_array_equal(loaded["new"], spline)
+
+
+def test_load_tracks_legacy(tmp_path):
+    points = pd.read_hdf(tracks_dir / "track.points")
+    IO.save_single_track(points, "legacy", tmp_path)
+    IO.save_single_track(points, "both", tmp_path)
+    IO.save_track_store(
+        tmp_path / "tracks.npz", {"both": spline, "stored": spline[:2]}
+    )
+
+    tracks = IO.load_tracks(tmp_path)
+    assert list(tracks) == ["both", "stored", "legacy"]
+    np.testing.assert_array_equal(tracks["both"], spline)
+    np.testing.assert_allclose(tracks["legacy"], points)
+
+
 def test_export_single_spline(tmp_path):
     IO.export_single_spline(spline, "track", tmp_path, ATLAS_RESOLUTION)
 
@@ -43,3 +84,12 @@ def test_export_single_spline(tmp_path):
     spline_validate = np.load(str(tracks_dir / "track.npy"))
 
     assert (spline_test == spline_validate).all()
+
+
+def test_export_splines_anisotropic(tmp_path):
+    resolution = (10, 20, 50)
+    IO.export_splines(tmp_path, [spline], ["track"], resolution)
+    np.testing.assert_allclose(
+        np.load(str(tmp_path / "track.npy")),
+        spline * np.array(resolution),
+    )
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import numpy as np
+from napari.layers import Points
+
+from brainglobe_segmentation.parallel import SharedArrayStore
+from brainglobe_segmentation.tracks.analysis import track_analysis_worker
+
+
+def run_track_analysis_worker(*args, **kwargs):
+    worker = track_analysis_worker(*args, **kwargs)
+    yielded, returned, errors = [], [], []
+    worker.yielded.connect(yielded.append)
+    worker.returned.connect(returned.append)
+    worker.errored.connect(errors.append)
+    worker.run()
+    if errors:
+        raise errors[0]
+    return yielded, returned[0]
+
+
+def test_track_analysis_reuses_shared_annotations(tmp_path, toy_atlas):
+    atlas = SimpleNamespace(
+        structures={
+            value: {"id": value, "acronym": f"s{value}", **structure}
+            for value, structure in toy_atlas.structures.items()
+        },
+        resolution=toy_atlas.resolution,
+    )
+    track_layers = [
+        Points(
+            np.array([[0, 0, 0], [1, 2, 3], [2, 3, 5], [3, 5, 7]]),
+            name="track_0",
+        ),
+        Points(
+            np.array([[3, 0, 7], [2, 1, 5], [1, 3, 3], [0, 5, 1]]),
+            name="track_1",
+        ),
+    ]
+    serial_directory = tmp_path / "serial"
+    _, (serial_splines, _) = run_track_analysis_worker(
+        toy_atlas.annotation, atlas, serial_directory, track_layers
+    )
+
+    store = SharedArrayStore()
+    try:
+        for run in range(2):
+            directory = tmp_path / f"parallel_{run}"
+            yielded, (splines, names) = run_track_analysis_worker(
+                toy_atlas.annotation,
+                atlas,
+                directory,
+                track_layers,
+                n_processes=2,
+                shared_store=store,
+            )
+            assert names == ["track_0", "track_1"]
+            assert sorted(index for index, _, _ in yielded) == [0, 1]
+            for spline, serial_spline in zip(splines, serial_splines):
+                np.testing.assert_allclose(spline, serial_spline)
+            for file in serial_directory.iterdir():
+                assert (directory / file.name).read_text() == (
+                    file.read_text()
+                )
+            # the annotations are copied to shared memory once, not per run
+            assert len(store.shared) == 1
+    finally:
+        store.release()
+    assert len(store.shared) == 0
@@ -1,11 +1,18 @@
+from types import SimpleNamespace
+
 import numpy as np
 import pytest
 from pandas import read_csv
+from scipy.interpolate import splev, splprep
 
 from brainglobe_segmentation.tracks.analysis import (
     analyse_track_anatomy,
+    analyse_track_crossings,
+    get_distances,
+    get_region_segments,
     spline_fit,
 )
+from brainglobe_segmentation.tracks.fit import fit_tracks, line_fit
 
 
 @pytest.fixture
@@ -71,6 +78,104 @@ def test_fit(pts_2d, pts_3d, fit_2d, fit_3d, rtol=1e-5):
     )
 
 
+def test_fit_fixed_step(pts_3d):
+    resolution = (25, 10, 5)
+    step = 20
+    fit = spline_fit(pts_3d, n_points=10, step=step, resolution=resolution)
+    distances = np.linalg.norm(np.diff(fit, axis=0) * resolution, axis=1)
+    # the path is curved, so each straight line is (slightly) shorter
+    assert np.all(distances <= step + 1e-6)
+    np.testing.assert_allclose(distances[:-1], step, rtol=0.01)
+    # both ends of the spline are included
+    full_fit = spline_fit(pts_3d, n_points=10)
+    np.testing.assert_allclose(fit[0], full_fit[0])
+    np.testing.assert_allclose(fit[-1], full_fit[-1])
+
+    path_length = get_distances(
+        spline_fit(pts_3d, n_points=10000), voxel_size=resolution
+    )[-1]
+    assert len(fit) == int(np.ceil(path_length / step)) + 1
+
+
+def test_fit_fixed_step_includes_tip():
+    points = np.array([[0, 0, 0], [10, 0, 0], [20, 0, 0], [30, 0, 0.0]])
+    tck, _ = splprep(points.T, s=0, k=3)
+    fit = spline_fit(points, smoothing=0, step=25, resolution=1)
+    np.testing.assert_allclose(fit[-1], np.array(splev(1, tck)))
+    np.testing.assert_allclose(fit[:, 0], [0, 25, 30], atol=1e-3)
+
+    # a step that divides the length doesn't repeat the tip
+    fit = spline_fit(points, smoothing=0, step=10, resolution=1)
+    np.testing.assert_allclose(fit[:, 0], [0, 10, 20, 30], atol=1e-3)
+
+
+def test_line_fit(pts_3d):
+    rng = np.random.default_rng(0)
+    direction = np.array([1, 2, -0.5]) / np.linalg.norm([1, 2, -0.5])
+    straight = [10, 20, 30] + np.sort(rng.uniform(0, 50, 8))[
+        :, np.newaxis
+    ] * np.array(direction)
+    tracks = [straight, pts_3d, straight[::-1]]
+
+    lines, residuals = line_fit(tracks, n_points=5)
+    np.testing.assert_allclose(residuals[[0, 2]], 0, atol=1e-10)
+    assert residuals[1] > 1
+    np.testing.assert_allclose(lines[0][[0, -1]], straight[[0, -1]])
+    np.testing.assert_allclose(lines[2], lines[0][::-1])
+    assert [len(line) for line in lines] == [5, 5, 5]
+    # the line through the curved points is still ordered first to last
+    assert np.dot(lines[1][-1] - lines[1][0], pts_3d[-1] - pts_3d[0]) > 0
+
+    resolution = (25, 10, 5)
+    lines, _ = line_fit(tracks, step=20, resolution=resolution)
+    full_lines, _ = line_fit(tracks, n_points=2, resolution=resolution)
+    for line, full_line in zip(lines, full_lines):
+        distances = np.linalg.norm(np.diff(line, axis=0) * resolution, axis=1)
+        np.testing.assert_allclose(distances[:-1], 20)
+        assert 0 < distances[-1] <= 20
+        # each line ends at the far projected point of its track
+        np.testing.assert_allclose(line[[0, -1]], full_line)
+    length = np.linalg.norm((straight[-1] - straight[0]) * resolution)
+    assert len(lines[0]) == int(np.floor(length / 20)) + 2
+    np.testing.assert_allclose(lines[0][-1], straight[-1])
+
+
+def test_line_fit_step_on_end():
+    track = np.linspace([0, 0, 0], [0, 0, 30], 4)
+    (line,), _ = line_fit([track], step=10)
+    np.testing.assert_allclose(line, track, atol=1e-10)
+    (line,), _ = line_fit([track[:1]], step=10)
+    np.testing.assert_allclose(line, track[:1])
+
+
+def test_fit_tracks(pts_3d, fit_3d):
+    straight = np.linspace([0, 0, 0], [10, 20, 30], 6)
+    fits = fit_tracks([straight, pts_3d], n_points=10)
+    np.testing.assert_allclose(fits[1], fit_3d, rtol=1e-5)
+
+    fits = fit_tracks([straight, pts_3d], n_points=10, straight_tolerance=1)
+    np.testing.assert_allclose(
+        fits[0],
+        np.linspace(straight[0], straight[-1], 10),
+        atol=1e-10,
+    )
+    np.testing.assert_allclose(fits[1], fit_3d, rtol=1e-5)
+
+    fits = fit_tracks([straight, pts_3d], n_points=10, straight=True)
+    np.testing.assert_allclose(fits[1], line_fit([pts_3d], n_points=10)[0][0])
+
+
+def test_get_distances():
+    spline = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [1, 1, 2.0000001]])
+    np.testing.assert_allclose(
+        get_distances(spline, voxel_size=10), [0, 10, 20, 40]
+    )
+    np.testing.assert_allclose(
+        get_distances(spline, voxel_size=(50, 10, 5)), [0, 50, 60, 70]
+    )
+    np.testing.assert_allclose(get_distances(spline[:1], voxel_size=10), [0])
+
+
 def test_analyse_track_anatomy(fit_3d, allen_mouse_50um_atlas, tmp_path):
     atlas = allen_mouse_50um_atlas
     output_file = tmp_path / "2d_analysis.csv"
@@ -81,3 +186,104 @@ def test_analyse_track_anatomy(fit_3d, allen_mouse_50um_atlas, tmp_path):
     assert df["Region name"][4] == "cerebal peduncle"
     assert df["Region name"][5] == "root"
     assert df["Region name"][6] == "Not found in brain"
+
+
+def test_analyse_track_anatomy_out_of_volume(tmp_path):
+    annotation = np.zeros((4, 5, 6), dtype=np.uint32)
+    annotation[1:, 1:, 1:] = 614454277
+    annotation[2, 2, 2] = 7
+    atlas = SimpleNamespace(
+        structures={
+            614454277: {"id": 614454277, "acronym": "ST", "name": "struct"},
+            7: {"id": 7, "acronym": "S7", "name": "seven"},
+        },
+        resolution=(10, 10, 10),
+    )
+    spline = np.array(
+        [
+            [2.5, 2.2, 2.9],
+            [1.5, 3.0, 4.0],
+            [0.5, 0.5, 0.5],
+            [3.9, 4.9, 6.1],
+            [-1.5, 2.0, 2.0],
+        ]
+    )
+    output_file = tmp_path / "track.csv"
+    segments_file = tmp_path / "track_segments.csv"
+    analyse_track_anatomy(
+        annotation,
+        atlas,
+        spline,
+        output_file,
+        segments_file_path=segments_file,
+    )
+
+    df = read_csv(output_file)
+    assert list(df["Index"]) == [0, 1, 2, 3, 4]
+    assert list(df["Region name"]) == [
+        "seven",
+        "struct",
+        "Not found in brain",
+        "Not found in brain",
+        "Not found in brain",
+    ]
+    assert list(df["Region acronym"][:2]) == ["S7", "ST"]
+    assert list(df["Region ID"][:2]) == ["7", "614454277"]
+    assert df["Distance from first position [um]"][1] == pytest.approx(
+        round(np.linalg.norm(spline[1] - spline[0]) * 10, 3)
+    )
+
+    segments = read_csv(segments_file)
+    distances = df["Distance from first position [um]"]
+    assert list(segments["Region name"]) == [
+        "seven",
+        "struct",
+        "Not found in brain",
+    ]
+    np.testing.assert_allclose(
+        segments["Start distance [um]"], distances[[0, 1, 2]]
+    )
+    np.testing.assert_allclose(
+        segments["End distance [um]"], distances[[1, 2, 4]]
+    )
+    np.testing.assert_allclose(
+        segments["Length [um]"],
+        segments["End distance [um]"] - segments["Start distance [um]"],
+        atol=1e-3,
+    )
+
+
+def test_get_region_segments():
+    atlas_values, starts, ends = get_region_segments(
+        np.array([3, 3, 0, 7, 7, 7, 3], dtype=np.uint32),
+        np.arange(7) * 10,
+        np.arange(1, 8) * 10,
+    )
+    np.testing.assert_array_equal(atlas_values, [3, 0, 7, 3])
+    np.testing.assert_array_equal(starts, [0, 20, 30, 60])
+    np.testing.assert_array_equal(ends, [20, 30, 60, 70])
+
+
+def test_analyse_track_crossings(toy_atlas, tmp_path):
+    # straight along the first axis, in structure 7 (planes 0 and 1), then
+    # 10 (planes 2, 3), then out of the image
+    spline = np.array([[0.5, 1.5, 3.5], [2.0, 1.5, 3.5], [5.5, 1.5, 3.5]])
+    atlas = SimpleNamespace(
+        structures={
+            atlas_value: {"id": atlas_value, "acronym": "S", **structure}
+            for atlas_value, structure in toy_atlas.structures.items()
+        },
+        resolution=toy_atlas.resolution,
+    )
+    output_file = tmp_path / "track_crossings.csv"
+    analyse_track_crossings(toy_atlas.annotation, atlas, spline, output_file)
+
+    df = read_csv(output_file)
+    assert list(df["Region name"]) == [
+        "structure_7",
+        "structure_10",
+        "Not found in brain",
+    ]
+    np.testing.assert_allclose(df["Start distance [um]"], [0, 150, 350])
+    np.testing.assert_allclose(df["End distance [um]"], [150, 350, 500])
+    np.testing.assert_allclose(df["Length [um]"], [150, 200, 150])
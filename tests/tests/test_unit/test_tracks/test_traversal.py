@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from brainglobe_segmentation.tracks.traversal import traverse_voxels
+
+
+def sample_voxels(points, n_samples=100001):
+    """Voxels along a path, by (very) dense sampling"""
+    positions = np.linspace(0, len(points) - 1, n_samples)
+    segments = np.minimum(positions.astype(int), len(points) - 2)
+    fractions = (positions - segments)[:, np.newaxis]
+    samples = points[segments] + fractions * (
+        points[segments + 1] - points[segments]
+    )
+    voxels = np.floor(samples).astype(int)
+    changed = np.any(voxels[1:] != voxels[:-1], axis=1)
+    return voxels[np.concatenate(([True], changed))]
+
+
+def test_traverse_voxels_straight_line():
+    points = np.array([[0.5, 0.5, 0.5], [3.5, 0.5, 0.5]])
+    voxels, entry_distances, exit_distances = traverse_voxels(
+        points, resolution=10
+    )
+    np.testing.assert_array_equal(voxels, [[i, 0, 0] for i in range(4)])
+    np.testing.assert_allclose(entry_distances, [0, 5, 15, 25])
+    np.testing.assert_allclose(exit_distances, [5, 15, 25, 30])
+
+
+def test_traverse_voxels_reversed():
+    points = np.array([[3.5, 0.5, 0.5], [0.5, 0.5, 0.5]])
+    voxels, _, exit_distances = traverse_voxels(points)
+    np.testing.assert_array_equal(voxels, [[i, 0, 0] for i in (3, 2, 1, 0)])
+    np.testing.assert_allclose(exit_distances, [0.5, 1.5, 2.5, 3])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_traverse_voxels_matches_sampling(seed):
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(-2, 6, (6, 3))
+    resolution = (25, 10, 5)
+    voxels, entry_distances, exit_distances = traverse_voxels(
+        points, resolution=resolution
+    )
+
+    np.testing.assert_array_equal(voxels, sample_voxels(points))
+    # the voxels cover the whole path, without gaps or overlaps
+    assert entry_distances[0] == 0
+    np.testing.assert_allclose(entry_distances[1:], exit_distances[:-1])
+    assert np.all(exit_distances > entry_distances)
+    assert exit_distances[-1] == pytest.approx(
+        np.linalg.norm(np.diff(points, axis=0) * resolution, axis=1).sum()
+    )
+
+
+def test_traverse_voxels_single_point():
+    voxels, entry_distances, exit_distances = traverse_voxels([[1.5, 2, 3]])
+    np.testing.assert_array_equal(voxels, [[1, 2, 3]])
+    np.testing.assert_array_equal(entry_distances, [0])
+    np.testing.assert_array_equal(exit_distances, [0])